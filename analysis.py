@@ -11,7 +11,8 @@ Description: This program is the main file of the pands-project repository, orch
         - Open the log file in append mode, so that previous data doesn't get overriden.
         - Format of the error messages with the time it occured, error level and error message.
 
-    II. Wrap code in a try-except statement to handle errors in case arguments are not provided in the cmd line or any other error occurs.
+    II. Wrap code in a try-except statement to handle errors in case any error occurs, exiting with code 1. 
+        Missing or invalid cmd line arguments are reported by argparse itself, which exits with code 2.
 
     III. Initialise the ArgumentParser object, which allows for cmd line arguments to be defined.
         Customise the parser by:
@@ -22,25 +23,52 @@ Description: This program is the main file of the pands-project repository, orch
 
         Define optional arguments for the filename with the following params:
             (1) Set long and short form flags;
-            (2) Set required to True as the program isn't meant to run without a name being provided in the cmd line, 
+            (2) Leave required as False, as the username is only needed by the GUI - the program checks it's provided when no 
+                batch command is given;
             (3) Set metavar to empty to clean up the -h message by not showing the uppercase dest values (USERNAME);
             (4) Set the helper with a brief description of what the argument does.
 
+        Define an optional positional argument with the batch command, which runs the analyses without the tkinter GUI so that the 
+        program can be used on headless servers or in cron jobs, and a --data flag choosing between the original and cleaned dataset.
+
     IV. Specify tkinter opening menu function parameters:
             (1) usarname is taken from the cmd line argument
             (2) df is the Iris dataset returned by the get_dataset() function in the tools module
-            (3) df_cleaned is the .csv Iris dataset returned by the outliers_cleanup() function in the tools module
-                - First, we create contains for the folder and file name;
-                - Secondly, to avoid using a hardcoded absolute path which would throw an error when running on different machines,
-                we construct the full file path using the os module.
-                - Finally, the data is loaded into a DataFrame using pandas' read_csv(), passing the file path as a param.
+            (3) df_cleaned is the Iris dataset without outliers, i.e. the rows kept by the outliers_cleanup() function in the tools 
+                module. Rather than a second copy of the dataset, it's a MaskedFrame from the core module: df and a boolean mask of 
+                the rows without outliers, which are only copied when an analysis runs on them. The mask itself is only computed 
+                when a cleaned option is first chosen, and is cached with the fingerprint of df so that it's never stale.
+            (4) --dataset, --source, --label & --numeric describe the dataset analysed with a DatasetSpec from the core module, 
+                which is given to every analysis; the Iris dataset with its species & 4 measurements by default.
+            (5) df is stored compactly, with species as a Categorical and the measurements as float32 (see compact() in core.py).
 
     V. Call the opening_menu() function from the menu module, passing in the above parameters.
+       If a batch command was given instead, switch matplotlib to the non-interactive Agg backend, draw the figures on the Agg canvas
+       without pyplot (see the figures module) and call run_batch(), which calls 
+       the tools functions with interactive=False so that no message box is shown. The "all" command runs every analysis on both 
+       the original and the cleaned dataset with run_all() from the pipeline module, on a pool of --workers processes. 
+       The pca command fits the PCA with the --pca-engine solver, in single precision with --float32, and saves the fitted model.
+       The plots are saved at --dpi dots per inch.
+       The pairplot command is drawn in --pairplot-mode (with sampling & density panels in the fast mode) for the --variables given.
+       Progress messages go through the instrument module: -v adds the duration of each stage, -q only shows warnings, 
+       --log-json appends a JSON record per stage to a file and --profile saves a cProfile dump of the run.
+       The results are saved under the --output-dir (the working directory by default), in a subdirectory of results/ per run
+       with --run-id, and every file is written to a temporary file first and renamed, so that concurrent runs are safe.
+       The report command saves every analysis of the --data dataset in a single report, as text, JSON and a single-file HTML 
+       page with the plots embedded (--report-format), so that other programs can read the results without parsing text.
+       The serve command keeps the datasets in memory and answers the analyses as JSON or PNG over HTTP on --host & --port, 
+       with a pool of --workers threads (2 by default) and --queue-size queued requests (see the service module).
+       The project command loads that model and projects the new observations of the --input CSV file without fitting again.
+       The summary command can also stream a CSV file given with --input in chunks of --chunksize rows, for datasets that don't fit in memory. The program exits with code 0 if the command 
+       succeeded and 1 otherwise, so that schedulers can detect failures.
+       https://matplotlib.org/stable/users/explain/figure/backends.html
+       https://docs.python.org/3/library/sys.html#sys.exit
 
 References:
     - https://docs.python.org/3/howto/logging.html
     - https://realpython.com/python-logging/
     - https://pandas.pydata.org/pandas-docs/stable/reference/api/pandas.read_csv.html
+    - https://pandas.pydata.org/docs/user_guide/categorical.html
     - https://realpython.com/command-line-interfaces-python-argparse/
     - https://stackoverflow.com/questions/1009860/how-can-i-read-and-process-parse-command-line-arguments
     - https://docs.python.org/3/library/argparse.html
@@ -48,50 +76,235 @@ References:
 '''
 
 import argparse
-import os
-import pandas as pd
+import functools
+import sys
 import tools
-import menu
+import core
+import pipeline
+import helpers
+import figures
+import report
+import instrument
 import logging
 
 # I.
 # Set up logging configuration
 logging.basicConfig(level=logging.ERROR, filename='error.log', filemode='a',
                     format='%(asctime)s - %(levelname)s - %(message)s')
-# II. 
-try:
-    # III. 
-    # Create an ArgumentParser object to handle cmd line arguments
-    parser = argparse.ArgumentParser(
-        prog="analysis.py",
-        description="Petalist is a program that runs an analysis on Fisher's Iris dataset.",
-        epilog="Thanks for using %(prog)s!")
-    
-    # Define a required cmd line argument for the username
-    parser.add_argument("-u", "--username", 
-                        metavar="", 
-                        required=True, 
-                        help='Please enter your name.')
-    
-    # Parse the cmd line arguments
-    args = parser.parse_args()
-
-    # IV. 
-    # Declare variables that contain the opening_menu() parameters
-    username = args.username                                # Assign the username provided in the cmd line
-    df = tools.get_dataset()                                # Load the dataset using a function from the tools module
-    
-    folder = 'results'                                      # Specify the folder and filename for the cleaned dataset
-    file_name = 'II.dataframe_cleaned.csv'
-    file_path = os.path.join(os.getcwd(),folder,file_name)  # Construct the full file path
-    df_cleaned = pd.read_csv(file_path)                     # Read in the cleaned dataset into a pandas DataFrame
-
-    # V.
-    # Call the opening menu function from the menu module, passing in the username and DataFrames as parameters
-    menu.opening_menu(username, df, df_cleaned)
-
-except:
-    # If an exception occurs, log the error before printing the help message
-    logging.error("An error occurred", exc_info=True)
-    # Print the help message, including the program usage and information about the arguments
-    parser.print_help()
+
+# Batch commands available in the cmd line & the order in which they run
+BATCH_COMMANDS = ['summary', 'outliers', 'clean', 'histograms', 'pairplot', 'pca']
+
+def cleaned_dataset(df, spec=None):
+    '''
+    This function returns the dataset without outliers as a MaskedFrame over df. Its mask is only computed (or loaded from 
+    its fingerprinted cache) by cleaned_mask() in the tools module the first time an analysis of the cleaned dataset needs it, 
+    so the startup doesn't wait for the outlier detection nor depend on a file saved by a previous run.
+    '''
+
+    return core.MaskedFrame(df, loader=functools.partial(tools.cleaned_mask, spec=spec))
+
+def run_batch(command, data, df, df_cleaned, use_cache=True, params=None, spec=None):
+    '''
+    This function runs one of the analyses without the GUI, on the original or the cleaned dataset, with run_task() from the 
+    pipeline module. The same file names as in the GUI are used, so that the results directory looks the same regardless of 
+    how it was produced, and the results cache is checked first unless use_cache is False.
+    The params dict maps an analysis to its keyword arguments, e.g. {'pca': {'engine': 'incremental'}}.
+    '''
+
+    # The text summaries and the cleanup always use the original dataset, the plots use the one chosen with --data
+    if command in ['summary', 'outliers', 'clean']:
+        data = 'original'
+    df_chosen = df_cleaned if data == 'cleaned' else df
+
+    return pipeline.run_task(command, data, df_chosen, use_cache, (params or {}).get(command), spec)
+
+def main():
+    # II. 
+    try:
+        # III. 
+        # Create an ArgumentParser object to handle cmd line arguments
+        parser = argparse.ArgumentParser(
+            prog="analysis.py",
+            description="Petalist is a program that runs an analysis on Fisher's Iris dataset.",
+            epilog="Thanks for using %(prog)s!")
+        
+        # Define a cmd line argument for the username, required to open the GUI
+        parser.add_argument("-u", "--username", 
+                            metavar="", 
+                            required=False, 
+                            help='Please enter your name.')
+        
+        # Define an optional batch command, which runs the analyses without the GUI
+        parser.add_argument("command", 
+                            nargs="?", 
+                            choices=BATCH_COMMANDS + ['all', 'project', 'report', 'serve'], 
+                            help='Run an analysis in batch mode, without the GUI. '
+                                 '"all" runs every analysis on both datasets in parallel. '
+                                 '"project" projects the new observations of --input onto the saved PCA model. '
+                                 '"report" saves every analysis of --data in a txt, JSON & HTML report. '
+                                 '"serve" answers the analyses over HTTP, keeping the datasets in memory.')
+        parser.add_argument("-d", "--data", 
+                            choices=['original', 'cleaned'], 
+                            default='original', 
+                            help='Dataset used by the plots in batch mode (default: original).')
+        parser.add_argument("-i", "--input", 
+                            metavar="", 
+                            help='CSV file summarised in chunks by the summary command, for datasets that don\'t fit in memory, '
+                                 'or with the new observations to project with the project command.')
+        parser.add_argument("--chunksize", 
+                            type=int, 
+                            default=100_000, 
+                            help='Number of rows read at a time with --input (default: 100000).')
+        parser.add_argument("--no-cache", 
+                            action="store_true", 
+                            help='Compute the results again even if they are up to date in the results directory.')
+        parser.add_argument("-w", "--workers", 
+                            type=int, 
+                            default=None, 
+                            help='Number of worker processes used by "all" (default: number of cores).')
+        parser.add_argument("--pca-engine", 
+                            choices=['full', 'randomized', 'incremental'], 
+                            default='full', 
+                            help='PCA solver: exact SVD, randomized SVD or incremental in batches (default: full).')
+        parser.add_argument("--pairplot-mode", 
+                            choices=['auto', 'reg', 'fast'], 
+                            default='auto', 
+                            help='Pair plot with bootstrapped regressions (reg), or sampled points, density panels & least squares '
+                                 'lines (fast). auto uses fast above 5000 rows (default: auto).')
+        parser.add_argument("--variables", 
+                            nargs="+", 
+                            metavar="", 
+                            help='Subset of variables shown in the pair plot (default: all).')
+        parser.add_argument("--dataset", 
+                            default='iris', 
+                            metavar="", 
+                            help='Name of the dataset analysed, e.g. penguins (default: iris).')
+        parser.add_argument("--source", 
+                            metavar="", 
+                            help='CSV file with the dataset analysed, instead of a dataset by name.')
+        parser.add_argument("--label", 
+                            default='species', 
+                            metavar="", 
+                            help='Column with the class of each row, used to group & colour the analyses (default: species).')
+        parser.add_argument("--numeric", 
+                            nargs="+", 
+                            metavar="", 
+                            help='Numeric columns analysed (default: all the numeric columns).')
+        parser.add_argument("-v", "--verbose", 
+                            action="count", 
+                            default=0, 
+                            help='Also show the duration of each stage (load, compute, render, save).')
+        parser.add_argument("-q", "--quiet", 
+                            action="store_true", 
+                            help='Only show warnings & errors.')
+        parser.add_argument("--log-json", 
+                            metavar="", 
+                            help='Append a JSON record with the duration & rows of each stage to this file.')
+        parser.add_argument("--profile", 
+                            metavar="", 
+                            help='Profile the run with cProfile and save the statistics to this file.')
+        parser.add_argument("--float32", 
+                            action="store_true", 
+                            help='Compute the PCA in single precision, halving its memory.')
+        parser.add_argument("--dpi", 
+                            type=float, 
+                            metavar="", 
+                            help='Resolution of the saved plots in dots per inch (default: 100).')
+        parser.add_argument("--report-format", 
+                            nargs="+", 
+                            choices=list(report.REPORT_FORMATS), 
+                            default=list(report.REPORT_FORMATS), 
+                            help='Formats of the report saved by the report command (default: txt json html).')
+        parser.add_argument("--host", 
+                            default="127.0.0.1", 
+                            metavar="", 
+                            help='Address the serve command listens on (default: 127.0.0.1).')
+        parser.add_argument("--port", 
+                            type=int, 
+                            default=8000, 
+                            metavar="", 
+                            help='Port the serve command listens on (default: 8000, 0 picks a free port).')
+        parser.add_argument("--queue-size", 
+                            type=int, 
+                            default=8, 
+                            metavar="", 
+                            help='Requests the serve command queues once its --workers are busy, before answering 503 (default: 8).')
+        parser.add_argument("-o", "--output-dir", 
+                            metavar="", 
+                            help='Save the results under this directory instead of the working directory (or set PETALIST_OUTPUT_DIR).')
+        parser.add_argument("--run-id", 
+                            metavar="", 
+                            nargs="?", 
+                            const="auto", 
+                            help='Save the results of this run in their own subdirectory of results/, named after the date & time if no name is given.')
+        
+        # Parse the cmd line arguments
+        args = parser.parse_args()
+        instrument.configure(verbosity=0 if args.quiet else 1 + args.verbose, json_file=args.log_json)
+        if args.output_dir is not None or args.run_id is not None:
+            instrument.log.info(f"\tResults are saved to {helpers.configure_output(args.output_dir, args.run_id)}")
+        spec = core.DatasetSpec(args.dataset, args.source, args.label, args.numeric)
+        params = {'pca': {'engine': args.pca_engine, 'dtype': 'float32' if args.float32 else 'float64'},
+                  'pairplot': {'mode': args.pairplot_mode, 'variables': args.variables}}
+        if args.dpi is not None:
+            for analysis in ['histograms', 'pairplot', 'pca']:
+                params.setdefault(analysis, {})['dpi'] = args.dpi
+        if args.command is None and args.username is None:
+            parser.error("the -u/--username argument is required to open the menu")
+
+        # IV. 
+        # Declare variables that contain the opening_menu() parameters
+        username = args.username                                # Assign the username provided in the cmd line
+        df = tools.get_dataset(spec=spec)                       # Load the dataset using a function from the tools module
+        df_cleaned = cleaned_dataset(df, spec)                  # Rows without outliers, masked on first use instead of copied
+
+        # V.
+        # Run the batch command without the GUI & exit with a code telling whether it succeeded
+        if args.command is not None:
+            import matplotlib
+            matplotlib.use('Agg')
+            figures.use_canvas('agg')
+            try:
+                with instrument.profiled(args.profile):
+                    if args.command == 'project':
+                        if args.input is None:
+                            parser.error("the project command requires --input")
+                        df_chosen = df_cleaned if args.data == 'cleaned' else df
+                        tools.project_observations(df_chosen, args.input, pipeline.output_file('pca', args.data), interactive=False, spec=spec)
+                    elif args.command == 'serve':
+                        import service
+                        service.serve(df, df_cleaned, args.host, args.port, args.workers or 2, args.queue_size, params, spec)
+                    elif args.command == 'report':
+                        df_chosen = df_cleaned if args.data == 'cleaned' else df
+                        tools.generate_report(df_chosen, formats=args.report_format, interactive=False, params=params, spec=spec)
+                    elif args.input is not None:
+                        if args.command != 'summary':
+                            parser.error("--input is only supported by the summary & project commands")
+                        tools.descriptive_summary_stream(args.input, chunksize=args.chunksize, interactive=False, spec=spec)
+                    elif args.command == 'all':
+                        pipeline.run_all(df, df_cleaned, workers=args.workers, use_cache=not args.no_cache, params=params, spec=spec)
+                    else:
+                        run_batch(args.command, args.data, df, df_cleaned, use_cache=not args.no_cache, params=params, spec=spec)
+            except Exception:
+                logging.error(f"Batch command '{args.command}' failed", exc_info=True)
+                sys.exit(1)
+            sys.exit(0)
+
+        # Call the opening menu function from the menu module, passing in the username and DataFrames as parameters
+        # The menu module is imported here, as tkinter isn't needed (and may not be installed) to run the batch commands
+        import menu
+        with instrument.profiled(args.profile):
+            menu.opening_menu(username, df, df_cleaned, spec)
+
+    except Exception:
+        # If an exception occurs, log the error before printing the help message
+        # SystemExit isn't caught here, so that the exit codes of the batch mode and argparse reach the shell
+        logging.error("An error occurred", exc_info=True)
+        # Print the help message, including the program usage and information about the arguments
+        parser.print_help()
+        sys.exit(1)
+
+# Only run the program when analysis.py is executed, not when it's imported, e.g. by the worker processes of the pipeline
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+'''
+Name: benchmark.py
+
+Author: Irina Simoes
+
+Description: This file contains a script that benchmarks the startup of the program, so that slow imports creeping back into
+    analysis.py are caught. Each measurement runs in a fresh Python process, as modules already imported would hide the cost.
+    With --suite, it benchmarks every analysis of tools.py on synthetic datasets of increasing size instead (V.).
+
+    I. Import profile: run `python -X importtime -c "import analysis"` and list the slowest imports (cumulative time).
+
+    II. Time to first window: time a process that imports analysis.py, loads the datasets as analysis.py does and creates the
+        tkinter root window. If there is no display (e.g. on a server), the time until the window would be created is reported.
+
+    III. Time to CLI result: time `python analysis.py summary --no-cache`, i.e. a whole batch run that writes a file.
+
+    IV. With --check, the script exits with code 1 if any of the heavy modules is imported at startup, or if a measurement
+        exceeds its budget in STARTUP_BUDGETS, so that it can be run as a regression check.
+
+    V. Analysis suite: generate synthetic Iris-shaped DataFrames of each size in --sizes, with --species species and --columns
+       numeric columns, and run each analysis of tools.py on them in batch mode (no message box), from a temporary directory 
+       so that the results directory of the repository isn't overwritten. The wall time and the peak memory allocated 
+       (traced with tracemalloc in a second run, which NumPy & pandas report their buffers to) are printed for each analysis 
+       & size, so that it's clear where each analysis stops scaling. --no-memory skips the second run. The dataset is loaded
+       with tools.get_dataset() and a DatasetSpec whose source is the synthetic CSV, so that the load includes the spec, 
+       column selection & compaction of a real run, and every analysis is given that spec.
+       --save-baseline writes the measurements to a JSON file; --baseline compares them with such a file and reports every
+       analysis & size whose wall time (or peak memory) grew by more than --threshold (25% by default) and by more than 
+       SUITE_NOISE (so that millisecond jitter on small sizes isn't reported). With --check, the script exits with code 1 if 
+       there is any regression, so that a saved baseline can be tracked across changes.
+
+    VI. Figure check: with --figures, draw & save each plot of tools.py --runs times (100 by default) on the Iris dataset, with 
+        the pyplot canvas of the GUI (or --canvas agg), and check that the figure manager of the figures module has no figure 
+        left open, that pyplot holds no figure and that the memory of the process grew by less than FIGURE_MEMORY_BUDGET 
+        between the first runs and the last one, so that a figure leak across repeated clicks is caught. The process memory is
+        read from /proc on Linux, and the check only counts the open figures where it can't be read.
+
+    Usage: python benchmark.py [--repeat N] [--check]
+           python benchmark.py --suite [--sizes 150 10000 1000000 10000000] [--species 3] [--columns 4] [--no-memory]
+                               [--save-baseline FILE] [--baseline FILE [--threshold 1.25] [--check]]
+           python benchmark.py --figures [--runs 100] [--canvas pyplot] [--check]
+
+References:
+    - https://docs.python.org/3/using/cmdline.html#cmdoption-X
+    - https://docs.python.org/3/library/subprocess.html
+    - https://docs.python.org/3/library/time.html#time.perf_counter
+    - https://docs.python.org/3/library/tracemalloc.html
+    - https://numpy.org/doc/stable/reference/random/generator.html
+'''
+
+import argparse
+import gc
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Modules that must not be imported before the window appears, as they take seconds to import
+HEAVY_MODULES = ['matplotlib.pyplot', 'seaborn', 'sklearn', 'scipy']
+
+# Budgets of each measurement in seconds (median of the repeats), generous enough for a slow laptop
+STARTUP_BUDGETS = {'first_window': 1.5, 'cli_result': 3.0}
+
+# Program run in a fresh process to time the first window, reporting the heavy modules that were imported
+FIRST_WINDOW_SNIPPET = '''
+import sys
+import analysis, tools
+df = tools.get_dataset()
+df_cleaned = analysis.cleaned_dataset(df)
+try:
+    import tkinter as tk
+except ImportError:
+    shown = 'no tkinter'
+else:
+    try:
+        root = tk.Tk()
+        root.update()
+        root.destroy()
+        shown = 'yes'
+    except tk.TclError:
+        shown = 'no display'
+heavy = [name for name in %r if name in sys.modules]
+print(shown + '|' + ','.join(heavy))
+''' % (HEAVY_MODULES,)
+
+# Sizes of the synthetic datasets of the analysis suite, from the size of the Iris dataset to 10 million rows
+SUITE_SIZES = [150, 10_000, 1_000_000, 10_000_000]
+
+# Analyses of the suite, in the order they are run for each size (get_dataset loads the synthetic dataset saved as CSV)
+SUITE_ANALYSES = ['get_dataset', 'descriptive_summary', 'outliers_summary', 'outliers_cleanup',
+                  'generate_histogram', 'generate_pairplot', 'perform_PCA']
+
+# Ratio over the baseline above which a measurement of the suite is a regression, and the growth below which it's ignored
+SUITE_THRESHOLD = 1.25
+SUITE_NOISE = {'seconds': 0.01, 'peak_bytes': 2**20}
+
+
+def import_profile(top=10):
+    '''
+    This function runs -X importtime on `import analysis` and returns the slowest imports as (cumulative seconds, module) tuples.
+    The report is written to stderr, one line per module with the self and cumulative time in microseconds.
+    '''
+
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import analysis'],
+                               capture_output=True, text=True, check=True)
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        rows.append((int(cumulative) / 1e6, module.rstrip()))
+
+    return sorted(rows, reverse=True)[:top]
+
+
+def time_process(args):
+    '''
+    This function runs a command in a fresh process and returns its wall time in seconds and its stdout.
+    '''
+
+    start = time.perf_counter()
+    completed = subprocess.run(args, capture_output=True, text=True, check=True)
+
+    return time.perf_counter() - start, completed.stdout
+
+
+def synthetic_iris(rows, species=3, columns=4, seed=0):
+    '''
+    This function returns an Iris-shaped DataFrame with the given number of rows, species and numeric columns. Each species
+    is a normal cloud with its own means, so that the outliers, histograms & PCA have some structure to find. The first 
+    columns & species take the names of the Iris dataset, the others are numbered.
+    '''
+
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    names = ['sepal_length', 'sepal_width', 'petal_length', 'petal_width'][:columns] + [f'variable_{n}' for n in range(5, columns + 1)]
+    labels = ['setosa', 'versicolor', 'virginica'][:species] + [f'species_{n}' for n in range(4, species + 1)]
+
+    codes = rng.integers(0, species, size=rows)
+    means = rng.uniform(1, 8, size=(species, columns))
+    values = means[codes] + rng.normal(0, 0.4, size=(rows, columns))
+
+    df = pd.DataFrame(values.round(1), columns=names)
+    df['species'] = pd.Categorical.from_codes(codes, categories=labels)
+
+    return df
+
+
+def measure(function, trace_memory=True):
+    '''
+    This function calls a function and returns its wall time in seconds and the peak memory it allocated in bytes (or None).
+    As tracing the allocations slows down pure Python code many times over, the function is timed without tracing and, 
+    if trace_memory is True, called a second time with tracemalloc to record its peak memory.
+    '''
+
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return seconds, peak
+
+
+def run_suite(sizes=SUITE_SIZES, species=3, columns=4, trace_memory=True):
+    '''
+    This function runs the analysis suite (V.) and returns its measurements as a list of dicts.
+    Each size runs in a temporary directory with its own results folder, and the figures are closed after each analysis.
+    '''
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import core
+    import figures
+    import tools
+
+    figures.use_canvas('agg')
+
+    # Import the heavy modules before the first measurement, so that their import isn't counted in the smallest size
+    import seaborn
+    import sklearn.decomposition
+
+    root = os.getcwd()
+    measurements = []
+
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            os.chdir(folder)
+            os.mkdir('results')
+            try:
+                synthetic_iris(rows, species, columns).to_csv(os.path.join('results', 'synthetic.csv'), index=False)
+                spec = core.DatasetSpec('synthetic', source=os.path.join('results', 'synthetic.csv'))
+                data = {}
+                calls = {'get_dataset': lambda: data.update(df=tools.get_dataset(spec=spec)),
+                         'descriptive_summary': lambda: tools.descriptive_summary(data['df'], interactive=False, spec=spec),
+                         'outliers_summary': lambda: tools.outliers_summary(data['df'], interactive=False, spec=spec),
+                         'outliers_cleanup': lambda: tools.outliers_cleanup(data['df'], interactive=False, spec=spec),
+                         'generate_histogram': lambda: tools.generate_histogram(data['df'], 'histograms.png', interactive=False, spec=spec),
+                         'generate_pairplot': lambda: tools.generate_pairplot(data['df'], 'pairplot.png', interactive=False, spec=spec),
+                         'perform_PCA': lambda: tools.perform_PCA(data['df'], 'PCA.png', interactive=False, spec=spec)}
+
+                for analysis in SUITE_ANALYSES:
+                    # The output of the analyses is hidden, only the measurements are printed
+                    with open(os.devnull, 'w') as devnull:
+                        stdout, sys.stdout = sys.stdout, devnull
+                        try:
+                            seconds, peak = measure(calls[analysis], trace_memory)
+                        finally:
+                            sys.stdout = stdout
+                    plt.close('all')
+                    measurements.append({'rows': rows, 'analysis': analysis, 'seconds': seconds, 'peak_bytes': peak})
+                    memory = '' if peak is None else f"{peak / 2**20:10.1f} MB"
+                    print(f"\t{rows:>10,}  {analysis:<22}{seconds * 1000:12.1f} ms{memory}")
+            finally:
+                os.chdir(root)
+
+    return measurements
+
+
+def save_baseline(file_path, measurements, species, columns):
+    '''
+    This function saves the measurements of the suite to a JSON file, with the shape of the synthetic datasets they were taken on.
+    '''
+
+    with open(file_path, 'w') as writer:
+        json.dump({'species': species, 'columns': columns, 'measurements': measurements}, writer, indent=2)
+
+
+def compare_baseline(file_path, measurements, species, columns, threshold=SUITE_THRESHOLD):
+    '''
+    This function compares the measurements of the suite with the baseline saved in a JSON file and returns the list of its
+    regressions: the measurements that grew by more than threshold times and by more than SUITE_NOISE. The analyses & sizes
+    missing from the baseline are skipped.
+    '''
+
+    with open(file_path, 'r') as reader:
+        baseline = json.load(reader)
+    if (baseline['species'], baseline['columns']) != (species, columns):
+        raise ValueError(f"The baseline {file_path} was taken with {baseline['species']} species and {baseline['columns']} "
+                         f"columns, not {species} and {columns}")
+
+    previous = {(row['rows'], row['analysis']): row for row in baseline['measurements']}
+    regressions = []
+    for row in measurements:
+        old = previous.get((row['rows'], row['analysis']))
+        if old is None:
+            continue
+        for metric, noise in SUITE_NOISE.items():
+            if row[metric] is None or old[metric] is None:
+                continue
+            if row[metric] > old[metric] * threshold and row[metric] - old[metric] > noise:
+                regressions.append(f"{row['analysis']} on {row['rows']:,} rows: {metric} {old[metric]:,.3f} -> {row[metric]:,.3f} "
+                                   f"(x{row[metric] / old[metric]:.2f}, threshold x{threshold:.2f})")
+
+    return regressions
+
+
+# Plots of the figure check, and the growth of the process memory allowed over the runs of each plot, in bytes
+FIGURE_PLOTS = ['generate_histogram', 'generate_pairplot', 'perform_PCA']
+FIGURE_MEMORY_BUDGET = 25 * 2**20
+
+# Runs of each plot before the memory baseline is taken, so that caches, fonts & pooled figures are already allocated
+FIGURE_WARMUP_RUNS = 5
+
+
+def run_figure_check(runs=100, canvas='pyplot'):
+    '''
+    This function runs the figure check (VI.) and returns the list of its failures.
+    '''
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import figures
+    import tools
+
+    figures.use_canvas(canvas)
+    df = tools.get_dataset()
+    root = os.getcwd()
+    failures = []
+
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        try:
+            calls = {'generate_histogram': lambda: tools.generate_histogram(df, 'histograms.png', interactive=False),
+                     'generate_pairplot': lambda: tools.generate_pairplot(df, 'pairplot.png', interactive=False),
+                     'perform_PCA': lambda: tools.perform_PCA(df, 'PCA.png', interactive=False)}
+
+            for plot in FIGURE_PLOTS:
+                start = time.perf_counter()
+                for run in range(runs):
+                    if run == min(FIGURE_WARMUP_RUNS, runs - 1):
+                        gc.collect()
+                        baseline = figures.process_memory()
+                    with open(os.devnull, 'w') as devnull:
+                        stdout, sys.stdout = sys.stdout, devnull
+                        try:
+                            calls[plot]()
+                        finally:
+                            sys.stdout = stdout
+                seconds = (time.perf_counter() - start) / runs
+
+                gc.collect()
+                stats = figures.stats()
+                growth = None if baseline is None else stats['process_bytes'] - baseline
+                memory = 'n/a' if growth is None else f"{growth / 2**20:+.1f} MB"
+                print(f"\t{plot:<22}{runs:>5} runs {seconds * 1000:10.1f} ms/run   memory {memory:>10}   "
+                      f"figures open {stats['open']}, created {stats['created']}, reused {stats['reused']}")
+
+                if stats['open'] or plt.get_fignums():
+                    failures.append(f"{plot} left {stats['open']} figure(s) open and {len(plt.get_fignums())} in pyplot")
+                if growth is not None and growth > FIGURE_MEMORY_BUDGET:
+                    failures.append(f"{plot} grew the process memory by {growth / 2**20:.1f} MB over {runs} runs, "
+                                    f"budget is {FIGURE_MEMORY_BUDGET / 2**20:.0f} MB")
+        finally:
+            os.chdir(root)
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="benchmark.py", description="Benchmark the startup of Petalist.")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help='Number of runs of each measurement (default: 5).')
+    parser.add_argument("--check", action="store_true", help='Exit with code 1 if a budget is exceeded.')
+    parser.add_argument("--suite", action="store_true", help='Benchmark the analyses on synthetic datasets instead of the startup.')
+    parser.add_argument("--sizes", type=int, nargs="+", default=SUITE_SIZES, help='Rows of the synthetic datasets of the suite.')
+    parser.add_argument("--species", type=int, default=3, help='Number of species of the synthetic datasets (default: 3).')
+    parser.add_argument("--columns", type=int, default=4, help='Number of numeric columns of the synthetic datasets (default: 4).')
+    parser.add_argument("--no-memory", action="store_true", help='Only record the wall time in the suite, without tracing memory.')
+    parser.add_argument("--save-baseline", metavar='FILE', help='Save the measurements of the suite to a JSON file.')
+    parser.add_argument("--baseline", metavar='FILE', help='Compare the measurements of the suite with a JSON file saved by --save-baseline.')
+    parser.add_argument("--threshold", type=float, default=SUITE_THRESHOLD, 
+                        help=f'Ratio over the baseline reported as a regression (default: {SUITE_THRESHOLD}).')
+    parser.add_argument("--figures", action="store_true", help='Check that repeated plots don\'t leak figures or memory instead.')
+    parser.add_argument("--runs", type=int, default=100, help='Runs of each plot in the figure check (default: 100).')
+    parser.add_argument("--canvas", choices=['pyplot', 'agg'], default='pyplot', help='Canvas of the figure check (default: pyplot, as in the GUI).')
+    args = parser.parse_args()
+
+    # The baseline files are given relative to the current directory
+    for option in ['save_baseline', 'baseline']:
+        if getattr(args, option):
+            setattr(args, option, os.path.abspath(getattr(args, option)))
+
+    # Run from the folder of this file, so that the results & data folders are found
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.getcwd())
+    failures = []
+
+    # V.
+    if args.suite:
+        print(f"Analysis suite ({args.species} species, {args.columns} numeric columns):")
+        print(f"\t{'rows':>10}  {'analysis':<22}{'wall time':>15}{'' if args.no_memory else 'peak memory':>13}")
+        measurements = run_suite(args.sizes, args.species, args.columns, trace_memory=not args.no_memory)
+        if args.baseline:
+            failures = compare_baseline(args.baseline, measurements, args.species, args.columns, args.threshold)
+            print(f"\nRegressions against {args.baseline}:" if failures else f"\nNo regression against {args.baseline}.")
+            for failure in failures:
+                print(f"\t{failure}")
+        if args.save_baseline:
+            save_baseline(args.save_baseline, measurements, args.species, args.columns)
+            print(f"Baseline saved to {args.save_baseline}")
+        if failures and args.check:
+            sys.exit(1)
+        return
+
+    # VI.
+    if args.figures:
+        print(f"Figure check ({args.canvas} canvas):")
+        failures = run_figure_check(args.runs, args.canvas)
+        for failure in failures:
+            print(f"\t{failure}")
+        if failures and args.check:
+            sys.exit(1)
+        return
+
+    # I.
+    print("Slowest imports of analysis.py (cumulative):")
+    for seconds, module in import_profile():
+        print(f"\t{seconds * 1000:8.1f} ms  {module}")
+
+    # II.
+    timings = []
+    for _ in range(args.repeat):
+        seconds, output = time_process([sys.executable, '-c', FIRST_WINDOW_SNIPPET])
+        timings.append(seconds)
+    shown, heavy = output.strip().splitlines()[-1].split('|')
+    first_window = statistics.median(timings)
+    print(f"\nTime to first window: {first_window * 1000:.0f} ms (median of {args.repeat}, window shown: {shown})")
+    if heavy:
+        failures.append(f"heavy modules imported before the window: {heavy}")
+
+    # III.
+    timings = [time_process([sys.executable, 'analysis.py', 'summary', '--no-cache'])[0] for _ in range(args.repeat)]
+    cli_result = statistics.median(timings)
+    print(f"Time to CLI result (summary): {cli_result * 1000:.0f} ms (median of {args.repeat})")
+
+    # IV.
+    for name, seconds in [('first_window', first_window), ('cli_result', cli_result)]:
+        if seconds > STARTUP_BUDGETS[name]:
+            failures.append(f"{name} took {seconds:.2f} s, budget is {STARTUP_BUDGETS[name]:.2f} s")
+
+    if failures:
+        print("\nStartup regressions:")
+        for failure in failures:
+            print(f"\t{failure}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+'''
+Name: cache.py
+
+Author: Irina Simoes
+
+Description: This file contains a module with the cache of the results produced by the analyses, so that clicking the same
+    option twice returns the file already saved in the results directory instead of computing and rendering it again.
+
+    I. Each result is identified by a key, which is the SHA-256 of the dataset fingerprint (a hash of the DataFrame contents,
+       columns and dtypes), the analysis name and its parameters. If the data or any parameter changes, so does the key.
+
+    II. The cache has two levels: an in-memory LRU (least recently used) dict for the current process and a manifest.json
+        in the results directory, so that the results are also reused across runs. Both are bounded to max_entries, dropping
+        the least recently used entries first: every hit refreshes the 'used' time of its entry in the manifest, so that an
+        entry read often isn't dropped before one written later. The files themselves are never deleted, as they are the
+        program's outputs.
+
+    III. A cached file is only returned if it still has the size and modification time recorded when it was cached. If the
+         file was overwritten since, e.g. by the same analysis on another dataset, the entry is stale and counts as a miss.
+
+    IV. The manifest is shared by every process writing to the results directory, so put() and the hits of get() hold a file
+        lock for the whole read-modify-write and replace the manifest atomically: concurrent runs can't lose each other's
+        entries or read half of it.
+
+References:
+    - https://docs.python.org/3/library/collections.html#collections.OrderedDict
+    - https://pandas.pydata.org/docs/reference/api/pandas.util.hash_pandas_object.html
+    - https://docs.python.org/3/library/hashlib.html
+    - https://docs.python.org/3/library/fcntl.html#fcntl.flock
+'''
+
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import core
+import helpers
+
+# Bump this number whenever the output of an analysis changes for the same data & parameters, so that old entries are ignored
+CACHE_VERSION = 3
+
+
+def fingerprint(df):
+    '''
+    This function returns a hash of the DataFrame contents, including its index, column names and dtypes.
+    hash_pandas_object() hashes each row in a vectorised way, and the row hashes are then hashed together with SHA-256.
+    A MaskedFrame is hashed as the fingerprint of its source plus its mask, so that its rows don't need to be copied.
+    https://pandas.pydata.org/docs/reference/api/pandas.util.hash_pandas_object.html
+    '''
+
+    digest = hashlib.sha256()
+    if isinstance(df, core.MaskedFrame):
+        digest.update(fingerprint(df.source).encode('utf-8'))
+        digest.update(np.packbits(df.mask).tobytes() + str(len(df.mask)).encode('utf-8'))
+        return digest.hexdigest()
+
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    digest.update(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode('utf-8'))
+
+    return digest.hexdigest()
+
+
+def make_key(df, analysis, params=None):
+    '''
+    This function returns the cache key of an analysis run on a DataFrame with the given parameters.
+    The parameters are serialised with sorted keys, so that their order doesn't change the key.
+    '''
+
+    payload = json.dumps({'version': CACHE_VERSION, 'data': fingerprint(df), 'analysis': analysis, 'params': params or {}},
+                         sort_keys=True, default=str)
+
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultsCache:
+    '''
+    This class maps cache keys to the files saved in the results directory, with an in-memory LRU and an on-disk manifest.
+    The hits and misses counters report how often the cache was used.
+    '''
+
+    def __init__(self, folder='results', manifest_name='manifest.json', max_entries=128):
+        self.folder = folder
+        self.manifest_name = manifest_name
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def manifest_path(self):
+        return helpers.output_path(self.folder, self.manifest_name)
+
+    def _read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as reader:
+                return json.load(reader)
+        except (OSError, ValueError):
+            # A corrupt manifest only means the results will be computed again
+            return {}
+
+    def _write_manifest(self, manifest):
+        with helpers.atomic_path(self.manifest_path) as temp_path:
+            with open(temp_path, 'w', encoding='utf-8') as writer:
+                json.dump(manifest, writer, indent=2)
+
+    def _is_valid(self, entry):
+        file_path = helpers.output_path(self.folder, entry['file'])
+        if not os.path.exists(file_path):
+            return False
+        stat = os.stat(file_path)
+        return stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']
+
+    def _remember(self, key, entry):
+        # Add the entry to the in-memory LRU, dropping the least recently used one if the cache is full
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        '''
+        This method returns the path of the cached file for the key, or None if there is no valid entry (a miss).
+        The in-memory LRU is checked first, then the manifest in the results directory. A hit refreshes the 'used' time of the 
+        entry in the manifest.
+        '''
+
+        entry = self.memory.get(key)
+        if entry is None:
+            entry = self._read_manifest().get(key)
+
+        if entry is None or not self._is_valid(entry):
+            self.memory.pop(key, None)
+            self.misses += 1
+            return None
+
+        self._remember(key, entry)
+        self._touch(key)
+        self.hits += 1
+
+        return helpers.output_path(self.folder, entry['file'])
+
+    def _touch(self, key):
+        # II. & IV.
+        # Refresh the 'used' time of the entry in the manifest, unless another process dropped or replaced it meanwhile
+        used = time.time()
+        self.memory[key]['used'] = used
+        with helpers.file_lock(self.manifest_path):
+            manifest = self._read_manifest()
+            if key in manifest:
+                manifest[key]['used'] = used
+                self._write_manifest(manifest)
+
+    def put(self, key, file_path):
+        '''
+        This method records the file saved for the key, both in memory and in the manifest. The manifest keeps the
+        max_entries most recently used entries, and drops the entries of the same file, as only the last one is valid.
+        '''
+
+        stat = os.stat(file_path)
+        entry = {'file': os.path.basename(file_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'used': time.time()}
+        self._remember(key, entry)
+
+        # IV.
+        with helpers.file_lock(self.manifest_path):
+            manifest = self._read_manifest()
+            manifest = {k: v for k, v in manifest.items() if v['file'] != entry['file']}
+            manifest[key] = entry
+            if len(manifest) > self.max_entries:
+                recent = sorted(manifest.items(), key=lambda item: item[1]['used'])[-self.max_entries:]
+                manifest = dict(recent)
+            self._write_manifest(manifest)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.memory)}
+
+
+# Cache shared by the pipeline and the menu
+results_cache = ResultsCache()
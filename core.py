@@ -0,0 +1,906 @@
+'''
+Name: core.py
+
+Author: Irina Simoes
+
+Description: This file contains a module with the compute layer of the program. Each function runs one of the analyses on a
+    DataFrame and returns a result object with the tables, masks, components or figures it produced, without writing any file,
+    opening any dialog or printing.
+
+    tools.py (the GUI) and analysis.py (the batch mode) are consumers of this module, which save the results and notify the user.
+    Keeping the compute separate means the analyses can also be called from other programs, batched, cached or benchmarked
+    without the file and dialog overhead.
+    The figures are created with new_figure() from the figures module, so that they only go through pyplot in the GUI, and 
+    are closed by the consumers with close() once saved, so that the figure manager can reuse them.
+
+References:
+    - https://docs.python.org/3/library/dataclasses.html
+    - https://realpython.com/python-data-classes/
+'''
+
+import io
+import time
+import weakref
+from dataclasses import dataclass, field
+import numpy as np
+import pandas as pd
+import figures
+import streaming
+
+# matplotlib.pyplot, seaborn and sklearn are imported inside the functions that use them rather than here, as importing them
+# takes seconds and analysis.py imports this module (through tools.py) before the window appears.
+# https://docs.python.org/3/using/cmdline.html#cmdoption-X (-X importtime)
+
+# Create a dict object mapping colours to the different species
+# https://stackoverflow.com/questions/70356069/defining-and-using-a-dictionary-of-colours-in-a-plot
+SPECIES_COLORS = {'setosa': 'black', 'versicolor': 'orange', 'virginica': 'green'}
+
+# Palettes of the datasets with colours of their own, and the colours given in order to the other labels (matplotlib's tab10)
+DATASET_PALETTES = {'iris': SPECIES_COLORS}
+AUTO_PALETTE = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
+
+
+# _____________________ DATASET SPEC _____________________
+@dataclass
+class DatasetSpec:
+    '''
+    Description of a labelled tabular dataset, accepted by every analysis so that they aren't tied to the Iris dataset:
+        - name: name of the dataset in the datastore (e.g. 'iris', 'penguins'), used when there is no source;
+        - source: path of a CSV file with the dataset, if it isn't in the datastore;
+        - label: column with the class of each row, which the analyses group by and colour by (e.g. 'species');
+        - numeric: numeric columns analysed, all the numeric columns but the label by default;
+        - palette: colour of each label. The labels without a colour get one from AUTO_PALETTE, in order.
+    '''
+    name: str = 'iris'
+    source: str = None
+    label: str = 'species'
+    numeric: list = None
+    palette: dict = None
+
+    def __post_init__(self):
+        if self.palette is None:
+            self.palette = dict(DATASET_PALETTES.get(self.name, {}))
+
+    def columns(self, df):
+        '''
+        This method returns the numeric columns of the DataFrame analysed with this spec.
+        '''
+
+        if self.numeric:
+            return list(self.numeric)
+
+        return [col for col in df.select_dtypes(include='number').columns if col != self.label]
+
+    def colors(self, labels):
+        '''
+        This method returns a dict with the colour of each label, generating the colours missing from the palette.
+        '''
+
+        colors = {name: color for name, color in self.palette.items() if name in set(labels)}
+        unused = [color for color in AUTO_PALETTE if color not in colors.values()] or AUTO_PALETTE
+        for position, name in enumerate(name for name in labels if name not in colors):
+            colors[name] = unused[position % len(unused)]
+
+        return colors
+
+
+# Spec of Fisher's Iris dataset, used by the analyses when no spec is given
+IRIS = DatasetSpec()
+
+
+# _____________________ RESULT OBJECTS _____________________
+@dataclass
+class SummaryResult:
+    '''
+    Result of describe(): the overall descriptive statistics & missing values, and the descriptive statistics,
+    missing values and unique values of each species, keyed by species name.
+    '''
+    overall: pd.DataFrame
+    missing: pd.Series
+    by_species: dict = field(default_factory=dict)
+
+    def to_text(self):
+        '''
+        This method formats the summary as the text saved in I.variables_summary.txt, written to a StringIO buffer in a 
+        single pass rather than by concatenating a growing string.
+        https://docs.python.org/3/library/io.html#io.StringIO
+        '''
+
+        summary = io.StringIO()
+
+        # Add overall summary, data types summary & summary header for each species
+        summary.write(f"(1) Overall Descriptive Statistics:\n{self.overall.to_string()}\n\n")
+        summary.write(f"(2) Data Types Summary:\n{self.missing.to_string()}\n\n")
+        summary.write(f"(3) Summary for Each Species:\n\n")
+
+        for counter, (species, tables) in enumerate(self.by_species.items(), start=1):
+            summary.write(f"3.{counter} Summary for {species}\n")
+            summary.write(f"a) Descriptive Statistics:\n{tables['describe'].to_string()}\n\n")
+            summary.write(f"b) Missing Values:\n{tables['missing'].to_string()}\n\n")
+            summary.write(f"c) Unique Values:\n{tables['unique'].to_string()}\n\n")
+            summary.write("\n\n")
+
+        return summary.getvalue()
+
+
+@dataclass
+class OutlierResult:
+    '''
+    Result of detect_outliers(): boolean masks of the lower & upper outliers, aligned to the index of the DataFrame,
+    the IQR thresholds of each species and the species of each row.
+    '''
+    lower_mask: pd.DataFrame
+    upper_mask: pd.DataFrame
+    thresholds: pd.DataFrame
+    species: pd.Series
+
+    @property
+    def outlier_rows(self):
+        '''
+        Boolean Series flagging the rows where any variable is a lower or upper outlier.
+        '''
+        return (self.lower_mask | self.upper_mask).any(axis=1)
+
+    def positions(self):
+        '''
+        This method yields each species, in the order the species appear in the df, with a dict mapping each variable to the 
+        indices of its lower & upper outliers within the species, found with Numpy's flatnonzero().
+        https://numpy.org/doc/stable/reference/generated/numpy.flatnonzero.html
+        '''
+
+        for species, species_lower in self.lower_mask.groupby(self.species, observed=True, sort=False):
+            species_upper = self.upper_mask.loc[species_lower.index]
+            yield species, {var: (np.flatnonzero(species_lower[var].to_numpy()), np.flatnonzero(species_upper[var].to_numpy()))
+                            for var in self.lower_mask.columns}
+
+    def to_text(self):
+        '''
+        This method formats the outliers as the text saved in II.outliers_summary.txt, listing for each species and variable
+        the indices of the outliers within the species.
+        '''
+
+        outlier_summary = io.StringIO()
+
+        for species, variables in self.positions():
+            outlier_summary.write(f'\n>>> Outlier summary for {species} <<<\n')
+
+            for var, (lower_array, upper_array) in variables.items():
+                # If any of the arrays isn't empty, write the outlier information
+                if len(lower_array) > 0 or len(upper_array) > 0:
+                    outlier_summary.write(f'\n\t\tOutliers found for {var}: \n\t\t\tLower bound: {lower_array} \n\t\t\tUpper bound: {upper_array}\n')
+                # If the arrays are empty, write a message stating so to maintain completeness
+                else:
+                    outlier_summary.write(f'\n\t\tNo outliers found for {var}\n')
+
+        return outlier_summary.getvalue()
+
+    def to_dict(self):
+        '''
+        This method returns the outliers as plain lists & floats which can be serialised to JSON: for each species and variable, 
+        the IQR thresholds and the indices of the lower & upper outliers within the species.
+        '''
+
+        return {str(species): {var: {'lower_bound': float(self.thresholds.loc[species, ('lower', var)]),
+                                     'upper_bound': float(self.thresholds.loc[species, ('upper', var)]),
+                                     'lower': lower_array.tolist(),
+                                     'upper': upper_array.tolist()}
+                               for var, (lower_array, upper_array) in variables.items()}
+                for species, variables in self.positions()}
+
+
+@dataclass
+class FigureResult:
+    '''
+    Result of histogram() and pairplot(): the matplotlib figure with the plot.
+    '''
+    figure: object
+
+
+@dataclass
+class PairplotResult(FigureResult):
+    '''
+    Result of pairplot(): the matplotlib figure, the mode it was drawn with, the number of rows drawn as points (after sampling) 
+    and the seconds spent on each panel, keyed by 'y ~ x' (or the whole grid in the 'reg' mode).
+    '''
+    mode: str = 'reg'
+    sampled_rows: int = 0
+    timings: dict = field(default_factory=dict)
+
+
+@dataclass
+class HistogramCounts:
+    '''
+    Result of histogram_counts(): the bin edges shared by all species for each variable (variables x bins + 1) and the
+    number of rows of each species in each bin (variables x species x bins).
+    '''
+    variables: list
+    species: list
+    edges: np.ndarray
+    counts: np.ndarray
+
+    def to_frame(self):
+        '''
+        This method returns the counts as a long DataFrame with one row per variable, species & bin, e.g. to add them to
+        a text summary without binning the data again.
+        '''
+
+        variables, species, bins = np.indices(self.counts.shape).reshape(3, -1)
+        return pd.DataFrame({'variable': np.asarray(self.variables)[variables],
+                             'species': np.asarray(self.species)[species],
+                             'bin_left': self.edges[variables, bins],
+                             'bin_right': self.edges[variables, bins + 1],
+                             'count': self.counts.ravel()})
+
+
+@dataclass
+class HistogramResult(FigureResult):
+    '''
+    Result of histogram(): the matplotlib figure and the counts it was drawn from.
+    '''
+    counts: HistogramCounts = None
+
+
+@dataclass
+class PCAModel:
+    '''
+    Fitted standardisation + PCA projection, which can project new rows without fitting again. The mean already includes the
+    mean removed by the PCA after the standardisation, so projecting is a single subtraction, division & matrix multiply:
+        components = ((X - mean) / scale) @ components.T
+    '''
+    columns: list
+    mean: np.ndarray
+    scale: np.ndarray
+    components: np.ndarray
+    explained_variance_ratio: np.ndarray
+    fingerprint: str = ''
+
+    @property
+    def names(self):
+        return [f'PCA_{number}' for number in range(1, len(self.components) + 1)]
+
+    @property
+    def loadings(self):
+        '''
+        Contribution of each variable (rows) to each component (columns).
+        '''
+        return pd.DataFrame(self.components.T, index=self.columns, columns=self.names)
+
+    def transform(self, df):
+        '''
+        This method projects the rows of a DataFrame with the same variables onto the components, in a vectorised way.
+        '''
+
+        values = df[self.columns].to_numpy(dtype=self.components.dtype, copy=True)
+        values -= self.mean
+        values /= self.scale
+
+        return values @ self.components.T
+
+    def to_arrays(self):
+        '''
+        This method returns the model as a dict of NumPy arrays, so that it can be saved in a compact NPZ file.
+        '''
+
+        return {'columns': np.array(self.columns, dtype=str), 'mean': self.mean, 'scale': self.scale,
+                'components': self.components, 'explained_variance_ratio': self.explained_variance_ratio,
+                'fingerprint': np.array(self.fingerprint)}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''
+        This method rebuilds a model from the dict of arrays returned by to_arrays().
+        '''
+
+        return cls(columns=[str(col) for col in arrays['columns']], mean=arrays['mean'], scale=arrays['scale'],
+                   components=arrays['components'], explained_variance_ratio=arrays['explained_variance_ratio'],
+                   fingerprint=str(arrays['fingerprint']))
+
+
+@dataclass
+class PCAResult:
+    '''
+    Result of pca(): the projected rows (PCA_1, PCA_2 & species), the explained variance ratio of each component,
+    the loadings (contribution of each variable to each component), the figure with the scatter plot and the fitted
+    model, which can project new rows without fitting again.
+    '''
+    components: pd.DataFrame
+    explained_variance_ratio: np.ndarray
+    loadings: pd.DataFrame
+    figure: object
+    model: PCAModel = None
+
+
+# _____________________ COMPACT DATA _____________________
+class MaskedFrame:
+    '''
+    A subset of the rows of a DataFrame (e.g. the dataset without outliers), kept as the source DataFrame and a boolean mask 
+    rather than as a copy of the rows. The rows are only copied by materialize() when an analysis needs them, so only the mask 
+    (one byte per row) stays in memory. The rows are renumbered from 0, as in the CSV file of the cleaned dataset.
+    The mask can also be given as a loader, a function of the source returning it, which is only called the first time the 
+    mask is needed (e.g. when an option on the cleaned dataset is chosen) and whose result is kept for the session.
+    '''
+
+    def __init__(self, source, mask=None, loader=None):
+        if mask is None and loader is None:
+            raise ValueError("A MaskedFrame needs a mask or a loader.")
+        self.source = source
+        self._mask = mask
+        self.loader = loader
+
+    @property
+    def mask(self):
+        if self._mask is None:
+            self._mask = np.asarray(self.loader(self.source), dtype=bool)
+        return self._mask
+
+    def __len__(self):
+        return int(np.count_nonzero(self.mask))
+
+    def materialize(self):
+        return self.source.loc[self.mask].reset_index(drop=True)
+
+def materialize(df):
+    '''
+    This function returns the rows of a MaskedFrame as a DataFrame, or the DataFrame itself.
+    '''
+
+    return df.materialize() if isinstance(df, MaskedFrame) else df
+
+def compact(df, max_decimals=6):
+    '''
+    This function returns a copy of the DataFrame using less memory, which gives the same results in every analysis:
+
+    I. Text columns (e.g. species) become pandas Categoricals, which store each name once and an integer code per row.
+       https://pandas.pydata.org/docs/user_guide/categorical.html#memory-usage
+
+    II. float64 columns become float32 when it's lossless for their measurement precision, i.e. when all the values have at most 
+        max_decimals decimals and rounding their float32 version to that number of decimals gives back the original values.
+        The number of decimals of each column is kept in df.attrs['decimals'], so that measurements() can restore the exact 
+        float64 values where comparisons depend on them (e.g. a value equal to an outlier threshold).
+        https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.attrs.html
+    '''
+
+    columns = {}
+    decimals = dict(df.attrs.get('decimals', {}))
+
+    for col in df.columns:
+        series = df[col]
+
+        # I.
+        if series.dtype == object or pd.api.types.is_string_dtype(series.dtype):
+            series = series.astype('category')
+
+        # II.
+        elif series.dtype == 'float64':
+            values = series.to_numpy()
+            finite = values[np.isfinite(values)]
+            precision = next((d for d in range(max_decimals + 1) if np.array_equal(np.round(finite, d), finite)), None)
+            if precision is not None and (len(finite) == 0 or np.abs(finite).max() * 10 ** precision < 2 ** 24):
+                downcast = finite.astype('float32').astype('float64')
+                if np.array_equal(np.round(downcast, precision), finite):
+                    series = series.astype('float32')
+                    decimals[col] = precision
+
+        columns[col] = series
+
+    compacted = pd.DataFrame(columns, index=df.index)
+    compacted.attrs['decimals'] = decimals
+
+    return compacted
+
+def measurements(df, columns):
+    '''
+    This function returns the given numeric columns as a float64 array, restoring the exact values of the columns downcast to
+    float32 by compact() by rounding them back to their number of decimals.
+    '''
+
+    values = df[columns].to_numpy(dtype='float64', copy=True)
+    decimals = df.attrs.get('decimals', {})
+    for position, col in enumerate(columns):
+        if df[col].dtype == 'float32' and col in decimals:
+            values[:, position] = np.round(values[:, position], decimals[col])
+
+    return values
+
+def restore(df):
+    '''
+    This function returns the DataFrame with the columns downcast by compact() converted back to their exact float64 values, 
+    for the computations whose output is printed with more digits than float32 can hold (e.g. the means of the summary).
+    '''
+
+    columns = [col for col in df.attrs.get('decimals', {}) if col in df.columns and df[col].dtype == 'float32']
+    if not columns:
+        return df
+
+    return df.assign(**dict(zip(columns, measurements(df, columns).T)))
+
+def memory_usage(df):
+    '''
+    This function returns the memory used by a DataFrame in bytes, including the contents of its object columns, 
+    or the memory used by the mask of a MaskedFrame.
+    https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.memory_usage.html
+    '''
+
+    if isinstance(df, MaskedFrame):
+        return df.mask.nbytes
+
+    return int(df.memory_usage(deep=True).sum())
+
+
+# _____________________ TXT SUMMARY _____________________
+def describe(df, spec=None):
+    '''
+    This function computes a descriptive statistic summary of the variables in the dataset.
+
+    I. Compute the overall summary with pandas describe() & the missing values with isnull().
+
+    II. Group the DataFrame by the label of the spec (species for Iris) and compute the same statistics for each group, plus 
+        the number of unique values.
+        https://realpython.com/pandas-groupby/
+        https://www.geeksforgeeks.org/how-to-iterate-over-dataframe-groups-in-python-pandas/
+    '''
+
+    df = restore(materialize(df))
+    # I.
+    overall = df.describe(include='all')
+    missing = df.isnull().sum()
+
+    # II.
+    spec = spec or IRIS
+    by_species = {}
+    for species, group_df in df.groupby(spec.label, observed=True):
+        by_species[species] = {'describe': group_df.describe(include='all'),
+                               'missing': group_df.isnull().sum(),
+                               'unique': group_df.nunique()}
+
+    return SummaryResult(overall, missing, by_species)
+
+def describe_stream(file_path, chunksize=100_000, spec=None):
+    '''
+    This function computes the same summary as describe() from a CSV file too large to fit in memory, reading it in chunks 
+    of rows and keeping only mergeable accumulators for the whole dataset and for each species (see streaming.py).
+    As in the batch path, only the numeric columns of the spec (all the numeric columns but the label by default) and the label 
+    are summarised.
+    The means, standard deviations, min/max & missing values are exact; the quartiles and unique values are exact for small 
+    groups and approximate (KLL sketch & HyperLogLog) for large ones. A file with a header but no rows raises a ValueError.
+    https://pandas.pydata.org/docs/user_guide/io.html#iterating-through-files-chunk-by-chunk
+    '''
+
+    spec = spec or IRIS
+    chunks = pd.read_csv(file_path, chunksize=chunksize)
+    overall, groups = streaming.summarise_chunks(chunks, spec.label, spec.numeric or None)
+    if overall is None:
+        raise ValueError(f"{file_path} has no rows to summarise")
+
+    by_species = {species: {'describe': group.describe(), 'missing': group.missing(), 'unique': group.nunique()}
+                  for species, group in groups.items()}
+
+    return SummaryResult(overall.describe(), overall.missing(), by_species)
+
+
+# _____________________ OUTLIERS _____________________
+
+# Outlier results computed by detect_outliers(), keyed by the id of the DataFrame, so that the summary and
+# the cleanup share the thresholds instead of computing them twice for the same dataset. An entry is evicted
+# as soon as its DataFrame is garbage-collected (DataFrames can't be weakly referenced keys, as they aren't hashable)
+_outliers_computed = {}
+
+def detect_outliers(df, spec=None):
+    '''
+    This function is the engine shared by the outliers summary and cleanup. It computes the IQR thresholds of every
+    variable for every species at once and flags the outliers of the whole dataset, using the formulas below:
+            - Lower Bound = Q1 - 1.5 x IQR
+            - Upper Bound = Q3 + 1.5 x IQR
+    https://www.geeksforgeeks.org/detect-and-remove-the-outliers-using-python/
+
+    I. Compute Q1 and Q3 of all the numeric variables for all species in a single groupby-quantile pass.
+       https://pandas.pydata.org/docs/reference/api/pandas.core.groupby.DataFrameGroupBy.quantile.html
+
+    II. Broadcast the thresholds of each species back to its rows with reindex(), so that the comparison against the
+        thresholds is a single vectorised operation over the whole dataset. Values equal to a threshold are also considered outliers.
+
+    III. Return an OutlierResult with the boolean masks aligned to the original index. The result is kept in memory for as long
+         as the DataFrame is alive, so a second call with the same df doesn't recompute it, and evicted with weakref.finalize()
+         once the DataFrame is collected.
+         https://docs.python.org/3/library/weakref.html#weakref.finalize
+    '''
+
+    df = materialize(df)
+    spec = spec or IRIS
+    variables = spec.columns(df)
+    key = (id(df), spec.label, tuple(variables))
+    cached = _outliers_computed.get(key)
+    if cached is not None and cached[0]() is df:
+        return cached[1]
+
+    # I.
+    labels = df[spec.label]
+    values = measurements(df, variables)
+    quartiles = pd.DataFrame(values, index=df.index, columns=variables).groupby(labels, observed=True, sort=False).quantile([0.25, 0.75])
+    Q1 = quartiles.xs(0.25, level=-1)
+    Q3 = quartiles.xs(0.75, level=-1)
+    IQR = Q3 - Q1
+    lower = Q1 - 1.5 * IQR
+    upper = Q3 + 1.5 * IQR
+
+    # II.
+    lower_rows = lower.reindex(labels).to_numpy()
+    upper_rows = upper.reindex(labels).to_numpy()
+    lower_mask = pd.DataFrame(values <= lower_rows, index=df.index, columns=variables)
+    upper_mask = pd.DataFrame(values >= upper_rows, index=df.index, columns=variables)
+
+    # III.
+    thresholds = pd.concat({'lower': lower, 'upper': upper}, axis=1)
+    result = OutlierResult(lower_mask, upper_mask, thresholds, labels)
+    _outliers_computed[key] = (weakref.ref(df), result)
+    weakref.finalize(df, _outliers_computed.pop, key, None)
+
+    return result
+
+def remove_outliers(df, spec=None):
+    '''
+    This function returns the DataFrame without the rows flagged by detect_outliers(), with a single boolean filter.
+    https://pandas.pydata.org/docs/user_guide/indexing.html#boolean-indexing
+    '''
+
+    df = materialize(df)
+    return df.loc[~detect_outliers(df, spec).outlier_rows]
+
+
+# _____________________ HISTOGRAM _____________________
+def histogram_counts(df, bins=10, spec=None):
+    '''
+    This function counts the rows of each species in each bin of each numeric variable, in a single vectorised pass over the data
+    instead of filtering the DataFrame once per variable & species.
+
+    I. Encode the species as integer codes (in order of appearance) and compute the edges of bins equal-width bins per variable,
+       from its minimum to its maximum, so that the bins are shared by all species and their bars line up.
+
+    II. Compute the bin of every value of every variable at once, as np.histogram does for equal-width bins: the last bin 
+        includes the maximum, and the values that rounding puts on the wrong side of an edge are moved to the right bin.
+        https://numpy.org/doc/stable/reference/generated/numpy.histogram.html
+
+    III. Combine the variable, species & bin of each value into a single index and count all of them with one np.bincount() call.
+         Missing values and rows without a species aren't counted.
+         https://numpy.org/doc/stable/reference/generated/numpy.bincount.html
+    '''
+
+    df = materialize(df)
+    # I.
+    spec = spec or IRIS
+    variables = spec.columns(df)
+    codes, species = pd.factorize(df[spec.label])
+    values = measurements(df, variables)
+
+    lower = np.nanmin(values, axis=0) if len(values) else np.zeros(len(variables))
+    upper = np.nanmax(values, axis=0) if len(values) else np.ones(len(variables))
+    # A variable with a single value gets a bin of width 1 around it, as in np.histogram
+    constant = lower == upper
+    lower, upper = np.where(constant, lower - 0.5, lower), np.where(constant, upper + 0.5, upper)
+    edges = np.linspace(lower, upper, bins + 1, axis=1)
+
+    # II.
+    valid = ~np.isnan(values) & (codes >= 0)[:, None]
+    scaled = (np.where(valid, values, lower) - lower) / (upper - lower) * bins
+    positions = np.clip(scaled.astype(np.int64), 0, bins - 1)
+    columns = np.arange(len(variables))
+    positions -= values < edges[columns, positions]
+    positions += (values >= edges[columns, positions + 1]) & (positions != bins - 1)
+
+    # III.
+    index = (columns * len(species) + codes[:, None]) * bins + positions
+    counts = np.bincount(index[valid], minlength=len(variables) * len(species) * bins)
+
+    return HistogramCounts(variables, list(species), edges, counts.reshape(len(variables), len(species), bins))
+
+def histogram(df, bins=10, spec=None):
+    '''
+    This function plots a histogram subplot of each variable in the dataset, one colour per species.
+
+    I. Count the rows of each species in each bin of each variable with histogram_counts(), and dynamically calculate the 
+       number of rows and columns for the subplots, with 2 plots per row.
+
+    II. Use zip() to map each element from the variables list to the corresponding subplot axis and draw the precomputed counts 
+        of each species on it as bars, so the plot costs the same whatever the number of rows. The remainder unused subplots are hidden.
+        https://matplotlib.org/stable/gallery/color/named_colors.html#list-of-named-colors
+        https://napsterinblue.github.io/notes/python/viz/subplots/
+        https://matplotlib.org/stable/api/_as_gen/matplotlib.axes.Axes.bar.html
+    '''
+
+    # I.
+    counts = histogram_counts(df, bins, spec)
+    colors = (spec or IRIS).colors(counts.species)
+
+    num_variables = len(counts.variables)  # Check how many variables the dataset contains
+    num_rows = (num_variables + 1) // 2    # Ensure there are at least 2 plots per row
+    num_columns = 2                        # Create 2 columns
+
+    # II.
+    fig = figures.new_figure(figsize=(14, 8), name='histograms')
+    axes = fig.subplots(num_rows, num_columns, squeeze=False).flatten()
+
+    for position, (col, ax) in enumerate(zip(counts.variables, axes)):
+        edges = counts.edges[position]
+        for name, name_counts in zip(counts.species, counts.counts[position]):
+            ax.bar(edges[:-1], name_counts, width=np.diff(edges), align='edge', 
+                   color=colors[name], alpha=0.5, label=name, edgecolor='black')
+        ax.set_title(col)
+        ax.set_xlabel('Value')
+        ax.set_ylabel('Frequency')
+        ax.legend(title=(spec or IRIS).label.capitalize())
+
+    # Cleanup the remainder unused subplots
+    [ax.set_visible(False) for ax in axes[num_variables:]]
+
+    # Adjust layout & set subplot suptitle
+    fig.suptitle(f"\nDistribution of Variables in the {(spec or IRIS).name.capitalize()} Dataset\n", fontsize=14)
+    fig.tight_layout()
+
+    return HistogramResult(fig, counts)
+
+
+# _____________________ PAIRPLOT _____________________
+
+# Modes of pairplot(): 'reg' is the seaborn pair plot with bootstrapped regressions, 'fast' the scalable version below and
+# 'auto' picks 'fast' once the dataset has more than max_rows rows
+PAIRPLOT_MODES = ['auto', 'reg', 'fast']
+
+def stratified_sample(df, max_rows, label='species', seed=0):
+    '''
+    This function returns at most about max_rows rows of the DataFrame, sampling the same fraction of each species so that
+    their proportions are kept. Smaller DataFrames are returned as they are.
+    https://pandas.pydata.org/docs/reference/api/pandas.core.groupby.DataFrameGroupBy.sample.html
+    '''
+
+    if len(df) <= max_rows:
+        return df
+
+    return df.groupby(label, observed=True, sort=False).sample(frac=max_rows / len(df), random_state=seed)
+
+def ols_lines(df, x, y, label='species'):
+    '''
+    This function fits a least squares line of y on x for each species in closed form, from the sums of x, y, x² and xy of
+    each group, so that no bootstrap is needed. It returns a DataFrame indexed by species with the slope, intercept and x range.
+    The columns are read with measurements(), so that the sums are accumulated in float64 even if the DataFrame is compacted.
+    https://en.wikipedia.org/wiki/Simple_linear_regression
+    '''
+
+    xs, ys = measurements(df, [x, y]).T
+    data = pd.DataFrame({'x': xs, 'y': ys, 'xx': xs * xs, 'xy': xs * ys, label: df[label].to_numpy()}).dropna()
+    grouped = data.groupby(label, observed=True, sort=False)
+    sums = grouped.sum()
+    n = grouped.size()
+
+    denominator = n * sums['xx'] - sums['x'] ** 2
+    slope = (n * sums['xy'] - sums['x'] * sums['y']) / denominator.where(denominator != 0)
+    intercept = (sums['y'] - slope * sums['x']) / n
+
+    return pd.DataFrame({'slope': slope, 'intercept': intercept, 'x_min': grouped['x'].min(), 'x_max': grouped['x'].max()})
+
+def fast_pairplot(df, variables, max_rows=5_000, spec=None):
+    '''
+    This function draws the scalable pair plot, timing each panel.
+
+    I. Sample at most max_rows rows with stratified_sample() for the points, so that the number of markers doesn't grow with the data.
+
+    II. On the diagonal, draw the histogram of each variable per species from the counts of histogram_counts(), computed on all rows.
+
+    III. Off the diagonal, draw the points of the sample of each species, over a hexbin density of all rows if the data was 
+         sampled, and the closed-form least squares line of each species from ols_lines(), also fitted on all rows.
+         https://matplotlib.org/stable/api/_as_gen/matplotlib.axes.Axes.hexbin.html
+    '''
+
+    # I.
+    spec = spec or IRIS
+    label = spec.label
+    colors = spec.colors(pd.unique(df[label].dropna()))
+    sample = stratified_sample(df, max_rows, label)
+    sampled = len(sample) < len(df)
+
+    size = len(variables)
+    fig = figures.new_figure(figsize=(2.5 * size, 2.5 * size), name='pairplot')
+    axes = fig.subplots(size, size, squeeze=False)
+    timings = {}
+
+    # II.
+    start = time.perf_counter()
+    counts = histogram_counts(df, spec=DatasetSpec(spec.name, label=label, numeric=variables))
+    for position, col in enumerate(variables):
+        ax, edges = axes[position, position], counts.edges[position]
+        for name, name_counts in zip(counts.species, counts.counts[position]):
+            ax.stairs(name_counts, edges, color=colors[name], label=name)
+    timings['histograms'] = time.perf_counter() - start
+
+    # III.
+    for row, y in enumerate(variables):
+        for column, x in enumerate(variables):
+            if row == column:
+                continue
+            start = time.perf_counter()
+            ax = axes[row, column]
+            if sampled:
+                ax.hexbin(*measurements(df, [x, y]).T, gridsize=30, cmap='Greys', mincnt=1, linewidths=0)
+            for name, df_species in sample.groupby(label, observed=True, sort=False):
+                ax.scatter(*measurements(df_species, [x, y]).T, s=8, alpha=0.6, color=colors[name])
+            for name, line in ols_lines(df, x, y, label).iterrows():
+                xs = np.array([line['x_min'], line['x_max']])
+                ax.plot(xs, line['intercept'] + line['slope'] * xs, color=colors[name], linewidth=1.5)
+            timings[f'{y} ~ {x}'] = time.perf_counter() - start
+
+    # Label the outer axes only, as in a seaborn pair grid
+    for position, col in enumerate(variables):
+        axes[-1, position].set_xlabel(col)
+        axes[position, 0].set_ylabel(col)
+    axes[0, 0].legend(title=label.capitalize(), fontsize='small')
+
+    return fig, len(sample), timings
+
+def pairplot(df, mode='auto', variables=None, max_rows=5_000, spec=None):
+    '''
+    This function plots a scatter plot of each pair of variables, with a regression line per species.
+    https://python-charts.com/correlation/pairs-plot-seaborn/
+
+    I. Pick the variables (all the numeric ones by default) and the mode: with 'auto', the seaborn pair plot is used up to 
+       max_rows rows and the fast one above.
+
+    II. The 'reg' mode fits a regression with bootstrapped confidence intervals on every panel with seaborn, which is slow for 
+        large datasets, while the 'fast' mode is drawn by fast_pairplot() with matplotlib only.
+    '''
+
+    df = materialize(df)
+
+    # I.
+    if mode not in PAIRPLOT_MODES:
+        raise ValueError(f"Unknown pairplot mode '{mode}', expected one of {PAIRPLOT_MODES}")
+    spec = spec or IRIS
+    variables = list(variables or spec.columns(df))
+    if mode == 'auto':
+        mode = 'fast' if len(df) > max_rows else 'reg'
+
+    # II.
+    if mode == 'fast':
+        fig, sampled_rows, timings = fast_pairplot(df, variables, max_rows, spec)
+    else:
+        import seaborn as sns
+
+        start = time.perf_counter()
+        grid = sns.pairplot(df, vars=variables, hue=spec.label, corner=False, kind="reg", plot_kws={'line_kws':{'color':'black'}})
+        fig, sampled_rows, timings = figures.track(grid.figure), len(df), {'all panels': time.perf_counter() - start}
+
+    # Adjust layout & set subplot suptitle
+    fig.suptitle("Attribute Pairs by Species\n\n", fontsize=14)
+    fig.tight_layout()
+
+    return PairplotResult(fig, mode, sampled_rows, timings)
+
+
+# _____________________ PCA _____________________
+
+# Engines available to fit the PCA:
+#   - full: exact SVD of the whole matrix (LAPACK), the best choice for small & medium datasets;
+#   - randomized: randomized SVD, faster when there are many variables and only a few components are needed;
+#   - incremental: IncrementalPCA fitted with partial_fit() on batches of rows, so the SVD never needs the whole matrix at once.
+PCA_ENGINES = ['full', 'randomized', 'incremental']
+
+# Dtypes the PCA can be fitted in: float32 halves the memory of float64
+PCA_DTYPES = ['float64', 'float32']
+
+def fit_pca(df, n_components=2, engine='full', dtype='float64', batch_size=10_000, spec=None):
+    '''
+    This function fits the standardisation & the PCA of the numeric variables of a DataFrame and returns the PCAModel together 
+    with the projected rows.
+
+    I. Copy the numeric variables into a single NumPy array of the chosen dtype (float32 halves the memory) and standardise it 
+       in place, i.e. subtract the mean & divide by the standard deviation without allocating new arrays. As in StandardScaler,
+       the population standard deviation is used and variables with no variance are left unscaled. Rows with missing values
+       aren't used to fit the model, and their components are missing too.
+       https://scikit-learn.org/stable/modules/generated/sklearn.preprocessing.StandardScaler.html
+
+    II. Fit the PCA with the chosen engine. The incremental engine loops over batches of batch_size rows with partial_fit().
+        https://scikit-learn.org/stable/modules/generated/sklearn.decomposition.PCA.html
+        https://scikit-learn.org/stable/modules/generated/sklearn.decomposition.IncrementalPCA.html
+
+    III. Build the PCAModel and project the rows with it, also in batches for the incremental engine.
+    '''
+
+    df = materialize(df)
+    from sklearn.decomposition import PCA, IncrementalPCA
+
+    if engine not in PCA_ENGINES:
+        raise ValueError(f"Unknown PCA engine '{engine}', expected one of {PCA_ENGINES}")
+    if str(dtype) not in PCA_DTYPES:
+        raise ValueError(f"Unsupported PCA dtype '{dtype}', expected one of {PCA_DTYPES}")
+
+    # I.
+    columns = (spec or IRIS).columns(df)
+    values = measurements(df, columns).astype(dtype, copy=False)
+    complete = ~np.isnan(values).any(axis=1)
+    reference = values if complete.all() else values[complete]
+    mean = reference.mean(axis=0)
+    scale = reference.std(axis=0)
+    scale[scale == 0] = 1
+    values -= mean
+    values /= scale
+    fitted = values if complete.all() else values[complete]
+
+    # II.
+    if engine == 'incremental':
+        estimator = IncrementalPCA(n_components=n_components, batch_size=batch_size)
+        for start in range(0, len(fitted), batch_size):
+            estimator.partial_fit(fitted[start:start + batch_size])
+    else:
+        svd_solver = 'randomized' if engine == 'randomized' else 'full'
+        estimator = PCA(n_components=n_components, svd_solver=svd_solver, random_state=0)
+        estimator.fit(fitted)
+
+    # III.
+    model = PCAModel(columns=columns,
+                     mean=(mean + estimator.mean_ * scale).astype(dtype),
+                     scale=scale.astype(dtype),
+                     components=estimator.components_.astype(dtype),
+                     explained_variance_ratio=estimator.explained_variance_ratio_)
+    projected = np.vstack([(values[start:start + batch_size] - estimator.mean_) @ model.components.T
+                           for start in range(0, len(values), batch_size)]) if len(values) else np.empty((0, n_components))
+
+    return model, projected
+
+def pca(df, n_components=2, engine='full', dtype='float64', batch_size=10_000, spec=None):
+    '''
+    This function computes a PCA and reduces the numeric variables of the dataset to n_components dimensions/features.
+    https://www.turing.com/kb/guide-to-principal-component-analysis
+    https://builtin.com/machine-learning/pca-in-python
+    https://saturncloud.io/blog/what-is-sklearn-pca-explained-variance-and-explained-variance-ratio-difference
+
+    I. Standardise the range of variables to analyse the contribution of each variable equally, mimicking a normal distribution
+       with a mean of 0 and a standard deviation of 1, and fit the PCA with fit_pca() using the chosen engine & dtype.
+
+    II. Keep the explained variance ratio & loadings of the components, as well as the fitted model.
+
+    III. Create new DataFrame with the variables created by sklearn when computing the PCA, with the index of df, and add the 
+         species column, so that the rows stay aligned even when df is a subset of the dataset with gaps in its index.
+
+    IV. Compute a scatter plot of the first 2 components (so n_components must be at least 2) in a single scatter() call, with the colour of each row taken from 
+        the colours of the spec through the categorical codes of its species (label of the spec), rather than one call and 
+        one boolean scan of the DataFrame per species. The colours are converted to an RGBA array once per species and indexed
+        by the codes, so that no Python object is created per row. The legend is built from one marker per species.
+        https://matplotlib.org/stable/api/_as_gen/matplotlib.pyplot.scatter.html
+        https://matplotlib.org/stable/api/_as_gen/matplotlib.colors.to_rgba_array.html
+        https://matplotlib.org/stable/users/explain/axes/legend_guide.html#creating-artists-specifically-for-adding-to-the-legend-aka-proxy-artists
+    '''
+
+    if n_components < 2:
+        raise ValueError(f"The PCA plot needs at least 2 components, got n_components={n_components}; use fit_pca() for fewer")
+
+    from matplotlib.colors import to_rgba_array
+    from matplotlib.lines import Line2D
+
+    df = materialize(df)
+
+    # I.
+    spec = spec or IRIS
+    model, principal_components = fit_pca(df, n_components, engine, dtype, batch_size, spec)
+
+    # II.
+    loadings = model.loadings
+
+    # III.
+    pca_df = pd.DataFrame(data=principal_components, columns=model.names, index=df.index)
+    pca_df[spec.label] = df[spec.label]
+
+    # IV.
+    species = list(df[spec.label].dropna().unique())
+    colors = spec.colors(species)
+    codes = pd.Categorical(df[spec.label], categories=species).codes
+    labelled = codes >= 0
+    palette = to_rgba_array([colors[name] for name in species])
+    fig = figures.new_figure(figsize=(8, 6), name='pca')
+    ax = fig.add_subplot()
+    ax.scatter(principal_components[labelled, 0], principal_components[labelled, 1], c=palette[codes[labelled]])
+
+    # Format scatterplot
+    ax.legend(handles=[Line2D([], [], marker='o', linestyle='', color=colors[name], label=name) for name in species])
+    ax.set_xlabel('Principal Component #1')
+    ax.set_ylabel('Principal Component #2')
+    ax.set_title('Principal Component Analysis with 2 Elements\n')
+
+    return PCAResult(pca_df, model.explained_variance_ratio, loadings, fig, model)
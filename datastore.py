@@ -0,0 +1,176 @@
+'''
+Name: datastore.py
+
+Author: Irina Simoes
+
+Description: This file contains a module with the functions that load the datasets used by the program from a local store,
+    so that analysis.py can start without any network round-trip to the seaborn-data repository.
+
+    I. A pinned copy of each dataset is bundled in the data directory, together with its SHA-256 checksum so that any
+       accidental edit to the file is detected before it is used in the analysis.
+
+    II. The first time a dataset is requested it is copied into a content-hashed cache directory, i.e. the file name is its
+        SHA-256 digest, and an index.json maps the dataset name to the digest. The cache location can be configured through
+        the PETALIST_CACHE_DIR environment variable or the cache_dir parameter. The cached file and the index are written
+        atomically, and the index is updated under a file lock (see helpers.py), so that an interrupted write or two runs
+        at once can't leave a truncated index; an unreadable index is treated as empty, i.e. as a cache miss.
+
+    III. Only when a dataset is neither cached nor bundled, and downloads are allowed, is Seaborn asked to fetch it by name.
+         The list of remote datasets is never requested, as that alone costs an HTTP call.
+
+References:
+    - https://docs.python.org/3/library/hashlib.html
+    - https://docs.python.org/3/library/json.html
+    - https://docs.python.org/3/library/time.html#time.perf_counter
+    - https://seaborn.pydata.org/generated/seaborn.load_dataset.html
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import pandas as pd
+import helpers
+from instrument import log
+
+# Folder containing the bundled copies of the datasets, relative to this file so that it works from any cwd
+BUNDLED_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Pinned datasets: name -> (bundled file name, SHA-256 of the file)
+PINNED_DATASETS = {
+    'iris': ('iris.csv', '9cc1c345c71bcc9b486b74cbf6063fa66f4bb5e0f603a4b3c3471ec2e5e8e355'),
+}
+
+CACHE_ENV_VAR = 'PETALIST_CACHE_DIR'
+INDEX_FILE = 'index.json'
+
+# Counters reporting how often the cache was used, so that callers can check hits/misses
+cache_stats = {'hits': 0, 'misses': 0}
+
+
+def get_cache_dir(cache_dir=None):
+    '''
+    This function returns the cache directory, giving priority to the cache_dir param, then to the PETALIST_CACHE_DIR
+    environment variable and finally defaulting to ~/.cache/petalist. The directory is created if it doesn't exist yet.
+    https://docs.python.org/3/library/os.path.html#os.path.expanduser
+    '''
+
+    if cache_dir is None:
+        cache_dir = os.environ.get(CACHE_ENV_VAR, os.path.join(os.path.expanduser('~'), '.cache', 'petalist'))
+    os.makedirs(cache_dir, exist_ok=True)
+
+    return cache_dir
+
+
+def file_sha256(file_path):
+    '''
+    This function computes the SHA-256 digest of a file, reading it in blocks of 1MB so that large files don't need to fit in memory.
+    https://docs.python.org/3/library/hashlib.html
+    '''
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as reader:
+        for block in iter(lambda: reader.read(1024 * 1024), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def _read_index(cache_dir):
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return {}
+    try:
+        with open(index_path, 'r', encoding='utf-8') as reader:
+            index = json.load(reader)
+    except (OSError, ValueError):
+        # A corrupt index only means the datasets will be copied into the cache again
+        return {}
+
+    return index if isinstance(index, dict) else {}
+
+
+def _write_index(cache_dir, index):
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    with helpers.atomic_path(index_path) as temp_path:
+        with open(temp_path, 'w', encoding='utf-8') as writer:
+            json.dump(index, writer, indent=2)
+
+
+def _fetch_source(name, cache_dir, allow_download):
+    '''
+    This function returns the path of a CSV file with the dataset to be added to the cache, preferring the bundled pinned copy.
+    If the dataset isn't bundled, Seaborn downloads it by name and the DataFrame is written to a temporary CSV in the cache directory.
+    '''
+
+    if name in PINNED_DATASETS:
+        file_name, expected_sha256 = PINNED_DATASETS[name]
+        file_path = os.path.join(BUNDLED_FOLDER, file_name)
+        if os.path.exists(file_path):
+            if file_sha256(file_path) != expected_sha256:
+                raise ValueError(f"Bundled dataset {file_path} doesn't match its pinned checksum.")
+            return file_path
+
+    if not allow_download:
+        raise FileNotFoundError(f"Dataset '{name}' is neither cached nor bundled and downloads are disabled.")
+
+    # Seaborn is only imported here, as it's the only place where the network is needed
+    import seaborn as sns
+    df = sns.load_dataset(name)
+    file_path = os.path.join(cache_dir, f'{name}.download.csv')
+    df.to_csv(file_path, index=False)
+
+    return file_path
+
+
+def load_dataset(name='iris', cache_dir=None, allow_download=True):
+    '''
+    This function loads a dataset as a DataFrame, trying the local cache first.
+
+    I. Look up the dataset name in the cache index and check that the cached file still matches its digest. If so, it's a cache hit.
+
+    II. Otherwise it's a cache miss: get the source file (bundled copy or Seaborn download), hash it and copy it into the
+        cache with the digest as file name, then record it in the index.
+
+    III. Read the cached CSV with pandas and report whether it was a hit or a miss and how long it took in milliseconds.
+    '''
+
+    start = time.perf_counter()
+    cache_dir = get_cache_dir(cache_dir)
+
+    # I.
+    index = _read_index(cache_dir)
+    digest = index.get(name)
+    cached_path = os.path.join(cache_dir, f'{digest}.csv') if digest else None
+
+    if cached_path and os.path.exists(cached_path) and file_sha256(cached_path) == digest:
+        cache_stats['hits'] += 1
+        status = 'hit'
+
+    # II.
+    else:
+        cache_stats['misses'] += 1
+        status = 'miss'
+
+        source_path = _fetch_source(name, cache_dir, allow_download)
+        digest = file_sha256(source_path)
+        cached_path = os.path.join(cache_dir, f'{digest}.csv')
+        with helpers.atomic_path(cached_path) as temp_path:
+            shutil.copyfile(source_path, temp_path)
+        if source_path.endswith('.download.csv'):
+            os.remove(source_path)
+
+        # Re-read the index under the lock, so that the entries added by another run meanwhile aren't lost
+        with helpers.file_lock(os.path.join(cache_dir, INDEX_FILE)):
+            index = _read_index(cache_dir)
+            index[name] = digest
+            _write_index(cache_dir, index)
+
+    # III.
+    df = pd.read_csv(cached_path)
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    log.info(f"\tDataset '{name}' loaded in {elapsed_ms:.1f} ms (cache {status}).")
+
+    return df
@@ -0,0 +1,273 @@
+'''
+Name: figures.py
+
+Author: Irina Simoes
+
+Description: This file contains a module with the creation, rendering and disposal of the matplotlib figures drawn by the
+    analyses, so that the plots can be saved, embedded in a report or sent by the service without going through pyplot.
+
+    I. new_figure() creates the figure of a plot. With the 'agg' canvas, used whenever no window is shown (batch mode, the
+       pipeline workers, the service & the benchmarks), the Figure is attached to an Agg canvas directly, without pyplot: it
+       isn't added to pyplot's global list of figures, so it's freed as soon as it's no longer referenced and can be drawn
+       on any thread. With the 'pyplot' canvas (the GUI), the figure is created by pyplot so that plt.show() can display it.
+
+    II. render() draws a figure into an in-memory buffer as PNG or SVG, with an optional resolution (dpi) and size in inches,
+        and returns its bytes, so that it can be written to a file, embedded in HTML or sent over HTTP without a temporary file.
+        The size of the figure is restored afterwards.
+
+    III. close() disposes of a figure once it's rendered (and shown): it's removed from pyplot if pyplot created it, and its
+         axes are cleared so that the result objects referencing it don't keep the artists alive. As a closed figure may be 
+         pooled and handed out again, release() closes the figure of a result object and detaches it from the result, so 
+         that a result returned to the caller never holds a figure which is reused by the next plot.
+
+    IV. The figures are owned by a FigureManager, which the functions above delegate to. On the Agg canvas, the cleared figure 
+        of a named plot (e.g. 'histograms') is kept in a pool of pool_size figures per name and reused, with its canvas, by the 
+        next plot of that name, so that repeated plots don't allocate a new figure each time. On the pyplot canvas the figures 
+        are closed for good, as plt.show() would otherwise show the pooled ones. stats() reports the figures still open, the 
+        pooled ones, the counts of figures created, reused & closed, the memory of their canvases and the memory of the process.
+        A figure created by another library (e.g. seaborn) is registered with track(), so that it's counted as well.
+
+References:
+    - https://matplotlib.org/stable/gallery/user_interfaces/canvasagg.html
+    - https://matplotlib.org/stable/api/backend_agg_api.html
+    - https://matplotlib.org/stable/api/_as_gen/matplotlib.figure.Figure.html#matplotlib.figure.Figure.savefig
+    - https://matplotlib.org/stable/users/faq.html#work-with-threads
+'''
+
+import io
+import os
+import sys
+import threading
+import weakref
+
+# Canvas of the figures created by new_figure(): 'pyplot' (to show them in windows) or 'agg' (to render them only)
+CANVASES = ['pyplot', 'agg']
+settings = {'canvas': 'pyplot'}
+
+# Formats render() can write, and the file extension of each
+RENDER_FORMATS = {'png': '.png', 'svg': '.svg'}
+
+# Options of an analysis which are given to render() rather than to the function drawing the plot
+RENDER_OPTIONS = ['dpi', 'size']
+
+
+def use_canvas(canvas):
+    '''
+    This function sets the canvas of the figures created from now on by new_figure().
+    '''
+
+    if canvas not in CANVASES:
+        raise ValueError(f"Unknown canvas '{canvas}', expected one of {CANVASES}")
+    settings['canvas'] = canvas
+
+
+class FigureManager:
+    '''
+    This class owns the figures of the plots: it creates them on the current canvas, reuses them and disposes of them.
+    '''
+
+    def __init__(self, pool_size=1):
+        self.pool_size = pool_size
+        self.pool = {}
+        self.live = weakref.WeakSet()
+        self.lock = threading.Lock()
+        self.counters = {'created': 0, 'reused': 0, 'closed': 0}
+
+    def new(self, figsize=None, name=None, **kwargs):
+        '''
+        This method returns an empty figure of the given size in inches, named after its plot: a pooled figure of that name 
+        if there is one on the Agg canvas, or a new one.
+        '''
+
+        import matplotlib
+
+        # I. & IV.
+        if settings['canvas'] == 'agg':
+            with self.lock:
+                fig = self.pool[name].pop() if self.pool.get(name) else None
+                self.counters['reused' if fig is not None else 'created'] += 1
+            if fig is not None:
+                # Reset what the previous plot may have changed, as clear() keeps the size, resolution & margins
+                fig.set_size_inches(figsize or matplotlib.rcParams['figure.figsize'])
+                fig.set_dpi(kwargs.get('dpi') or matplotlib.rcParams['figure.dpi'])
+                fig.subplotpars.update(**{key: matplotlib.rcParams[f'figure.subplot.{key}'] 
+                                          for key in ['left', 'right', 'bottom', 'top', 'wspace', 'hspace']})
+            else:
+                from matplotlib.backends.backend_agg import FigureCanvasAgg
+                from matplotlib.figure import Figure
+
+                fig = Figure(figsize=figsize, **kwargs)
+                FigureCanvasAgg(fig)
+        else:
+            import matplotlib.pyplot as plt
+
+            fig = plt.figure(figsize=figsize, **kwargs)
+            with self.lock:
+                self.counters['created'] += 1
+
+        fig.set_label(name or '')
+        with self.lock:
+            self.live.add(fig)
+
+        return fig
+
+    def track(self, fig):
+        '''
+        This method registers a figure created by another library, so that it's counted until it's closed.
+        '''
+
+        with self.lock:
+            self.live.add(fig)
+            self.counters['created'] += 1
+
+        return fig
+
+    def close(self, fig):
+        '''
+        This method disposes of a figure: it's cleared, removed from pyplot if pyplot created it, and pooled for reuse if it's 
+        a named figure on the Agg canvas and the pool of its name isn't full.
+        '''
+
+        # III. & IV.
+        if fig is None:
+            return
+
+        pyplot = sys.modules.get('matplotlib.pyplot')
+        if pyplot is not None and getattr(fig, 'number', None) is not None:
+            pyplot.close(fig)
+            name = None
+        else:
+            name = fig.get_label() or None
+        fig.clear()
+
+        with self.lock:
+            if fig in self.live:
+                self.live.discard(fig)
+                self.counters['closed'] += 1
+            pool = self.pool.setdefault(name, []) if name is not None else None
+            if pool is not None and len(pool) < self.pool_size and all(pooled is not fig for pooled in pool):
+                pool.append(fig)
+
+    def stats(self):
+        '''
+        This method returns the figures open & pooled, the counts of figures created, reused & closed, the bytes of the RGBA 
+        buffers of their canvases and the resident memory of the process (None if it can't be read).
+        '''
+
+        with self.lock:
+            open_figures = list(self.live)
+            pooled = [fig for pool in self.pool.values() for fig in pool]
+            counters = dict(self.counters)
+
+        canvas_bytes = sum(int(width * fig.dpi) * int(height * fig.dpi) * 4
+                           for fig in open_figures + pooled for width, height in [fig.get_size_inches()])
+
+        return {'open': len(open_figures), 'pooled': len(pooled), **counters, 'canvas_bytes': canvas_bytes,
+                'process_bytes': process_memory()}
+
+
+def process_memory():
+    '''
+    This function returns the resident memory of the process in bytes: the current one from /proc on Linux, otherwise the 
+    peak one from getrusage(), or None if neither is available (e.g. on Windows).
+    https://man7.org/linux/man-pages/man5/proc.5.html
+    https://docs.python.org/3/library/resource.html#resource.getrusage
+    '''
+
+    try:
+        with open('/proc/self/statm', 'r') as reader:
+            return int(reader.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# Manager of the figures drawn by the analyses
+manager = FigureManager()
+
+
+def new_figure(figsize=None, name=None, **kwargs):
+    '''
+    This function returns an empty figure for the plot called name, on the current canvas, with the given size in inches and 
+    Figure arguments.
+    '''
+
+    return manager.new(figsize, name, **kwargs)
+
+
+def track(fig):
+    '''
+    This function registers a figure created by another library (e.g. seaborn) with the manager.
+    '''
+
+    return manager.track(fig)
+
+
+def stats():
+    '''
+    This function returns the figure & memory statistics of the manager.
+    '''
+
+    return manager.stats()
+
+
+def render(fig, fmt='png', dpi=None, size=None):
+    '''
+    This function returns the bytes of the figure rendered as fmt ('png' or 'svg'), at dpi dots per inch (the figure's own
+    resolution by default) and with size as (width, height) in inches (the figure's own size by default).
+    '''
+
+    # II.
+    if fmt not in RENDER_FORMATS:
+        raise ValueError(f"Unknown image format '{fmt}', expected one of {', '.join(RENDER_FORMATS)}")
+
+    original_size = fig.get_size_inches().copy()
+    if size is not None:
+        fig.set_size_inches(size)
+
+    buffer = io.BytesIO()
+    try:
+        fig.savefig(buffer, format=fmt, dpi=dpi or 'figure')
+    finally:
+        fig.set_size_inches(original_size)
+
+    return buffer.getvalue()
+
+
+def split_options(options):
+    '''
+    This function splits the options of an analysis (e.g. {'mode': 'fast', 'dpi': 150}) into the options of the function 
+    drawing the plot and those of render().
+    '''
+
+    options = options or {}
+
+    return ({key: value for key, value in options.items() if key not in RENDER_OPTIONS},
+            {key: value for key, value in options.items() if key in RENDER_OPTIONS})
+
+
+def close(fig):
+    '''
+    This function disposes of a figure which is no longer needed. Nothing else may hold the figure, as it can be reused.
+    '''
+
+    manager.close(fig)
+
+
+def release(result):
+    '''
+    This function closes the figure of a result object and sets it to None, so that the result can be returned to the caller.
+    '''
+
+    fig, result.figure = result.figure, None
+    manager.close(fig)
+
+    return result
@@ -1,9 +1,113 @@
 '''
 This file handles repetitive tasks pertaining to saving and creating files which performed multiple times in tools.py
+and loading them back in analysis.py.
+
+The files are saved under the output root, which is the working directory unless PETALIST_OUTPUT_DIR is set, and optionally in
+a subdirectory of their folder for each run (PETALIST_RUN_ID), so that concurrent runs don't overwrite each other's results.
+Both are environment variables, so that the worker processes of the pipeline & the menu inherit them.
+Every file is first written to a temporary file in the same directory and then renamed over the final path with os.replace(),
+which is atomic, so that a crash or a concurrent reader never sees a half-written file.
+https://docs.python.org/3/library/os.html#os.replace
 '''
 
 import os
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
 import pandas as pd
+import figures
+
+# Environment variables with the output root and the run subdirectory
+OUTPUT_DIR_VARIABLE = 'PETALIST_OUTPUT_DIR'
+RUN_ID_VARIABLE = 'PETALIST_RUN_ID'
+
+
+def configure_output(output_dir=None, run_id=None):
+    '''
+    This function sets the output root and the run subdirectory of the files saved from now on, in this process and in the
+    worker processes it starts. A run_id of 'auto' is replaced by the current date & time, e.g. 20240131-142501.
+    '''
+
+    if output_dir is not None:
+        os.environ[OUTPUT_DIR_VARIABLE] = os.path.abspath(output_dir)
+    if run_id == 'auto':
+        run_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+    if run_id is not None:
+        os.environ[RUN_ID_VARIABLE] = run_id
+
+    return folder_path('results')
+
+
+def folder_path(folder):
+    '''
+    This function returns the full path of a folder under the output root (and in the run subdirectory, if any),
+    creating it if it doesn't exist yet.
+    '''
+
+    path = os.path.join(os.environ.get(OUTPUT_DIR_VARIABLE) or os.getcwd(), folder)
+    if os.environ.get(RUN_ID_VARIABLE):
+        path = os.path.join(path, os.environ[RUN_ID_VARIABLE])
+    os.makedirs(path, exist_ok=True)
+
+    return path
+
+
+def output_path(folder, file_name):
+    '''
+    This function returns the full path of a file saved in a folder under the output root.
+    '''
+
+    return os.path.join(folder_path(folder), file_name)
+
+
+@contextmanager
+def atomic_path(file_path):
+    '''
+    This function yields a temporary path in the directory of file_path, to write the file to, and renames it over
+    file_path once the block has finished. If the block fails, the temporary file is deleted and file_path is left untouched.
+    The temporary file is unique to the process and keeps the extension of file_path, as some writers (savefig, np.savez)
+    pick the format from it.
+    '''
+
+    directory, file_name = os.path.split(file_path)
+    temp_path = os.path.join(directory, f'.{file_name}.{os.getpid()}.{uuid.uuid4().hex[:8]}{os.path.splitext(file_name)[1]}')
+    try:
+        yield temp_path
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+@contextmanager
+def file_lock(file_path):
+    '''
+    This function holds an exclusive lock on file_path + '.lock' for the duration of the block, so that a read-modify-write
+    of a shared file (e.g. the cache manifest) by one process can't interleave with another's. It uses flock() on POSIX
+    and msvcrt.locking() on Windows, which both release the lock if the process dies.
+    https://docs.python.org/3/library/fcntl.html#fcntl.flock
+    https://docs.python.org/3/library/msvcrt.html#msvcrt.locking
+    '''
+
+    with open(file_path + '.lock', 'a+') as lock_file:
+        if os.name == 'nt':
+            import msvcrt
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == 'nt':
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
 
 def save_text_file(folder, file_name, content):
     '''
@@ -20,9 +124,10 @@ def save_text_file(folder, file_name, content):
 
     folder = folder
     file_name = file_name
-    file_path = os.path.join(os.getcwd(), folder, file_name)
-    with open(file_path, 'w', encoding='utf-8') as writer:
-        writer.write(content)
+    file_path = output_path(folder, file_name)
+    with atomic_path(file_path) as temp_path:
+        with open(temp_path, 'w', encoding='utf-8') as writer:
+            writer.write(content)
 
     return file_path
 
@@ -39,15 +144,18 @@ def save_csv_file(folder, file_name, df):
 
     folder = folder
     file_name = file_name    
-    file_path = os.path.join(os.getcwd(), folder, file_name)
-    df.to_csv(file_path, index=False)
+    file_path = output_path(folder, file_name)
+    with atomic_path(file_path) as temp_path:
+        df.to_csv(temp_path, index=False)
     
     return file_path
 
 
-def save_plot(folder, file_name, fig):
+def save_plot(folder, file_name, fig, dpi=None, size=None):
     '''
-    This function saves plots as PNG files with matplotlib savefid(). To keep the repository nicely organised, we specify the folder where the file should be saved. 
+    This function saves plots as PNG (or SVG, following the extension of file_name) files. The figure is rendered in memory 
+    with render() from the figures module, at dpi dots per inch and with size as (width, height) in inches if given, and the 
+    bytes are then written in one go. To keep the repository nicely organised, we specify the folder where the file should be saved. 
     Also, as the program is meant to be ran on different machines, the os module is used to construct a full path, as a hardcoded absolute path would throw an error.  
     The file_path makes use of os.path.join to ensure compatibility across different operating systems. 
     After saving the file, it returns its path so that it can be maniputed in other parts of the code.
@@ -55,8 +163,41 @@ def save_plot(folder, file_name, fig):
     https://docs.python.org/3/library/os.path.html
     '''
 
-    folder = folder
-    file_name = file_name    
-    file_path = os.path.join(os.getcwd(), folder, file_name)
-    fig.savefig(fname=file_path)
+    fmt = os.path.splitext(file_name)[1].lstrip('.').lower() or 'png'
+    image = figures.render(fig, fmt, dpi, size)
+    file_path = output_path(folder, file_name)
+    with atomic_path(file_path) as temp_path:
+        with open(temp_path, 'wb') as writer:
+            writer.write(image)
+
+    return file_path
     
+
+
+# _____________________ ARRAYS _____________________
+
+def save_arrays(folder, file_name, arrays):
+    '''
+    This function saves a dict of NumPy arrays (e.g. the parameters of a fitted model) in a single uncompressed NPZ file, 
+    which is loaded back with load_arrays() without pickling any Python object.
+    https://numpy.org/doc/stable/reference/generated/numpy.savez.html
+    '''
+
+    file_path = output_path(folder, file_name)
+    with atomic_path(file_path) as temp_path:
+        np.savez(temp_path, **arrays)
+
+    return file_path
+
+
+def load_arrays(folder, file_name):
+    '''
+    This function loads the dict of arrays saved by save_arrays(), or returns None if the file doesn't exist.
+    '''
+
+    file_path = output_path(folder, file_name)
+    if not os.path.exists(file_path):
+        return None
+
+    with np.load(file_path, allow_pickle=False) as arrays:
+        return {key: arrays[key] for key in arrays.files}
@@ -0,0 +1,135 @@
+'''
+Name: instrument.py
+
+Author: Irina Simoes
+
+Description: This file contains a module with the instrumentation of the program: the progress messages, the timing of each
+    stage of the analyses and an optional profile of a whole run, so that it's possible to see where the time goes without
+    editing the code.
+
+    I. The progress messages are sent to the 'petalist' logger rather than printed. configure() shows them on the console
+       depending on the verbosity (0: warnings only, 1: progress messages, 2: also the duration of each stage), and can also
+       write every record, whatever the verbosity, as one JSON object per line to a log file.
+
+    II. timed() is a context manager and decorator which times a stage (load, compute, render, save...) and logs a record
+        with its duration in seconds and the analysis, dataset & number of rows it was given, e.g.
+        {"time": "...", "level": "DEBUG", "message": "...", "stage": "compute", "analysis": "pca", "rows": 150, "seconds": 0.012}
+
+    III. profiled() runs a block with cProfile and dumps the statistics to a file, which can be read with pstats or snakeviz.
+
+    The settings given to configure() are kept in the settings dict, so that the worker processes of the pipeline & the menu
+    can be configured the same way.
+
+References:
+    - https://docs.python.org/3/howto/logging.html
+    - https://docs.python.org/3/library/logging.html#logrecord-attributes
+    - https://docs.python.org/3/library/contextlib.html#contextlib.ContextDecorator
+    - https://docs.python.org/3/library/profile.html
+'''
+
+import json
+import logging
+import sys
+import time
+from contextlib import ContextDecorator, contextmanager
+from datetime import datetime, timezone
+
+# Logger of the program, which doesn't propagate to the root logger writing the errors to error.log
+log = logging.getLogger('petalist')
+log.propagate = False
+
+# Logging level of each verbosity
+VERBOSITY_LEVELS = {0: logging.WARNING, 1: logging.INFO, 2: logging.DEBUG}
+
+# Settings given to the last call of configure()
+settings = {'verbosity': 1, 'json_file': None}
+
+
+class JsonFormatter(logging.Formatter):
+    '''
+    This class formats a log record as a JSON object on a single line, with the fields given to timed() as keys.
+    '''
+
+    def format(self, record):
+        entry = {'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+                 'level': record.levelname,
+                 'message': record.getMessage().strip()}
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['error'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+def configure(verbosity=1, json_file=None):
+    '''
+    This function sets up the handlers of the logger: the console, with the level of the verbosity, and the JSON log file
+    with every record if json_file is given. It can be called again to change the settings.
+    '''
+
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+        handler.close()
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(VERBOSITY_LEVELS[max(0, min(verbosity, 2))])
+    console.setFormatter(logging.Formatter('%(message)s'))
+    log.addHandler(console)
+
+    if json_file is not None:
+        writer = logging.FileHandler(json_file, mode='a', encoding='utf-8')
+        writer.setFormatter(JsonFormatter())
+        log.addHandler(writer)
+
+    log.setLevel(logging.DEBUG)
+    settings.update(verbosity=verbosity, json_file=json_file)
+
+
+class timed(ContextDecorator):
+    '''
+    This class times a stage, as a context manager or as a decorator, and logs its duration at the DEBUG level:
+
+        with instrument.timed('compute', analysis='pca', rows=len(df)):
+            ...
+
+    The duration is also kept in the seconds attribute. If the stage raises an exception, the record has a status of 'error'.
+    '''
+
+    def __init__(self, stage, **fields):
+        self.stage = stage
+        self.fields = fields
+        self.seconds = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.seconds = time.perf_counter() - self.start
+        fields = {'stage': self.stage, **self.fields, 'seconds': round(self.seconds, 6),
+                  'status': 'ok' if exc_type is None else 'error'}
+        label = ' '.join(str(self.fields[key]) for key in ['analysis', 'data'] if key in self.fields)
+        log.debug(f"\t[{self.stage}{' ' + label if label else ''}] {self.seconds * 1000:.1f} ms", extra={'fields': fields})
+        return False
+
+
+@contextmanager
+def profiled(file_path=None):
+    '''
+    This function runs the block with cProfile and dumps the statistics to file_path, or just runs it if file_path is None.
+    '''
+
+    if file_path is None:
+        yield
+        return
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(file_path)
+        log.info(f"\tProfile saved to {file_path}")
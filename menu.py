@@ -4,18 +4,124 @@ Name: menu.py
 Author: Irina Simoes
 
 Description: This file contains a module with the function that computes the GUI with tkinter when analysis.py is run.
+    The analyses triggered by the buttons run in a background process (see JobDispatcher), so that the window doesn't 
+    freeze while a plot is being generated.
 
 '''
 
 import tkinter as tk
 from tkinter import messagebox
+from tkinter import ttk
 import tkinter.font as font
+import logging
+import multiprocessing
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 import tools
+import pipeline
+import instrument
+
+#____________________________ BACKGROUND JOBS ____________________________
+
+class JobDispatcher:
+    '''
+    This class runs the analyses triggered by the menu buttons in a background process, so that the tkinter mainloop 
+    keeps handling events while a pairplot or a PCA is being computed.
+
+    I. The jobs are submitted to a process pool which stays alive for the whole session, so that only the first job pays 
+       for starting the worker and importing seaborn/sklearn. Processes are used instead of threads as matplotlib figures 
+       aren't thread-safe; the worker saves the plot with the Agg backend and the GUI opens the saved file.
+       https://docs.python.org/3/library/concurrent.futures.html#processpoolexecutor
+
+    II. While a job is in flight, the button that triggered it is disabled and the progress bar & status label show which 
+        jobs are running. Clicking again on an analysis which is already running doesn't queue a duplicate job. Whether the file
+        of an analysis is already saved for the same data (see cache.py) is checked by the job itself, as hashing the dataset
+        would freeze the window on large inputs; the saved file is then returned without computing the analysis again.
+
+    III. Tkinter widgets can only be used from the mainloop, so instead of waiting on the job, the dispatcher checks if it's
+         done every 100ms with root.after() and shows the message box on the main thread once it is.
+         https://tkdocs.com/tutorial/eventloop.html
+    '''
+
+    def __init__(self, root, status_label, progress_bar, workers=1, poll_ms=100, spec=None):
+        self.root = root
+        self.spec = spec
+        self.status_label = status_label
+        self.progress_bar = progress_bar
+        self.poll_ms = poll_ms
+        self.in_flight = {}
+
+        # I.
+        context = multiprocessing.get_context('spawn')
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=instrument.configure,
+                                            initargs=(instrument.settings['verbosity'], instrument.settings['json_file']))
+
+    def submit(self, analysis, data, df, button):
+        '''
+        This method dispatches an analysis on the chosen dataset to the background process, unless the same job is already running.
+        '''
+
+        # II.
+        key = (analysis, data)
+        if key in self.in_flight:
+            self.status_label.config(text=f"{analysis} ({data}) is already running...")
+            return
+
+        future = self.executor.submit(pipeline.run_task, analysis, data, df, spec=self.spec)
+        self.in_flight[key] = (future, button, time.perf_counter())
+        button.config(state='disabled')
+        self._update_status()
+
+        # III.
+        self.root.after(self.poll_ms, self._poll, key)
+
+    def _poll(self, key):
+        future, button, start = self.in_flight[key]
+        if not future.done():
+            self.root.after(self.poll_ms, self._poll, key)
+            return
+
+        del self.in_flight[key]
+        # Re-enable the button unless another job triggered by it is still running
+        if all(other_button is not button for _, other_button, _ in self.in_flight.values()):
+            button.config(state='normal')
+
+        try:
+            result = future.result()
+        except Exception:
+            self._update_status()
+            logging.error(f"Job {key} failed", exc_info=True)
+            messagebox.showerror("Error", f"{key[0]} ({key[1]}) failed, please check error.log for details.")
+            return
+
+        # The worker returns the saved file without computing it again if it's up to date
+        if result['cached']:
+            self._update_status(finished=f"{key[0]} ({key[1]}) is up to date.")
+        else:
+            self._update_status(finished=f"{key[0]} ({key[1]}) finished in {time.perf_counter() - start:.1f} s.")
+
+        # The plots were saved by the worker, so they are opened as files rather than with plt.show()
+        tools.notify_user(*tools.NOTIFICATIONS[result['analysis']], result['file_path'])
+
+    def _update_status(self, finished=None):
+        if self.in_flight:
+            running = ', '.join(f"{analysis} ({data})" for analysis, data in self.in_flight)
+            self.status_label.config(text=f"Running: {running}...")
+            self.progress_bar.start(10)
+        else:
+            self.status_label.config(text=finished or '')
+            self.progress_bar.stop()
+
+    def shutdown(self):
+        '''
+        This method cancels the pending jobs and stops the worker process without waiting for the running job.
+        '''
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
 #____________________________ OPENING MENU ____________________________
 
-def closing_window(root):
+def closing_window(root, dispatcher=None):
     '''
     This function ensures the program exits completely after closing tkinter GUI, without triggering an error.
     https://stackoverflow.com/questions/110923/how-do-i-close-a-tkinter-window
@@ -24,11 +130,13 @@ def closing_window(root):
     https://docs.python.org/3/library/os.html#os._exit
     '''
     if messagebox.askokcancel('Quit', 'Are you sure you want to exit?'):
+        if dispatcher is not None:
+            dispatcher.shutdown()
         root.destroy()
         os._exit(os.EX_OK) # EX_OK code passed to specify that no error occurred, making this function preferred over sys_exit() 
                           # which raises an exception
 
-def opening_menu(username, df, df_cleaned):
+def opening_menu(username, df, df_cleaned, spec=None):
     '''
     This function computes a GUI using the tkinter library, displaying four clickable analysys options. Each of the
     options trigger a different function from tools.py: getting a descriptive summary, identifying and 
@@ -41,9 +149,15 @@ def opening_menu(username, df, df_cleaned):
     root = tk.Tk()
     root.title("PETALIST || Iris Dataset Analysis")
 
+    # Create the status label & progress bar showing the jobs running in the background, and the dispatcher running them
+    # https://tkdocs.com/tutorial/morewidgets.html#progressbar
+    status_label = tk.Label(root, fg="#5E7F73", bg="white", text="", anchor='w')
+    progress_bar = ttk.Progressbar(root, mode='indeterminate', length=220)
+    dispatcher = JobDispatcher(root, status_label, progress_bar, spec=spec)
+
     # Handle the menu close event gracefully
     # https://stackoverflow.com/questions/110923/how-do-i-close-a-tkinter-window
-    root.protocol("WM_DELETE_WINDOW", lambda: closing_window(root))
+    root.protocol("WM_DELETE_WINDOW", lambda: closing_window(root, dispatcher))
 
     # Load image
     folder = 'images'
@@ -75,6 +189,9 @@ def opening_menu(username, df, df_cleaned):
                       text="Welcome to Petalist, the Iris dataset analysis \nprogram. Please select one of the options below:", 
                       font=font_label_text, anchor='w')
     label2.place(relx=0.50, rely=0.4, anchor="sw")
+    status_label['font'] = font_label_text
+    status_label.place(relx=0.50, rely=0.97, anchor="sw")
+    progress_bar.place(relx=0.50, rely=0.93, anchor="sw")
     
     # Create buttons
     # Colours: https://cs111.wellesley.edu/archive/cs111_fall14/public_html/labs/lab12/tkintercolor.html
@@ -91,11 +208,11 @@ def opening_menu(username, df, df_cleaned):
     button_fg = "white"
 
     # Call button functions
-    button_1(root,df,button_width,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons)
-    button_2(root,df,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons,font_options)
-    button_3(root,df,df_cleaned,button_width,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons)
-    button_4(root,df,df_cleaned,button_width,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons)
-    button_5(root,df,df_cleaned,button_width,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons)
+    button_1(root,df,dispatcher,button_width,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons)
+    button_2(root,df,dispatcher,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons,font_options)
+    button_3(root,df,df_cleaned,dispatcher,button_width,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons)
+    button_4(root,df,df_cleaned,dispatcher,button_width,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons)
+    button_5(root,df,df_cleaned,dispatcher,button_width,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons)
 
     # Maximize the window
     root.state('zoomed')
@@ -106,16 +223,16 @@ def opening_menu(username, df, df_cleaned):
 
 #____________________________ OPENING MENU BUTTONS ____________________________
 
-def button_1(root,df,button_width,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons):
+def button_1(root,df,dispatcher,button_width,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons):
     '''
     This function is part of the GUI setup in the opening_menu function, creating and configuring a button within the menu. 
-    When clicked, it triggers the descriptive_summary function from the tools module, which performs a descriptive summary 
-    of the DataFrame.
+    When clicked, it dispatches the descriptive summary of the DataFrame to the background process, which runs the 
+    descriptive_summary function from the tools module.
     '''
 
     button1 = tk.Button(root, 
                     text=" I .get descriptive summary", 
-                    command=lambda: tools.descriptive_summary(df),
+                    command=lambda: dispatcher.submit('summary', 'original', df, button1),
                     width=button_width, 
                     height=button_height, 
                     anchor=button_anchor, 
@@ -125,18 +242,18 @@ def button_1(root,df,button_width,button_height,button_anchor,button_justify,but
     button1.place(relx=0.60, rely=0.5, anchor="center")  
     button1['font'] = font_buttons
 
-def button_2(root,df,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons,font_options):
+def button_2(root,df,dispatcher,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons,font_options):
     '''
     This function is part of the GUI setup in the opening_menu function, creating and configuring a button within the menu. 
     This option menu allows the user to choose between summarizing outliers or removing them from the dataset. When an option 
-    is selected, the corresponding function from the tools module is triggered. 
+    is selected, the corresponding analysis is dispatched to the background process. 
     '''
 
-    # Create the list of options & a dictionary mapping options to their respective functions
+    # Create the list of options & a dictionary mapping options to their respective analyses
     options_list = ["Get a summary of outliers", "Remove outliers from the dataset"] 
-    option_functions = {
-        "Get a summary of outliers": tools.outliers_summary,
-        "Remove outliers from the dataset": tools.outliers_cleanup
+    option_analyses = {
+        "Get a summary of outliers": 'outliers',
+        "Remove outliers from the dataset": 'clean'
         }
     
     # Variable to keep track of the option selected in tk.OptionMenu() & set the default value of the variable
@@ -159,9 +276,9 @@ def button_2(root,df,button_height,button_anchor,button_justify,button_bg,button
 
     # Configure the OptionMenu to call the appropriate function when an option is selected
     for option in options_list:
-        button2["menu"].entryconfig(option, command=lambda opt=option: option_functions[opt](df))
+        button2["menu"].entryconfig(option, command=lambda opt=option: dispatcher.submit(option_analyses[opt], 'original', df, button2))
 
-def button_3(root,df,df_cleaned,button_width,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons):
+def button_3(root,df,df_cleaned,dispatcher,button_width,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons):
     '''
     This function is part of the GUI setup in the opening_menu function, creating and configuring a button within the menu. 
     When clicked, it triggers the generate_pairplot_options function from the tools module, which prompts the user to choose 
@@ -170,7 +287,7 @@ def button_3(root,df,df_cleaned,button_width,button_height,button_anchor,button_
         
     button3 = tk.Button(root, 
                         text="III .generate pair scatter plot", 
-                        command=lambda: tools.generate_pairplot_options(df,df_cleaned),
+                        command=lambda: tools.generate_pairplot_options(df, df_cleaned, run=lambda analysis, data, df_chosen: dispatcher.submit(analysis, data, df_chosen, button3)),
                         width=button_width, 
                         height=button_height, 
                         anchor=button_anchor, 
@@ -180,7 +297,7 @@ def button_3(root,df,df_cleaned,button_width,button_height,button_anchor,button_
     button3.place(relx=0.60, rely=0.7, anchor="center") 
     button3['font'] = font_buttons
 
-def button_4(root,df,df_cleaned,button_width,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons):
+def button_4(root,df,df_cleaned,dispatcher,button_width,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons):
     '''
     This function is part of the GUI setup in the opening_menu function, creating and configuring a button within the menu. 
     When clicked, it triggers the generate_histogram_options function from the tools module, which prompts the user to choose 
@@ -189,7 +306,7 @@ def button_4(root,df,df_cleaned,button_width,button_height,button_anchor,button_
     
     button4 = tk.Button(root, 
                             text="IV .generate histograms",  
-                            command=lambda: tools.generate_histogram_options(df, df_cleaned),
+                            command=lambda: tools.generate_histogram_options(df, df_cleaned, run=lambda analysis, data, df_chosen: dispatcher.submit(analysis, data, df_chosen, button4)),
                             width=button_width, 
                             height=button_height, 
                             anchor=button_anchor, 
@@ -199,7 +316,7 @@ def button_4(root,df,df_cleaned,button_width,button_height,button_anchor,button_
     button4.place(relx=0.60, rely=0.8, anchor="center") 
     button4['font'] = font_buttons
 
-def button_5(root,df,df_cleaned,button_width,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons):
+def button_5(root,df,df_cleaned,dispatcher,button_width,button_height,button_anchor,button_justify,button_bg,button_fg,font_buttons):
     '''
     This function is part of the GUI setup in the opening_menu function, creating and configuring a button within the menu. 
     When clicked, it triggers the perform_PCA_options function from the tools module, which prompts the user to choose 
@@ -208,7 +325,7 @@ def button_5(root,df,df_cleaned,button_width,button_height,button_anchor,button_
     
     button5 = tk.Button(root, 
                         text="V .compute PCA",  
-                        command=lambda: tools.perform_PCA_options(df, df_cleaned),
+                        command=lambda: tools.perform_PCA_options(df, df_cleaned, run=lambda analysis, data, df_chosen: dispatcher.submit(analysis, data, df_chosen, button5)),
                         width=button_width, 
                         height=button_height, 
                         anchor=button_anchor, 
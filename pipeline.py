@@ -0,0 +1,219 @@
+'''
+Name: pipeline.py
+
+Author: Irina Simoes
+
+Description: This file contains a module that runs all the analyses of the program, for both the original and the cleaned dataset,
+    on a pool of worker processes, so that producing the full results directory scales with the number of cores.
+
+    I. Each analysis/dataset pair is a task. The tasks are independent from each other, as each one writes its own file
+       in the results directory, so they can run in any order.
+
+    II. The tasks run on a concurrent.futures process pool rather than on threads, given that matplotlib figures aren't
+        thread-safe. Each worker uses the non-interactive Agg backend & closes its figures once they are saved.
+        The 'spawn' start method is used so that the workers don't inherit the state of the parent (e.g. the tkinter GUI).
+
+    III. Each task is timed in the worker and a report with the duration of each task is printed when the pipeline finishes.
+
+    IV. Before running a task, the results cache (cache.py) is checked, so that a task whose data and parameters didn't change
+        since its file was saved returns that file straight away.
+
+    V. The workers are configured with the logging settings of the parent (instrument.py), so that their progress messages
+       and timing records end up on the same console and JSON log file.
+
+References:
+    - https://docs.python.org/3/library/concurrent.futures.html#processpoolexecutor
+    - https://docs.python.org/3/library/multiprocessing.html#contexts-and-start-methods
+    - https://matplotlib.org/stable/users/faq.html#work-with-threads
+'''
+
+import dataclasses
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cache
+import core
+import helpers
+import instrument
+from instrument import log
+
+# Tasks run by the pipeline: (analysis, dataset). The text summaries and the cleanup are only computed on the original
+# dataset, as in the GUI, while the plots are generated for both datasets.
+TASKS = [('summary', 'original'), ('outliers', 'original'), ('clean', 'original'),
+         ('pairplot', 'original'), ('pairplot', 'cleaned'),
+         ('histograms', 'original'), ('histograms', 'cleaned'),
+         ('pca', 'original'), ('pca', 'cleaned')]
+
+# Files written by each analysis in the results directory, formatted with the dataset name for the plots
+OUTPUT_FILES = {'summary': 'I.variables_summary.txt',
+                'outliers': 'II.outliers_summary.txt',
+                'clean': 'II.dataframe_cleaned.csv',
+                'pairplot': 'III.pairplot_{data}.png',
+                'histograms': 'IV.histograms_{data}.png',
+                'pca': 'V.PCA_{data}.png'}
+
+
+def output_file(analysis, data):
+    '''
+    This function returns the name of the file written by an analysis for the given dataset (original or cleaned).
+    '''
+
+    return OUTPUT_FILES[analysis].format(data=data)
+
+
+def task_key(analysis, data, df, params=None, spec=None):
+    '''
+    This function returns the results cache key of a task, i.e. of an analysis on a DataFrame with its parameters and the
+    spec of the dataset (label, numeric columns & palette).
+    '''
+
+    return cache.make_key(df, analysis, {'data': data, 'file': output_file(analysis, data), **(params or {}),
+                                         'spec': dataclasses.asdict(spec or core.IRIS)})
+
+
+def cached_result(analysis, data, key):
+    '''
+    This function returns the result of a task from the results cache, in the same format as run_task(), or None on a miss.
+    '''
+
+    start = time.perf_counter()
+    cached_path = cache.results_cache.get(key)
+    if cached_path is None:
+        return None
+
+    log.info(f"\t{analysis} ({data}) is up to date, using {cached_path}")
+
+    return {'analysis': analysis, 'data': data, 'file_path': cached_path, 'cached': True, 'seconds': time.perf_counter() - start}
+
+
+def run_analysis(tools, analysis, data, df, params, spec=None):
+    '''
+    This function calls the tools function of an analysis in batch mode, with its params as keyword arguments and the spec of the dataset.
+    '''
+
+    if analysis == 'summary':
+        tools.descriptive_summary(df, interactive=False, spec=spec)
+    elif analysis == 'outliers':
+        tools.outliers_summary(df, interactive=False, spec=spec)
+    elif analysis == 'clean':
+        tools.outliers_cleanup(df, interactive=False, spec=spec)
+    elif analysis == 'histograms':
+        tools.generate_histogram(df, output_file(analysis, data), interactive=False, spec=spec, **params)
+    elif analysis == 'pairplot':
+        tools.generate_pairplot(df, output_file(analysis, data), interactive=False, spec=spec, **params)
+    elif analysis == 'pca':
+        tools.perform_PCA(df, output_file(analysis, data), interactive=False, spec=spec, **params)
+    else:
+        raise ValueError(f"Unknown analysis '{analysis}'")
+
+
+def run_task(analysis, data, df, use_cache=True, params=None, spec=None):
+    '''
+    This function runs a single task in batch mode (no message box) and returns a dict with its name, the path of the file 
+    it wrote, its duration in seconds and whether the file came from the results cache.
+    The params of the analysis (e.g. the PCA engine) are passed to its tools function as keyword arguments, together with 
+    the spec of the dataset (the Iris dataset if it's None).
+    It's defined at module level so that it can be pickled and sent to the worker processes.
+    '''
+
+    start = time.perf_counter()
+    params = params or {}
+    key = task_key(analysis, data, df, params, spec)
+
+    # Return the saved file if the data & parameters didn't change since it was saved
+    if use_cache:
+        result = cached_result(analysis, data, key)
+        if result is not None:
+            return result
+
+    # Use the non-interactive backend & draw the figures on the Agg canvas, without pyplot, as nothing is shown in batch mode.
+    # The tools functions close their figures once they are saved, so that a long-running worker doesn't accumulate them
+    import matplotlib
+    matplotlib.use('Agg')
+    import figures
+    import tools
+
+    figures.use_canvas('agg')
+    with instrument.timed('task', analysis=analysis, data=data, rows=len(df)):
+        run_analysis(tools, analysis, data, df, params, spec)
+
+    # Record the file in the results cache, even if it wasn't used to compute it, so that the next run can use it
+    file_path = helpers.output_path('results', output_file(analysis, data))
+    cache.results_cache.put(key, file_path)
+
+    return {'analysis': analysis, 'data': data, 'file_path': file_path, 'cached': False, 'seconds': time.perf_counter() - start}
+
+
+def run_all(df, df_cleaned, workers=None, tasks=TASKS, use_cache=True, params=None, spec=None):
+    '''
+    This function runs all the tasks on a process pool and prints a timing report.
+
+    I. If workers is None, the pool has as many workers as there are cores. With a single worker the tasks run one after
+       the other in the current process, which avoids the cost of starting a pool.
+
+    II. Check the results cache in the current process first, so that the pool is only started if some task needs to be computed.
+        Submit each remaining task to the pool with the DataFrame of its dataset and collect the results as they complete with as_completed().
+        If a task fails, its exception is raised once all the other tasks have finished, so that one failure doesn't leave the
+        results directory half written.
+
+    III. Print the timing report, with the tasks in the order they were defined and whether their file came from the
+         results cache, and return it as a list of dicts.
+
+    The params dict maps an analysis to its keyword arguments, e.g. {'pca': {'engine': 'incremental'}}.
+    '''
+
+    datasets = {'original': df, 'cleaned': df_cleaned}
+    params = params or {}
+
+    # I.
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    start = time.perf_counter()
+    results = {}
+    errors = []
+
+    if workers == 1:
+        for analysis, data in tasks:
+            results[(analysis, data)] = run_task(analysis, data, datasets[data], use_cache, params.get(analysis), spec)
+
+    # II.
+    else:
+        pending = []
+        for analysis, data in tasks:
+            result = cached_result(analysis, data, task_key(analysis, data, datasets[data], params.get(analysis), spec)) if use_cache else None
+            if result is not None:
+                results[(analysis, data)] = result
+            else:
+                pending.append((analysis, data))
+
+        if pending:
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=min(workers, len(pending)), mp_context=context,
+                                     initializer=instrument.configure, initargs=(instrument.settings['verbosity'], instrument.settings['json_file'])) as executor:
+                futures = {executor.submit(run_task, analysis, data, datasets[data], False, params.get(analysis), spec): (analysis, data) for analysis, data in pending}
+                for future in as_completed(futures):
+                    try:
+                        results[futures[future]] = future.result()
+                    except Exception as error:
+                        errors.append((futures[future], error))
+
+    total = time.perf_counter() - start
+
+    # III.
+    report = [results.get((analysis, data), {'analysis': analysis, 'data': data, 'seconds': None, 'cached': False}) 
+              for analysis, data in tasks]
+
+    log.info(f"\nPipeline report ({workers} worker{'s' if workers > 1 else ''}):")
+    for row in report:
+        duration = 'failed' if row['seconds'] is None else f"{row['seconds']:.2f} s"
+        log.info(f"\t{row['analysis']:<12}{row['data']:<10}{duration:>10}{'  (cached)' if row['cached'] else ''}")
+    log.info(f"\t{'total (wall)':<22}{total:>10.2f} s")
+    log.info(f"\t{sum(row['cached'] for row in report)} of {len(report)} task(s) served from the results cache")
+
+    if errors:
+        (analysis, data), error = errors[0]
+        raise RuntimeError(f"{len(errors)} task(s) failed, first one was {analysis}/{data}") from error
+
+    return report
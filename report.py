@@ -0,0 +1,187 @@
+'''
+Name: report.py
+
+Author: Irina Simoes
+
+Description: This file contains a module with the report of the analyses, which collects their tables, structured results and
+    figures once and writes them as a plain text, JSON or single-file HTML report, so that other programs can read the results
+    without parsing the text summaries.
+
+    I. A Report is a list of sections, each with a title and a list of blocks: a table (a DataFrame or Series), data (plain
+       lists, dicts & numbers, with an optional text version) or a figure. The figures are rendered to PNG once, when they are
+       added, and closed, so that the report doesn't keep them open.
+
+    II. Each format is rendered into an in-memory buffer in a single pass over the sections, and saved in one write with
+        save_text_file() from the helpers module, so that the file is never partially written:
+            - txt: the tables as pandas prints them & the text version of the data, with the name of each figure;
+            - json: {"title": ..., "sections": [{"title": ..., "blocks": [...]}]}, with each table in pandas' "split" orientation
+              ({"index": [...], "columns": [...], "data": [[...]]}) and each figure's name & size;
+            - html: the tables as HTML tables and the figures embedded as base64 data URIs, so that the report is a single file.
+
+References:
+    - https://docs.python.org/3/library/io.html#io.StringIO
+    - https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.to_json.html
+    - https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.to_html.html
+    - https://developer.mozilla.org/en-US/docs/Web/URI/Schemes/data
+'''
+
+import base64
+import html
+import io
+import json
+from datetime import datetime, timezone
+import pandas as pd
+import figures
+import helpers
+
+# Formats a report can be written in, and the file extension of each
+REPORT_FORMATS = {'txt': '.txt', 'json': '.json', 'html': '.html'}
+
+HTML_STYLE = '''body { font-family: sans-serif; color: #2F3E38; margin: 2em auto; max-width: 1100px; }
+h1, h2 { color: #5E7F73; } h3 { margin-bottom: 0.3em; }
+table { border-collapse: collapse; font-size: 0.85em; margin-bottom: 1em; }
+th, td { border: 1px solid #CCD5D1; padding: 0.2em 0.6em; text-align: right; }
+img { max-width: 100%; } pre { background: #F4F6F5; padding: 0.6em; }'''
+
+
+class Report:
+    '''
+    This class collects the sections of a report and writes them in any of the REPORT_FORMATS:
+
+        report = Report('Iris dataset analysis')
+        section = report.section('Descriptive summary')
+        section.append(('table', 'Overall Descriptive Statistics', result.overall))
+        report.save('results', 'VI.report', ['txt', 'json', 'html'])
+    '''
+
+    def __init__(self, title):
+        self.title = title
+        self.created = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        self.sections = []
+
+    def section(self, title):
+        '''
+        This method adds a section to the report and returns its list of blocks, to which the blocks are appended:
+        ('table', name, frame), ('data', name, obj, text) or ('figure', name, png_bytes, (width, height)).
+        '''
+
+        blocks = []
+        self.sections.append((title, blocks))
+
+        return blocks
+
+    # _____________________ WRITERS _____________________
+    def _write_txt(self, buffer):
+        buffer.write(f"{self.title}\n{'=' * len(self.title)}\nCreated: {self.created}\n\n")
+        for counter, (title, blocks) in enumerate(self.sections, start=1):
+            buffer.write(f"({counter}) {title}\n\n")
+            for kind, name, *content in blocks:
+                if kind == 'table':
+                    buffer.write(f"{name}:\n{content[0].to_string()}\n\n")
+                elif kind == 'data':
+                    text = content[1] if content[1] is not None else json.dumps(content[0], indent=2)
+                    buffer.write(f"{name}:\n{text}\n\n")
+                else:
+                    buffer.write(f"[Figure: {name}, {content[1][0]}x{content[1][1]} px]\n\n")
+
+    def _write_json(self, buffer):
+        sections = [{'title': title, 'blocks': [json_block(block) for block in blocks]} for title, blocks in self.sections]
+        json.dump({'title': self.title, 'created': self.created, 'sections': sections}, buffer, indent=2, default=str)
+
+    def _write_html(self, buffer):
+        buffer.write(f'<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="utf-8">\n<title>{html.escape(self.title)}</title>\n'
+                     f'<style>\n{HTML_STYLE}\n</style>\n</head>\n<body>\n<h1>{html.escape(self.title)}</h1>\n'
+                     f'<p>Created: {self.created}</p>\n')
+        for title, blocks in self.sections:
+            buffer.write(f'<h2>{html.escape(title)}</h2>\n')
+            for kind, name, *content in blocks:
+                buffer.write(f'<h3>{html.escape(name)}</h3>\n')
+                if kind == 'table':
+                    frame = content[0].to_frame() if isinstance(content[0], pd.Series) else content[0]
+                    buffer.write(frame.to_html(border=0, na_rep=''))
+                    buffer.write('\n')
+                elif kind == 'data':
+                    text = content[1] if content[1] is not None else json.dumps(content[0], indent=2)
+                    buffer.write(f'<pre>{html.escape(text)}</pre>\n')
+                else:
+                    encoded = base64.b64encode(content[0]).decode('ascii')
+                    buffer.write(f'<img alt="{html.escape(name)}" width="{content[1][0]}" height="{content[1][1]}" '
+                                 f'src="data:image/png;base64,{encoded}">\n')
+        buffer.write('</body>\n</html>\n')
+
+    def render(self, fmt):
+        '''
+        This method returns the report in the given format as a string, rendered into a StringIO buffer in a single pass.
+        '''
+
+        if fmt not in REPORT_FORMATS:
+            raise ValueError(f"Unknown report format '{fmt}', expected one of {', '.join(REPORT_FORMATS)}.")
+
+        buffer = io.StringIO()
+        getattr(self, f'_write_{fmt}')(buffer)
+
+        return buffer.getvalue()
+
+    def save(self, folder, stem, formats=('txt', 'json', 'html')):
+        '''
+        This method saves the report in each of the formats, as folder/stem + extension, and returns the list of file paths.
+        '''
+
+        return [helpers.save_text_file(folder, stem + REPORT_FORMATS[fmt], self.render(fmt)) for fmt in formats]
+
+
+def json_block(block):
+    '''
+    This function returns a block of a report section as a dict which can be serialised to JSON. The tables are converted 
+    by pandas' to_json(), which turns NaN into null & NumPy scalars into numbers, and stringifies the column tuples of a MultiIndex.
+    '''
+
+    kind, name, *content = block
+    if kind == 'table':
+        frame = content[0].to_frame() if isinstance(content[0], pd.Series) else content[0]
+        return {'type': 'table', 'name': name, **json.loads(frame.to_json(orient='split'))}
+    if kind == 'data':
+        return {'type': 'data', 'name': name, 'data': content[0]}
+
+    return {'type': 'figure', 'name': name, 'width': content[1][0], 'height': content[1][1]}
+
+
+def figure_block(name, fig, dpi=None, size=None):
+    '''
+    This function renders a matplotlib figure to PNG bytes (at dpi dots per inch and with size in inches, if given) and 
+    closes it, returning the figure block of a report section.
+    '''
+
+    dpi = dpi or fig.get_dpi()
+    width, height = (int(round(inches * dpi)) for inches in (size or fig.get_size_inches()))
+    image = figures.render(fig, 'png', dpi, size)
+    figures.close(fig)
+
+    return ('figure', name, image, (width, height))
+
+
+def summary_blocks(result):
+    '''
+    This function returns the blocks of the descriptive summary (a SummaryResult from the core module).
+    '''
+
+    blocks = [('table', 'Overall Descriptive Statistics', result.overall), ('table', 'Data Types Summary', result.missing)]
+    for species, tables in result.by_species.items():
+        blocks.append(('table', f'Descriptive Statistics for {species}', tables['describe']))
+        blocks.append(('table', f'Missing Values for {species}', tables['missing']))
+        blocks.append(('table', f'Unique Values for {species}', tables['unique']))
+
+    return blocks
+
+
+def outlier_blocks(result):
+    '''
+    This function returns the blocks of the outliers (an OutlierResult from the core module): the IQR thresholds of each
+    species and the indices of the outliers, with the text of II.outliers_summary.txt as their text version.
+    '''
+
+    thresholds = result.thresholds.copy()
+    thresholds.columns = [f'{bound} {var}' for bound, var in thresholds.columns]
+
+    return [('table', 'IQR Thresholds', thresholds),
+            ('data', 'Outliers by Species & Variable', result.to_dict(), result.to_text().strip('\n'))]
@@ -0,0 +1,396 @@
+'''
+Name: service.py
+
+Author: Irina Simoes
+
+Description: This file contains a module with a long-running analysis service, which keeps the datasets, the imported
+    libraries and the fitted models in memory and answers HTTP requests, so that an analysis takes milliseconds instead of
+    the seconds of starting analysis.py, loading the dataset and importing Seaborn & Scikit-learn again.
+
+    I. The endpoints are GET requests with the dataset (?data=original or cleaned) and the format of the answer in the query:
+            - /health                                   JSON with the state of the service (datasets, queue, cache, figures & memory);
+            - /summary, /outliers                       JSON with the tables (the default) or ?format=txt for the text summaries;
+            - /cleanup                                  JSON with the rows kept & removed, or ?format=csv for the cleaned dataset;
+            - /histograms, /pca                         PNG plot (the default), ?format=svg, or ?format=json for the counts / loadings;
+            - /pairplot                                 PNG or SVG plot, with ?mode=auto|reg|fast and ?variables=petal_length,petal_width;
+       The plots also take ?dpi= and ?width= & ?height= in inches, within RENDER_LIMITS and MAX_PIXELS, /histograms takes ?bins=
+       within BINS_LIMITS and /pca & /project take ?engine= & ?dtype= (float64 or float32). Other values are answered with 400.
+            - POST /project                             CSV body with new observations, projected onto the PCA of ?data (JSON).
+       The tables are serialised as in the JSON report of the report module.
+
+    II. The requests are accepted by a ThreadingHTTPServer and run on a bounded pool of worker threads. At most
+        workers + queue_size requests are admitted at once: the others are answered straight away with 503 Service
+        Unavailable and a Retry-After header, so that a burst of requests can't pile up without bound. A request which takes
+        longer than the timeout is answered with 504, and the worker finishes it in the background.
+
+    III. The datasets are materialised once, the fitted PCA models are kept for /project, and the last cache_size answers are
+         kept in an LRU dict keyed by the endpoint & query, so that the same request is answered without computing it again.
+         The plots are drawn on the Agg canvas of the figures module, without pyplot, so that they can be drawn on several
+         threads at once, and rendered in memory & closed. Only the seaborn pair plot goes through pyplot, which isn't
+         thread-safe, so it's drawn one at a time.
+
+    Run it with: python analysis.py serve --port 8000, then e.g. curl "http://127.0.0.1:8000/pca?data=cleaned" -o pca.png
+
+References:
+    - https://docs.python.org/3/library/http.server.html
+    - https://docs.python.org/3/library/concurrent.futures.html#threadpoolexecutor
+    - https://docs.python.org/3/library/threading.html#threading.BoundedSemaphore
+    - https://developer.mozilla.org/en-US/docs/Web/HTTP/Status/503
+'''
+
+import contextlib
+import io
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import pandas as pd
+import core
+import figures
+import report
+from instrument import log, timed
+
+# Endpoints of the service and the formats of their answer, the first one being used when none is given in the query
+ENDPOINTS = {'summary': ('json', 'txt'), 'outliers': ('json', 'txt'), 'cleanup': ('json', 'csv'),
+             'histograms': ('png', 'svg', 'json'), 'pairplot': ('png', 'svg'), 'pca': ('png', 'svg', 'json'), 'project': ('json', 'csv')}
+
+# Ranges accepted for the render options & the bins of the query, and the largest image (in pixels) a request can render, so
+# that a single request can't make the resident process allocate gigabytes
+RENDER_LIMITS = {'dpi': (10, 600), 'width': (1, 40), 'height': (1, 40)}
+BINS_LIMITS = (1, 1000)
+MAX_PIXELS = 40_000_000
+
+CONTENT_TYPES = {'json': 'application/json', 'png': 'image/png', 'svg': 'image/svg+xml', 'txt': 'text/plain; charset=utf-8',
+                 'csv': 'text/csv; charset=utf-8'}
+
+
+def bounded(query, name, limits, cast=float):
+    '''
+    This function returns the value of a query parameter cast to a number, raising ValueError if it's outside its (low, high) limits.
+    '''
+
+    value = cast(query[name])
+    low, high = limits
+    if not low <= value <= high:
+        raise ValueError(f"?{name}={query[name]} is out of range, expected a value between {low} and {high}.")
+
+    return value
+
+
+def pca_options(options, query):
+    '''
+    This function returns the options of the PCA updated with the engine & dtype of the query, raising ValueError if they 
+    aren't supported.
+    '''
+
+    allowed = {'engine': core.PCA_ENGINES, 'dtype': core.PCA_DTYPES}
+    for key, values in allowed.items():
+        if key in query:
+            if query[key] not in values:
+                raise ValueError(f"Unsupported ?{key}={query[key]}, expected one of {', '.join(values)}.")
+            options[key] = query[key]
+
+    return options
+
+
+class ServiceBusy(RuntimeError):
+    '''
+    Raised when the worker pool and its queue are full, answered with 503 Service Unavailable.
+    '''
+
+
+class AnalysisService:
+    '''
+    This class runs the analyses of the endpoints on warm datasets, with a bounded pool of worker threads.
+    handle() returns the answer of a request as a (content type, bytes) tuple.
+    '''
+
+    def __init__(self, df, df_cleaned, spec=None, params=None, workers=2, queue_size=8, timeout=120, cache_size=32):
+        self.datasets = {'original': df, 'cleaned': df_cleaned}
+        self.frames = {}
+        self.spec = spec or core.IRIS
+        self.params = params or {}
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='petalist-worker')
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.lock = threading.Lock()
+        self.render_lock = threading.Lock()
+        self.responses = OrderedDict()
+        self.models = {}
+        self.counters = {'requests': 0, 'cache_hits': 0, 'rejected': 0, 'pending': 0}
+        self.started = time.time()
+
+    # _____________________ STATE _____________________
+    def frame(self, data):
+        '''
+        This method returns the materialised DataFrame of a dataset, copying the rows of the cleaned dataset only once.
+        '''
+
+        if data not in self.datasets:
+            raise ValueError(f"Unknown dataset '{data}', expected one of {', '.join(self.datasets)}.")
+        with self.lock:
+            if data not in self.frames:
+                self.frames[data] = core.materialize(self.datasets[data])
+            return self.frames[data]
+
+    def health(self):
+        with self.lock:
+            return {'status': 'ok', 'dataset': self.spec.name, 'uptime': round(time.time() - self.started, 1),
+                    'rows': {data: len(df) for data, df in self.datasets.items()}, 'workers': self.workers,
+                    'queue_size': self.queue_size, 'cached_responses': len(self.responses), 'models': len(self.models),
+                    **self.counters, 'figures': figures.stats()}
+
+    # _____________________ REQUESTS _____________________
+    def handle(self, endpoint, query, body=None):
+        '''
+        This method admits a request if a slot of the pool or its queue is free, runs it on a worker and waits for its answer.
+        The answers of GET requests are kept in the LRU cache.
+        '''
+
+        if endpoint == 'health':
+            return 'json', json.dumps(self.health()).encode('utf-8')
+
+        key = (endpoint, tuple(sorted(query.items())))
+        with self.lock:
+            self.counters['requests'] += 1
+            if body is None and key in self.responses:
+                self.responses.move_to_end(key)
+                self.counters['cache_hits'] += 1
+                return self.responses[key]
+
+        # II.
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.counters['rejected'] += 1
+            raise ServiceBusy(f"{self.workers + self.queue_size} requests are already running or queued.")
+
+        with self.lock:
+            self.counters['pending'] += 1
+        future = self.executor.submit(self.run, endpoint, query, body)
+        future.add_done_callback(self._release)
+        answer = future.result(timeout=self.timeout)
+
+        if body is None:
+            with self.lock:
+                self.responses[key] = answer
+                while len(self.responses) > self.cache_size:
+                    self.responses.popitem(last=False)
+
+        return answer
+
+    def _release(self, future):
+        with self.lock:
+            self.counters['pending'] -= 1
+        self.slots.release()
+
+    def run(self, endpoint, query, body=None):
+        '''
+        This method computes the answer of an endpoint, on a worker thread.
+        '''
+
+        query = dict(query)
+        data = query.pop('data', 'original')
+        fmt = query.pop('format', ENDPOINTS[endpoint][0])
+        if fmt not in ENDPOINTS[endpoint]:
+            raise ValueError(f"Unsupported format '{fmt}' for /{endpoint}, expected one of {', '.join(ENDPOINTS[endpoint])}.")
+        df = self.frame(data)
+
+        with timed('compute', analysis=endpoint, data=data, rows=len(df)):
+            answer = getattr(self, f'_{endpoint}')(df, data, fmt, query, body)
+
+        if fmt == 'json':
+            answer = json.dumps(answer, default=str)
+        return fmt, answer if isinstance(answer, bytes) else answer.encode('utf-8')
+
+    def _render(self, draw, fmt, query, render=None, pyplot=False):
+        # Draw the figure & render it in memory with the dpi & size (in inches) of the query or else of the params, then close it.
+        # The figures are drawn on the Agg canvas, without pyplot, except the seaborn pair plot, which is drawn one at a time
+        # The values of the query are checked against RENDER_LIMITS before drawing, and the size of the image before rendering it
+        render = dict(render or {})
+        if 'dpi' in query:
+            render['dpi'] = bounded(query, 'dpi', RENDER_LIMITS['dpi'])
+        if 'width' in query and 'height' in query:
+            render['size'] = (bounded(query, 'width', RENDER_LIMITS['width']), bounded(query, 'height', RENDER_LIMITS['height']))
+
+        with self.render_lock if pyplot else contextlib.nullcontext():
+            fig = draw()
+        try:
+            dpi = render.get('dpi') or fig.dpi
+            width, height = render.get('size') or fig.get_size_inches()
+            if width * dpi * height * dpi > MAX_PIXELS:
+                raise ValueError(f"The image would be {width * dpi:.0f} x {height * dpi:.0f} pixels, "
+                                 f"above the limit of {MAX_PIXELS:,} pixels; lower ?dpi, ?width or ?height.")
+            return figures.render(fig, fmt, **render)
+        finally:
+            figures.close(fig)
+
+    # _____________________ ENDPOINTS _____________________
+    def _summary(self, df, data, fmt, query, body):
+        result = core.describe(df, self.spec)
+        if fmt == 'txt':
+            return result.to_text()
+        return {'data': data, 'blocks': [report.json_block(block) for block in report.summary_blocks(result)]}
+
+    def _outliers(self, df, data, fmt, query, body):
+        result = core.detect_outliers(df, self.spec)
+        if fmt == 'txt':
+            return result.to_text()
+        return {'data': data, 'blocks': [report.json_block(block) for block in report.outlier_blocks(result)]}
+
+    def _cleanup(self, df, data, fmt, query, body):
+        result = core.detect_outliers(df, self.spec)
+        if fmt == 'csv':
+            return core.remove_outliers(df, self.spec).to_csv(index=False)
+        removed = result.outlier_rows.to_numpy().nonzero()[0]
+        return {'data': data, 'rows': len(df) - len(removed), 'removed': removed.tolist()}
+
+    def _histograms(self, df, data, fmt, query, body):
+        options, render = figures.split_options(self.params.get('histograms'))
+        bins = bounded(query, 'bins', BINS_LIMITS, int) if 'bins' in query else options.get('bins', 10)
+        if fmt == 'json':
+            return {'data': data, **report.json_block(('table', 'Histogram Counts', core.histogram_counts(df, bins, self.spec).to_frame()))}
+        return self._render(lambda: core.histogram(df, bins, self.spec).figure, fmt, query, render)
+
+    def _pairplot(self, df, data, fmt, query, body):
+        options, render = figures.split_options(self.params.get('pairplot'))
+        if 'mode' in query:
+            options['mode'] = query['mode']
+        if 'variables' in query:
+            options['variables'] = query['variables'].split(',')
+        return self._render(lambda: core.pairplot(df, spec=self.spec, **options).figure, fmt, query, render, pyplot=True)
+
+    def _pca(self, df, data, fmt, query, body):
+        options, render = figures.split_options(self.params.get('pca'))
+        options = pca_options(options, query)
+        if fmt == 'json':
+            model, _ = core.fit_pca(df, spec=self.spec, **options)
+            self.models[(data, tuple(sorted(options.items())))] = model
+            return {'data': data, 'explained_variance_ratio': model.explained_variance_ratio.tolist(),
+                    **report.json_block(('table', 'Loadings', model.loadings))}
+
+        def draw():
+            result = core.pca(df, spec=self.spec, **options)
+            self.models[(data, tuple(sorted(options.items())))] = result.model
+            return result.figure
+
+        return self._render(draw, fmt, query, render)
+
+    def _project(self, df, data, fmt, query, body):
+        if not body:
+            raise ValueError("POST /project needs a CSV body with the new observations.")
+        options = figures.split_options(self.params.get('pca'))[0]
+        options = pca_options(options, query)
+        key = (data, tuple(sorted(options.items())))
+        if key not in self.models:
+            self.models[key], _ = core.fit_pca(df, spec=self.spec, **options)
+        model = self.models[key]
+
+        new_df = pd.read_csv(io.BytesIO(body))
+        projected = new_df.assign(**dict(zip(model.names, model.transform(new_df).T)))
+        if fmt == 'csv':
+            return projected.to_csv(index=False)
+        return {'data': data, 'rows': json.loads(projected.to_json(orient='records'))}
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    '''
+    This class turns the HTTP requests into calls of the AnalysisService of the server, and its exceptions into status codes.
+    '''
+
+    server_version = 'Petalist/1.0'
+
+    def do_GET(self):
+        self._answer()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self._answer(self.rfile.read(length))
+
+    def _answer(self, body=None):
+        parts = urlsplit(self.path)
+        endpoint = parts.path.strip('/') or 'health'
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        headers = {}
+
+        if endpoint != 'health' and endpoint not in ENDPOINTS:
+            status, fmt, payload = 404, 'json', {'error': f"Unknown endpoint /{endpoint}, expected one of {', '.join(ENDPOINTS)}."}
+        elif (endpoint == 'project') != (body is not None):
+            status, fmt, payload = 405, 'json', {'error': f"Use {'POST' if endpoint == 'project' else 'GET'} for /{endpoint}."}
+        else:
+            try:
+                fmt, payload = self.server.service.handle(endpoint, query, body)
+                status = 200
+            except ServiceBusy as error:
+                status, fmt, payload, headers = 503, 'json', {'error': str(error)}, {'Retry-After': '1'}
+            except TimeoutError:
+                status, fmt, payload = 504, 'json', {'error': f"/{endpoint} took longer than {self.server.service.timeout} s."}
+            except (ValueError, KeyError) as error:
+                status, fmt, payload = 400, 'json', {'error': str(error)}
+            except Exception as error:
+                log.error(f"\tRequest {self.path} failed", exc_info=True)
+                status, fmt, payload = 500, 'json', {'error': str(error)}
+
+        if not isinstance(payload, bytes):
+            payload = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', CONTENT_TYPES[fmt])
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # Send the access log to the program's logger instead of stderr
+        log.debug(f"\t{self.address_string()} {format % args}")
+
+
+class AnalysisServer(ThreadingHTTPServer):
+    '''
+    ThreadingHTTPServer holding the AnalysisService its handlers call.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        self.request_queue_size = service.workers + service.queue_size
+        super().__init__(address, RequestHandler)
+        self.service = service
+
+
+def serve(df, df_cleaned, host='127.0.0.1', port=8000, workers=2, queue_size=8, params=None, spec=None):
+    '''
+    This function warms up the libraries used by the analyses, starts the service and answers requests until interrupted.
+    '''
+
+    import matplotlib
+    matplotlib.use('Agg')
+    figures.use_canvas('agg')
+
+    with timed('load', analysis='libraries'):
+        import matplotlib.pyplot  # noqa: F401
+        import seaborn  # noqa: F401
+        import sklearn.decomposition  # noqa: F401
+
+    service = AnalysisService(df, df_cleaned, spec, params, workers, queue_size)
+    server = AnalysisServer((host, port), service)
+    log.info(f"\tServing the {service.spec.name} dataset on http://{host}:{server.server_port} with {workers} worker(s) "
+             f"and a queue of {queue_size} request(s). Press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info("\tService stopped.")
+    finally:
+        server.server_close()
+        service.close()
+
+    return service
@@ -0,0 +1,322 @@
+'''
+Name: streaming.py
+
+Author: Irina Simoes
+
+Description: This file contains a module that computes the descriptive summary of a CSV file in a single pass over chunks of
+    rows, so that datasets which don't fit in memory can be summarised with bounded memory.
+
+    I. The file is read with pd.read_csv(chunksize=...), which returns an iterator of DataFrames instead of one DataFrame.
+
+    II. Each group (the overall dataset and each species) has a set of accumulators which are updated with each chunk and can be
+        merged with each other:
+            - count, mean & variance of each numeric variable, merged with Welford/Chan's parallel algorithm;
+            - min, max & missing values;
+            - quantiles, estimated with a KLL sketch, which keeps a bounded number of values. While the sketch hasn't
+              compacted any value the quantiles are exact;
+            - number of unique values, estimated with HyperLogLog. While there are few distinct values they are counted
+              exactly, so that small datasets get exact counts;
+            - frequency of each label, counted exactly as the number of labels is small.
+
+    III. The accumulators are turned into the same tables as pandas describe(include='all'), isnull().sum() & nunique(), so
+         that the report has the same layout as the in-memory summary.
+
+References:
+    - https://pandas.pydata.org/docs/user_guide/io.html#iterating-through-files-chunk-by-chunk
+    - https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm
+    - https://arxiv.org/abs/1603.05346 (Karnin, Lang & Liberty - Optimal Quantile Approximation in Streams)
+    - https://en.wikipedia.org/wiki/HyperLogLog
+'''
+
+from collections import Counter
+import numpy as np
+import pandas as pd
+
+
+# _____________________ MOMENTS _____________________
+class MomentsAccumulator:
+    '''
+    This class keeps the count, mean, sum of squared deviations (M2), min, max & missing values of a set of numeric variables.
+    All the attributes are NumPy arrays with one item per variable, so that each update is vectorised across the variables.
+    '''
+
+    def __init__(self, num_variables):
+        self.count = np.zeros(num_variables)
+        self.mean = np.zeros(num_variables)
+        self.m2 = np.zeros(num_variables)
+        self.min = np.full(num_variables, np.inf)
+        self.max = np.full(num_variables, -np.inf)
+        self.missing = np.zeros(num_variables, dtype=np.int64)
+
+    def update(self, values):
+        '''
+        This method adds a 2D array of values (rows x variables), computing the moments of the batch and merging them.
+        '''
+
+        valid = ~np.isnan(values)
+        batch = MomentsAccumulator(values.shape[1])
+        batch.count = valid.sum(axis=0).astype(float)
+        batch.missing = (~valid).sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            batch.mean = np.where(batch.count > 0, np.nansum(values, axis=0) / batch.count, 0.0)
+            batch.m2 = np.nansum((values - batch.mean) ** 2, axis=0)
+        batch.min = np.where(batch.count > 0, np.nanmin(np.where(valid, values, np.inf), axis=0), np.inf)
+        batch.max = np.where(batch.count > 0, np.nanmax(np.where(valid, values, -np.inf), axis=0), -np.inf)
+        self.merge(batch)
+
+    def merge(self, other):
+        '''
+        This method merges the moments of another accumulator, using Chan's formula for the mean & M2 of the union.
+        '''
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = np.where(count > 0, other.count / count, 0.0)
+        self.mean = self.mean + delta * ratio
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * ratio
+        self.count = count
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.missing = self.missing + other.missing
+
+    @property
+    def std(self):
+        # Sample standard deviation (ddof=1), as in pandas describe()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, np.sqrt(self.m2 / (self.count - 1)), np.nan)
+
+
+# _____________________ QUANTILES _____________________
+class KLLSketch:
+    '''
+    This class estimates the quantiles of a stream of values with a KLL sketch. The values are kept in levels, where a value
+    at level h stands for 2^h values of the stream. When a level is full it's sorted and every other value (starting at a
+    random offset) is promoted to the next level, which halves its size. The capacity of a level decreases geometrically with
+    its distance to the top level, so the total memory is bounded by about 3k values.
+    '''
+
+    def __init__(self, k=200, seed=0):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(int(np.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(self.levels[level])
+                # Keep an odd item back if the level has an odd number of items, so that no weight is lost
+                if len(items) % 2 == 1:
+                    leftover, items = items[:1], items[1:]
+                else:
+                    leftover = np.empty(0)
+                promoted = items[self.rng.integers(2)::2]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+                self.levels[level] = leftover
+            level += 1
+
+    def update(self, values):
+        values = values[~np.isnan(values)]
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other):
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self._compress()
+
+    def quantile(self, q):
+        '''
+        This method returns the q-quantile. While every value is still at level 0 it's computed exactly, with the same
+        linear interpolation as pandas; otherwise it's the first value whose cumulative weight reaches q.
+        '''
+
+        if len(self.levels) == 1:
+            return np.quantile(self.levels[0], q) if len(self.levels[0]) else np.nan
+
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items_h), 2 ** h) for h, items_h in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        cumulative = np.cumsum(weights[order])
+        position = np.searchsorted(cumulative, q * cumulative[-1], side='left')
+
+        return items[order][min(position, len(items) - 1)]
+
+
+# _____________________ DISTINCT VALUES _____________________
+class HyperLogLog:
+    '''
+    This class estimates the number of distinct values of a stream. Each value is hashed to 64 bits; the first p bits pick one of
+    2^p registers and the register keeps the maximum position of the first 1-bit in the remaining bits. The estimate is the
+    harmonic mean of 2^register, with the linear counting correction for small cardinalities.
+    While there are fewer than exact_limit distinct hashes they are kept in a set and counted exactly.
+    '''
+
+    def __init__(self, p=12, exact_limit=2048):
+        self.p = p
+        self.registers = np.zeros(2 ** p, dtype=np.uint8)
+        self.exact = set()
+        self.exact_limit = exact_limit
+
+    def _add_to_registers(self, hashes):
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        remainder = hashes & np.uint64((1 << (64 - self.p)) - 1)
+        # Position of the first 1-bit in the remaining 64-p bits, from the left
+        bit_length = np.zeros(len(remainder), dtype=np.int64)
+        nonzero = remainder > 0
+        bit_length[nonzero] = np.frexp(remainder[nonzero].astype(np.float64))[1]
+        rank = (64 - self.p - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def update(self, values):
+        values = values[pd.notna(values)]
+        hashes = pd.util.hash_array(np.asarray(values)).astype(np.uint64)
+        self._add_to_registers(hashes)
+        if self.exact is not None:
+            self.exact.update(np.unique(hashes).tolist())
+            if len(self.exact) > self.exact_limit:
+                self.exact = None
+
+    def merge(self, other):
+        self.registers = np.maximum(self.registers, other.registers)
+        if self.exact is not None and other.exact is not None:
+            self.exact |= other.exact
+            if len(self.exact) > self.exact_limit:
+                self.exact = None
+        else:
+            self.exact = None
+
+    def count(self):
+        if self.exact is not None:
+            return len(self.exact)
+
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m ** 2 / np.sum(2.0 ** -self.registers.astype(float))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * np.log(m / zeros)
+
+        return int(round(estimate))
+
+
+# _____________________ GROUP SUMMARY _____________________
+class GroupAccumulator:
+    '''
+    This class keeps all the accumulators of one group of rows (the whole dataset or one species).
+    '''
+
+    def __init__(self, variables, columns, label):
+        self.variables = list(variables)
+        self.columns = list(columns)
+        self.label = label
+        self.moments = MomentsAccumulator(len(self.variables))
+        self.sketches = {var: KLLSketch() for var in self.variables}
+        self.distinct = {col: HyperLogLog() for col in self.columns}
+        self.label_counts = Counter()
+        self.label_missing = 0
+
+    def update(self, chunk):
+        values = chunk[self.variables].to_numpy(dtype=float)
+        self.moments.update(values)
+        for position, var in enumerate(self.variables):
+            self.sketches[var].update(values[:, position])
+        for col in self.columns:
+            self.distinct[col].update(chunk[col].to_numpy())
+        self.label_counts.update(chunk[self.label].dropna().tolist())
+        self.label_missing += int(chunk[self.label].isna().sum())
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        for var in self.variables:
+            self.sketches[var].merge(other.sketches[var])
+        for col in self.columns:
+            self.distinct[col].merge(other.distinct[col])
+        self.label_counts.update(other.label_counts)
+        self.label_missing += other.label_missing
+
+    def describe(self):
+        '''
+        This method returns the same table as pandas describe(include='all') for the group.
+        '''
+
+        table = {}
+        moments = self.moments
+        for position, var in enumerate(self.variables):
+            sketch = self.sketches[var]
+            table[var] = pd.Series({'count': moments.count[position],
+                                    'mean': moments.mean[position] if moments.count[position] else np.nan,
+                                    'std': moments.std[position],
+                                    'min': moments.min[position] if moments.count[position] else np.nan,
+                                    '25%': sketch.quantile(0.25),
+                                    '50%': sketch.quantile(0.5),
+                                    '75%': sketch.quantile(0.75),
+                                    'max': moments.max[position] if moments.count[position] else np.nan}, dtype=float)
+
+        # Label column: count, unique, most frequent label & its frequency
+        top, freq = self.label_counts.most_common(1)[0] if self.label_counts else (np.nan, np.nan)
+        table[self.label] = pd.Series({'count': np.int64(sum(self.label_counts.values())),
+                                       'unique': len(self.label_counts),
+                                       'top': top,
+                                       'freq': np.int64(freq)}, dtype=object)
+
+        index = ['count', 'unique', 'top', 'freq', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+        return pd.DataFrame({col: table[col].reindex(index) for col in self.columns if col in table})
+
+    def missing(self):
+        missing = dict(zip(self.variables, self.moments.missing.tolist()))
+        missing[self.label] = self.label_missing
+        return pd.Series({col: missing[col] for col in self.columns if col in missing}, dtype=np.int64)
+
+    def nunique(self):
+        return pd.Series({col: self.distinct[col].count() for col in self.columns}, dtype=np.int64)
+
+
+def summarise_chunks(chunks, label='species', variables=None):
+    '''
+    This function summarises an iterable of DataFrames (e.g. the chunks returned by pd.read_csv(chunksize=...)) in one pass.
+
+    I. The numeric variables summarised are the given variables, or else all the numeric columns of the first chunk but the label.
+       Only those variables and the label are summarised, as the batch summary does with the columns of a DatasetSpec.
+
+    II. For each chunk, update the overall accumulator, then group the chunk by label and update the accumulator of each label,
+        creating it the first time the label is seen. Only the accumulators are kept, so memory doesn't grow with the number of rows.
+
+    III. Return the overall accumulator and a dict with the accumulator of each label, sorted by label as in pandas groupby().
+         The overall accumulator is None if there were no rows at all.
+    '''
+
+    overall = None
+    groups = {}
+
+    for chunk in chunks:
+        # Empty chunks (e.g. the only chunk of a file with a header but no rows) have nothing to add
+        if chunk.empty:
+            continue
+
+        # I.
+        if overall is None:
+            if variables is None:
+                variables = [col for col in chunk.select_dtypes(include='number').columns if col != label]
+            variables = list(variables)
+            columns = variables + [label]
+            overall = GroupAccumulator(variables, columns, label)
+
+        # II.
+        overall.update(chunk)
+        for species, group_df in chunk.groupby(label, observed=True, sort=False):
+            if species not in groups:
+                groups[species] = GroupAccumulator(variables, columns, label)
+            groups[species].update(group_df)
+
+    # III.
+    return overall, dict(sorted(groups.items()))
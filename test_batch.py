@@ -0,0 +1,58 @@
+'''
+Name: test_batch.py
+
+Author: Irina Simoes
+
+Description: This file contains the regression tests of the batch mode of analysis.py, run with pytest. Each test runs in a
+    fresh Python process where tkinter can't be imported, as on a headless server, by putting a tkinter package that raises
+    ImportError first on PYTHONPATH, to check that the batch commands, the service & the benchmarks never load Tk.
+
+References:
+    - https://docs.python.org/3/library/subprocess.html
+    - https://docs.pytest.org/en/stable/how-to/tmp_path.html
+'''
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def headless_env(tmp_path):
+    # Shadow tkinter with a package which can't be imported, and keep the dataset cache & results in the temporary directory
+    blocked = tmp_path / 'blocked'
+    (blocked / 'tkinter').mkdir(parents=True)
+    (blocked / 'tkinter' / '__init__.py').write_text("raise ImportError('No module named _tkinter')\n")
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([str(blocked), ROOT] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    env['PETALIST_CACHE_DIR'] = str(tmp_path / 'cache')
+    env['PETALIST_OUTPUT_DIR'] = str(tmp_path / 'output')
+
+    return env
+
+
+def test_tkinter_is_blocked(headless_env):
+    completed = subprocess.run([sys.executable, '-c', 'import tkinter'], env=headless_env, capture_output=True, text=True)
+
+    assert completed.returncode != 0 and 'ImportError' in completed.stderr
+
+
+def test_batch_command_runs_without_tkinter(headless_env, tmp_path):
+    completed = subprocess.run([sys.executable, os.path.join(ROOT, 'analysis.py'), 'summary', '--no-cache'],
+                               env=headless_env, cwd=tmp_path, capture_output=True, text=True)
+
+    assert completed.returncode == 0, completed.stderr
+    assert (tmp_path / 'output' / 'results' / 'I.variables_summary.txt').exists()
+
+
+def test_service_and_benchmark_import_without_tkinter(headless_env, tmp_path):
+    completed = subprocess.run([sys.executable, '-c', "import sys, analysis, service, benchmark; "
+                                                      "assert 'tkinter' not in sys.modules and 'menu' not in sys.modules"],
+                               env=headless_env, cwd=tmp_path, capture_output=True, text=True)
+
+    assert completed.returncode == 0, completed.stderr
@@ -0,0 +1,123 @@
+'''
+Name: test_figures.py
+
+Author: Irina Simoes
+
+Description: This file contains the regression tests of the figures module, run with pytest. The plots are drawn 100 times on
+    the Agg canvas, where the figures are pooled (the pair plot in its fast mode, as the seaborn one is drawn by pyplot), to
+    check that the figures open & the memory of the process stay flat and that no result returned to the caller holds a
+    pooled figure. The seaborn pair plot of the GUI, drawn by pyplot, is checked in the same way on a small frame with fewer
+    runs, as each run takes about a second.
+
+References:
+    - https://docs.pytest.org/en/stable/how-to/tmp_path.html
+'''
+
+import gc
+
+import pytest
+
+import benchmark
+import figures
+import tools
+
+RUNS = 100
+
+# Runs of the seaborn pair plot, which is much slower than the plots drawn on the Agg canvas
+PYPLOT_RUNS = 25
+
+
+@pytest.fixture
+def agg_canvas(tmp_path, monkeypatch):
+    # Save the plots in a temporary results directory, and draw them on the Agg canvas with a fresh manager
+    (tmp_path / 'results').mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(figures, 'manager', figures.FigureManager())
+    canvas = figures.settings['canvas']
+    figures.use_canvas('agg')
+    yield
+    figures.use_canvas(canvas)
+
+
+@pytest.fixture
+def pyplot_canvas(tmp_path, monkeypatch):
+    # Same as agg_canvas, but with the pyplot canvas of the GUI (on the Agg backend, as no window is shown)
+    import matplotlib
+    matplotlib.use('Agg')
+
+    (tmp_path / 'results').mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(figures, 'manager', figures.FigureManager())
+    canvas = figures.settings['canvas']
+    figures.use_canvas('pyplot')
+    yield
+    figures.use_canvas(canvas)
+
+
+@pytest.fixture(scope='module')
+def df():
+    return tools.get_dataset()
+
+
+PLOTS = {'generate_histogram': lambda df: tools.generate_histogram(df, 'histograms.png', interactive=False),
+         'generate_pairplot': lambda df: tools.generate_pairplot(df, 'pairplot.png', interactive=False, mode='fast'),
+         'perform_PCA': lambda df: tools.perform_PCA(df, 'PCA.png', interactive=False)}
+
+
+@pytest.mark.parametrize('plot', list(PLOTS))
+def test_repeated_plots_reuse_pooled_figures(agg_canvas, df, plot):
+    for run in range(RUNS):
+        if run == benchmark.FIGURE_WARMUP_RUNS:
+            gc.collect()
+            baseline = figures.process_memory()
+        PLOTS[plot](df)
+
+    gc.collect()
+    stats = figures.stats()
+
+    assert stats['open'] == 0
+    assert stats['pooled'] <= figures.manager.pool_size
+    assert stats['created'] + stats['reused'] == RUNS
+    assert stats['reused'] >= RUNS - stats['pooled']
+    if baseline is not None:
+        assert stats['process_bytes'] - baseline <= benchmark.FIGURE_MEMORY_BUDGET
+
+
+def test_repeated_seaborn_pairplots_close_their_figures(pyplot_canvas, df):
+    import matplotlib.pyplot as plt
+
+    small = df.groupby('species', observed=True).head(10)
+    for run in range(PYPLOT_RUNS):
+        if run == benchmark.FIGURE_WARMUP_RUNS:
+            gc.collect()
+            baseline = figures.process_memory()
+        result = tools.generate_pairplot(small, 'pairplot.png', interactive=False, mode='auto',
+                                         variables=['petal_length', 'petal_width'])
+        assert result.mode == 'reg'
+        assert plt.get_fignums() == []
+
+    gc.collect()
+    stats = figures.stats()
+
+    assert stats['open'] == 0
+    assert stats['created'] == stats['closed'] == PYPLOT_RUNS
+    if baseline is not None:
+        assert stats['process_bytes'] - baseline <= benchmark.FIGURE_MEMORY_BUDGET
+
+
+def test_results_do_not_hold_pooled_figures(agg_canvas, df):
+    first = tools.perform_PCA(df, 'PCA.png', interactive=False)
+    second = tools.perform_PCA(df, 'PCA.png', interactive=False)
+
+    assert first.figure is None and second.figure is None
+    assert figures.stats()['reused'] == 1
+
+
+def test_new_figure_after_close_is_empty(agg_canvas):
+    fig = figures.new_figure(name='test')
+    fig.add_subplot()
+    figures.close(fig)
+
+    reused = figures.new_figure(name='test')
+
+    assert reused is fig and not reused.axes
@@ -4,59 +4,125 @@ Name: tools.py
 Author: Irina Simoes
 
 Description: This file contains a module with all the functions that perform the core tasks on the menu.py.
+    The analyses themselves are computed by the core.py module, which returns result objects; the functions in this module
+    save those results in the results directory and notify the user, either with a message box (GUI) or a print (batch mode).
+    Every analysis accepts a DatasetSpec (core.py) describing the dataset, its label & numeric columns; the Iris dataset by default.
 
 '''
 
-import tkinter as tk
-from tkinter import messagebox
-import tkinter.font as font
-import seaborn as sns
-import matplotlib.pyplot as plt
-import pandas as pd
-import numpy as np
+import dataclasses
 import os
-import sys
+import numpy as np
+import pandas as pd
 import helpers
-from sklearn import datasets
-from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import PCA
+import datastore
+import core
+import figures
+import cache
+import report
+from instrument import log, timed
+
+# Cache of the mask of the rows without outliers, see cleaned_mask()
+CLEANED_MASK_FILE = 'II.dataframe_cleaned_mask.npz'
+
+# _____________________ USER NOTIFICATION _____________________
+# Titles & messages of the message boxes shown by notify_user() once the output of each analysis is saved
+NOTIFICATIONS = {
+    'summary': ("Descriptive summary",
+                "A text file with a descriptive summary of each variable will be saved in the results directory. Please click OK to open the file."),
+    'outliers': ("Outlier summary",
+                 "A text file with an outlier summary by species will be saved in the results directory. Please click OK to open the file"),
+    'clean': ("Outliers cleanup",
+              "A CSV file containing the Iris dataset without outliers will be saved in the results directory. Please click OK to open the file."),
+    'histograms': ("Generate histograms",
+                   "A histogram of each variable will be plotted and saved in the results directory. Please click OK to open the file."),
+    'pairplot': ("Generate pair scatter plot",
+                 "A scatter plot of each pair of variables will be created and saved in the results directory. Please click OK to open the file."),
+    'pca': ("Principal Componenent Analysis",
+            "A scatter plot of the computed PCA will be created and saved in the results directory. Please click OK to open the file."),
+    'report': ("Generate report",
+               "A report with the summaries, outliers & plots of the dataset will be saved in the results directory. Please click OK to open the file."),
+    'project': ("Project new observations",
+                "A CSV file with the new observations projected onto the principal components will be saved in the results directory. Please click OK to open the file."),
+}
+
+def notify_user(title, message, file_path, interactive=True, plot=False):
+    '''
+    This function tells the user where the output of an analysis was saved.
+
+    I. In the GUI (interactive=True) a message box prompts the user to choose to open the file or not. As per Python documentation, 
+       askokcancel returns a boolean value, so we check if response is True(OK) to open the file using the file_path returned by
+       the helpers.py functions, or to show the plot with plt.show(); if False the file will just be saved.
+       https://stackoverflow.com/questions/72626730/python-launch-text-file-in-users-default-text-editor
+       https://docs.python.org/3/library/tkinter.messagebox.html
+
+    II. In batch mode (interactive=False) no window can be opened, so the path of the file is only printed.
+    '''
+
+    # II.
+    if not interactive:
+        log.info(f"\tOutput saved to {file_path}")
+        return
+
+    # I.
+    from tkinter import messagebox  # Imported here, so that batch mode runs on hosts without tkinter (e.g. headless servers)
+    response = messagebox.askokcancel(title, message)
+
+    # If response is True open the file, otherwise just leave it saved
+    if response:
+        log.info(f"\tOutput saved to {file_path}")
+        if plot:
+            import matplotlib.pyplot as plt  # Imported here, as pyplot is slow to import and only needed to show plots
+            plt.show()
+        else:
+            os.startfile(file_path)
+        log.info(f"\tUser opened the file.")
+    else:
+        log.info(f"\tOutput saved to {file_path}")
+        log.info(f"\tUser closed the pop-up.")
+
 
 # _____________________ GET IRIS _____________________
-def get_dataset():
+@timed('load', analysis='dataset')
+def get_dataset(cache_dir=None, allow_download=True, compact=True, spec=None):
     '''
-    This function fetches the Iris dataset from the Seaborn library as a DataFrame object.
+    This function fetches the Iris dataset as a DataFrame object from the local dataset store in datastore.py.
 
-    I. Get a list of all datasets available in the Seasborn library
+    I. The Iris dataset is pinned in the data directory, so there is no need to list all datasets available in the Seaborn
+       library to find it, which would cost a network round-trip at every start of analysis.py and fail on machines without internet.
        https://github.com/mwaskom/seaborn-data
-       https://seaborn.pydata.org/generated/seaborn.get_dataset_names.html
 
-    II. Use the filter() function with a lambda to filter elements in the datasets names list returned by Seaborn 
-        containing the 'iris' string. As the previous is wrapped in list, we then access it by indexing the first and only result 
-        returned by the lambda function.
+    II. The datastore module tries its content-hashed cache first, then the pinned copy bundled in the data directory,
+        and only downloads the dataset by name with Seaborn as a last resort (unless allow_download is False).
+        The cache location can be set with the cache_dir param or the PETALIST_CACHE_DIR environment variable.
+        Another dataset can be loaded with a DatasetSpec from the core module, by name or from the CSV file of its source;
+        only its label & numeric columns are kept.
         https://seaborn.pydata.org/generated/seaborn.load_dataset.html
-        https://www.w3resource.com/python-exercises/lambda/python-lambda-exercise-39.php
 
-    III. Load the Iris dataset which is a DataFrame object by default, as the Seaborn library is closely integrated with pandas 
-         data structures. Then we use the return statement to send the DataFrame back to the caller of the function, enabling 
+    III. Unless compact is False, store the species as a Categorical and the measurements as float32 (which is lossless for 
+         their single decimal) with compact() from the core module, reporting the memory used before & after.
+         https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.memory_usage.html
+
+    IV. Use the return statement to send the DataFrame back to the caller of the function, enabling 
          analysis.py to access the Iris dataset.
-         https://seaborn.pydata.org/generated/seaborn.load_dataset.html)]
     '''
 
-    # I.
-    # Get a list of all datasets available in the Seasborn library
-    datasets_list = sns.get_dataset_names()
-
-    # II.
-    # Access the list returned by Seaborn with datasets names
-    iris_dataset = list(filter(lambda x: "iris" in x, datasets_list))[0]
-
-    # Print dataset name (uncomment for sanity check) 
-    #print(f"Dataset name is: {iris_dataset}")
+    # I. & II.
+    # Load the Iris dataset as df from the local store
+    spec = spec or core.IRIS
+    if spec.source is not None:
+        df = pd.read_csv(spec.source)
+    else:
+        df = datastore.load_dataset(spec.name, cache_dir=cache_dir, allow_download=allow_download)
+    df = df[spec.columns(df) + [spec.label]]
 
     # III.
-    # Load the Iris dataset as df
-    df = sns.load_dataset(iris_dataset)
+    if compact:
+        before = core.memory_usage(df)
+        df = core.compact(df)
+        log.info(f"\tDataset compacted from {before / 1024:.1f} KB to {core.memory_usage(df) / 1024:.1f} KB.")
 
+    # IV.
     # Return the DataFrame object
     return df
 
@@ -68,97 +134,69 @@ if __name__ == "__main__":
 
 
 # _____________________ TXT SUMMARY _____________________
-def descriptive_summary(df):
+def descriptive_summary(df, interactive=True, spec=None):
     '''
     This function creates a descriptive statistic summary of the variables in the Iris dataset.
 
-    I. Initialise an empty string to store the summary and then we add overall summary, data types summary & 
-        summary header for each species.
-
-    II. Group the DataFrame by species & initialise a counter to be used to loop through them, as demonstrated in one of the lectures.
-        Start the for loop - as we are grouping by multiple species, the group name will be a tuple so each group should be unpacked into two variables.
-        Each iteration will then generate summary statistics for each species, and concatenate it to the summary container.
+    I. Compute the summary with describe() from the core module, which returns the overall summary, data types summary & 
+       summary of each species, and format it as text.
         https://realpython.com/pandas-groupby/
-        https://realpython.com/python-for-loop/
         https://www.geeksforgeeks.org/how-to-iterate-over-dataframe-groups-in-python-pandas/
 
-    III. Call the save_text_file() function from helpers.py module to save summary in a txt file with writer mode. 
+    II. Call the save_text_file() function from helpers.py module to save summary in a txt file with writer mode. 
         https://docs.python.org/3/library/functions.html#open
-        https://stackoverflow.com/questions/72626730/python-launch-text-file-in-users-default-text-editor
         https://docs.python.org/3/library/os.path.html
 
-    IV. Show message box prompting the user to choose to open the the file or not. As per Python documentation, 
-        askokcancel returns a boolean value, so we check if response is True(OK) to save & open the file using 
-        the file_path returned by save_text_file() function; if False the txt file will just be saved.
+    III. Show message box prompting the user to choose to open the the file or not with notify_user().
         https://stackoverflow.com/questions/72626730/python-launch-text-file-in-users-default-text-editor
         https://docs.python.org/3/library/tkinter.messagebox.html
     '''
 
     # I.
-    print(f"\nStarting {__name__}/descriptive_summary()")
+    log.info(f"\nStarting {__name__}/descriptive_summary()")
 
-    # Initialise an empty string to store the summary
-    summary = ''
+    with timed('compute', analysis='summary', rows=len(df)):
+        result = core.describe(df, spec)
+    log.info(f'\tOverall & species summaries computed.')
 
-    # Add overall summary, data types summary & summary header for each species
-    descriptive_statistics = df.describe(include='all').to_string() 
-    summary += f"(1) Overall Descriptive Statistics:\n{descriptive_statistics}\n\n"
+    # II.
+    # Run save txt file function to save the summary in a txt file
+    with timed('save', analysis='summary'):
+        file_path = helpers.save_text_file('results', 'I.variables_summary.txt', result.to_text())
     
-    missing_values = df.isnull().sum().to_string()
-    summary += f"(2) Data Types Summary:\n{missing_values}\n\n"
+    # III.
+    # Display message box with "OK" and "Cancel" buttons, unless running in batch mode
+    notify_user(*NOTIFICATIONS['summary'], file_path, interactive)
     
-    print(f'\n\tOverall summary computed.')
+    # https://stackoverflow.com/questions/16676101/print-the-approval-sign-check-mark-u2713-in-python
+    log.info("\n\t\u2713 Descriptive summary function successfully finished.")
 
-    # II.
-    summary += f"(3) Summary for Each Species:\n\n"
+    return result
 
-    # Group the DataFrame by species & initialise counter for the below for loop
-    df_species = df.groupby('species')
-    counter = 0
+def descriptive_summary_stream(input_path, chunksize=100_000, interactive=True, spec=None):
+    '''
+    This function creates the same descriptive summary as descriptive_summary() for a CSV file which doesn't fit in memory, 
+    reading it in chunks of rows with describe_stream() from the core module, so the file is read once with bounded memory.
+    '''
 
-    # Iterate over each species and generate summary statistics
-    # Given we are dealing with strings the '+' sign will append the text to summary variable in each iteration
-    for species, group_df in df_species:
-        counter += 1
-        summary += f"3.{counter} Summary for {species}\n"
+    log.info(f"\nStarting {__name__}/descriptive_summary_stream()")
 
-        descriptive_statistics = group_df.describe(include='all').to_string() 
-        summary += f"a) Descriptive Statistics:\n{descriptive_statistics}\n\n" # Add descriptive statistics summary with pd.describe()
-        
-        missing_values = group_df.isnull().sum().to_string()
-        summary += f"b) Missing Values:\n{missing_values}\n\n"  # Add missing values summary with pd.isnull()
-        
-        unique_values = group_df.nunique().to_string()
-        summary += f"c) Unique Values:\n{unique_values}\n\n"  # Add unique values summary with pd.nunique()
-        summary += "\n\n"
-    
-    print(f'\tSpecies summary computed.')
+    with timed('compute', analysis='summary', input=input_path, chunksize=chunksize):
+        result = core.describe_stream(input_path, chunksize=chunksize, spec=spec)
+    log.info(f'\tOverall & species summaries computed from {input_path} in chunks of {chunksize} rows.')
 
-    # III.
     # Run save txt file function to save the summary in a txt file
-    file_path = helpers.save_text_file('results', 'I.variables_summary.txt', summary)
-    
-    # Display message box with "OK" and "Cancel" buttons
-    response = messagebox.askokcancel("Descriptive summary", "A text file with a descriptive summary of each variable will be saved in the results directory. Please click OK to open the file.")
+    with timed('save', analysis='summary'):
+        file_path = helpers.save_text_file('results', 'I.variables_summary.txt', result.to_text())
+    notify_user(*NOTIFICATIONS['summary'], file_path, interactive)
 
-    # IV.
-    # If response is True save & open the txt file, otherwise just save the txt file
-    if response:
-        file_path
-        print(f"\tDescriptive summaries added to the txt file.")
-        os.startfile(file_path)
-        print(f"\tUser opened the file.")
-    else:
-        file_path
-        print(f"\tDescriptive summaries added to the txt file.")
-        print(f"\tUser closed the pop-up.")
-    
-    # https://stackoverflow.com/questions/16676101/print-the-approval-sign-check-mark-u2713-in-python
-    print("\n\t\u2713 Descriptive summary function successfully finished.")
+    log.info("\n\t\u2713 Descriptive summary function successfully finished.")
+
+    return result
 
 
 # _____________________ OUTLIERS _____________________
-def outliers_summary(df):
+def outliers_summary(df, interactive=True, spec=None):
     '''
     This function computes a summary of outliers present in the Iris dataset by species, using the Inter Quartile Range (IQR) 
     approach to determine if an entry is an outlier. Given that the IQR measures the middle 50% of the data, outliers are 
@@ -169,459 +207,397 @@ def outliers_summary(df):
     https://www.geeksforgeeks.org/detect-and-remove-the-outliers-using-python/
     https://www.khanacademy.org/math/statistics-probability/summarizing-quantitative-data/box-whisker-plots/a/identifying-outliers-iqr-rule
     
-    I. Create a container for the DataFrame columns names which will be analysed for outliers, filtering out any categorical features.
-       https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.select_dtypes.html
+    I. Get the outliers from detect_outliers() in the core module, which computes the thresholds of all variables for all 
+       species in one pass, and format them as text, listing the indices of the outliers within each species.
     
-    II. Initialise outlier_summary as an empty list to store the outlier information for each species. Then start looping through 
-        each unique species in the df, filtering it for the current species. Bearing in mind that all iterations will have to be recorded,
-        we create empty arrays(lower/upper_array_agg) which will serve as containers to aggregate the outlier indices.
-
-    III. Compute the IQR calculation for each variable within each species using Numpy's where() function to identify the indices of outliers, 
-        which are stored in upper_array and lower_array. Then append each iteration to lower/upper_array_agg.
-        https://numpy.org/doc/stable/reference/generated/numpy.where.html
-        
-    IV. Create a final for loop to iterate through the combined list of variables and their corresponding outlier arrays created with zip().
-        If any outliers are found, the arrays are not empty and so the outlier information is appended to the summary list.
-        If no outliers are found, a message indicating no outliers is appended to the list.
-        https://realpython.com/python-zip-function/
-
-    V.  Compile the outliers_summary list items into one string before writing to file to avoid TypeError: write() argument must be str, not list.
-        Then, call the save_text_file() function from helpers.py module to save summary in a txt file with writer mode. 
+    II. Call the save_text_file() function from helpers.py module to save summary in a txt file with writer mode. 
         https://docs.python.org/3/library/functions.html#open
-        https://stackoverflow.com/questions/72626730/python-launch-text-file-in-users-default-text-editor
         https://docs.python.org/3/library/os.path.html
 
-    VI. Show message box prompting the user to choose to open the the file or not. As per Python documentation, 
-        askokcancel returns a boolean value, so we check if response is True(OK) to save & open the file using 
-        the file_path returned by save_text_file() function; if False the txt file will just be saved.
-        https://stackoverflow.com/questions/72626730/python-launch-text-file-in-users-default-text-editor
+    III. Show message box prompting the user to choose to open the the file or not with notify_user().
         https://docs.python.org/3/library/tkinter.messagebox.html
     '''
 
     # I. 
-    print(f"Starting {__name__}/outliers_summary()")
+    log.info(f"Starting {__name__}/outliers_summary()")
     
-    # Get the list of columns names in the DataFrame
-    variables = df.select_dtypes(include='number').columns
-    
-    # II.
-    # Initialise an empty list to store outlier information
-    outlier_summary = []  
-
-    # Iterate over unique species values
-    for species in df['species'].unique():
-
-        # Filter dataframe for the current species
-        df_species = df[df['species'] == species]
-        print(f'\n\tLooping through {species}...')
-        
-        outlier_summary.append(f'\n>>> Outlier summary for {species} <<<\n')
-
-        lower_array_agg = []
-        upper_array_agg = []
-
-        # III.
-        for var in variables: 
-            # Calculate the upper and lower limits
-            Q1 = df_species[var].quantile(0.25) # The 1st quartile is the value below which 25% of the data can be found
-            Q3 = df_species[var].quantile(0.75) # The 3rd quartile is the value below which 75% of the data falls
-
-            # Calculate the IQR, which measures the middle 50% of the data
-            IQR = Q3 - Q1
-
-            # Calculate the outlier thresholds as per the above formulas
-            # Any data point below/above these values are considered outliers
-            lower = Q1 - 1.5 * IQR
-            upper = Q3 + 1.5 * IQR
-            
-            # Create arrays of Boolean values indicating the outlier rows using Numpy's where() function
-            # to find indices of all data points where the variable does meet the threshold condition
-            upper_array = np.where(df_species[var] >= upper)[0]
-            lower_array = np.where(df_species[var] <= lower)[0]
-
-            lower_array_agg.append(lower_array)
-            upper_array_agg.append(upper_array)
-
-        # IV.
-        # Check if any of the arrays contain outliers and append accordingly to the list.
-        # Map and combine the variables and the arrays into a single iterable with zip() and loop through them 
-        for var, lower_array, upper_array in zip(variables, lower_array_agg, upper_array_agg):
-            
-            # If any of the arrays isn't empty, append the outlier information to the list
-            if len(lower_array) > 0 or len(upper_array) > 0:
-                outlier_summary.append(f'\n\t\tOutliers found for {var}: \n\t\t\tLower bound: {lower_array} \n\t\t\tUpper bound: {upper_array}\n')
-                print(f"\t\tOutlier summary for {var} appended to the array.")
-            
-            # If the arrays are empty, append a message stating so to maintain completeness 
-            else:
-                outlier_summary.append(f'\n\t\tNo outliers found for {var}\n')
-                print(f"\t\tOutlier summary for {var} appended to the array.")
-
-    # V.
-    # Compile the list items into one string before writing to file to avoid TypeError: write() argument must be str, not list
-    outlier_summary = ''.join(outlier_summary)
+    with timed('compute', analysis='outliers', rows=len(df)):
+        result = core.detect_outliers(df, spec)
+    log.info(f"\tOutlier summary computed for {result.species.nunique()} species.")
 
+    # II.
     # Run save txt file function to save the summary in a txt file
-    file_path = helpers.save_text_file('results', 'II.outliers_summary.txt', outlier_summary)
+    with timed('save', analysis='outliers'):
+        file_path = helpers.save_text_file('results', 'II.outliers_summary.txt', result.to_text())
     
-    # Display message box with "OK" and "Cancel" buttons
-    response = messagebox.askokcancel("Outlier summary", "A text file with an outlier summary by species will be saved in the results directory. Please click OK to open the file")
-
-    # VI.
-    # If response is True save & open the txt file, otherwise just save the txt file
-    if response:
-        file_path
-        print(f"\Outliers summary added to the txt file.")
-        os.startfile(file_path)
-        print(f"\tUser opened the file.")
-    else:
-        file_path
-        print(f"\tOutliers summary added to the txt file.")
-        print(f"\tUser closed the pop-up.")
+    # III.
+    # Display message box with "OK" and "Cancel" buttons, unless running in batch mode
+    notify_user(*NOTIFICATIONS['outliers'], file_path, interactive)
     
     # https://stackoverflow.com/questions/16676101/print-the-approval-sign-check-mark-u2713-in-python
-    print("\n\t\u2713 Descriptive summary function successfully finished.")
+    log.info("\n\t\u2713 Outliers summary function successfully finished.")
 
-def outliers_cleanup(df):
+    return result
+
+def outliers_cleanup(df, interactive=True, spec=None):
     '''
-    Using the same logic as outliers_summary(df), this function removes the outliers present in the Iris dataset for each of the species.
+    Using the same engine as outliers_summary(df), this function removes the outliers present in the Iris dataset for each of the species
+    and saves the cleaned DataFrame as a CSV file with the save_csv_file() function from helpers.py module.
     '''
 
     # I.
-    print(f"Starting {__name__}/outliers_cleanup()")
-    
-    # Get the list of columns names in the DataFrame
-    variables = df.select_dtypes(include='number').columns
-
-    # Initialise empty array to store indices of outlier rows
-    outlier_indices = []
-
-    # Iterate over unique species in the DataFrame
-    for species in df['species'].unique():
-        
-        # Filter dataframe for the current species
-        df_species = df[df['species'] == species]
-        print(f'\n\tLooping through {species}...')
-
-        for var in variables: 
-            # Calculate the upper and lower limits
-            Q1 = df_species[var].quantile(0.25)  # The 1st quartile is the value below which 25% of the data can be found
-            Q3 = df_species[var].quantile(0.75)  # The 3rd quartile is the value below which 75% of the data falls
-
-            # Calculate the IQR, which measures the middle 50% of the data
-            IQR = Q3 - Q1
-
-            # Calculate the outlier thresholds as per the above formulas
-            # Any data point below/above these values are considered outliers
-            lower = Q1 - 1.5 * IQR
-            upper = Q3 + 1.5 * IQR
-            
-            # Use Numpy's where function to get [indices] of upper/lower outliers & combined them
-            upper_outliers = np.where(df_species[var] >= upper)[0]
-            lower_outliers = np.where(df_species[var] <= lower)[0]
-            all_outliers = np.concatenate((upper_outliers, lower_outliers))
-            
-            # II.
-            # Collect all indices by mapping local indices in df_species back to the global indices in the original df 
-            # with iloc
-            # https://www.geeksforgeeks.org/python-extracting-rows-using-pandas-iloc/
-            global_outliers = df_species.iloc[all_outliers].index
-            
-            # Collect global outlier indices with extend() method to add multiple elements to a list
-            # Tried appending but it didn't work as it would add the entire list as a single element, 
-            # instead of adding each element of variable being looped to the list individually
-            # https://www.geeksforgeeks.org/append-extend-python/
-            outlier_indices.extend(global_outliers)
+    log.info(f"Starting {__name__}/outliers_cleanup()")
     
-    # III.
-    # Drop outliers from the original df
-    df = df.drop(index=outlier_indices)
+    with timed('compute', analysis='clean', rows=len(df)):
+        df = core.remove_outliers(df, spec)
     
-    # IV.
+    # II.
     # Run 'save_csv_file' function to save the cleaned DataFrame as a CSV file
-    file_path = helpers.save_csv_file('results', 'II.dataframe_cleaned.csv', df)
+    with timed('save', analysis='clean', rows=len(df)):
+        file_path = helpers.save_csv_file('results', 'II.dataframe_cleaned.csv', df)
     
-    # Display message box with "OK" and "Cancel" buttons
-    response = messagebox.askokcancel("Outliers cleanup", "A CSV file containing the Iris dataset without outliers will be saved in the results directory. Please click OK to open the file.")
-
-    # V.
-    # If response is True save & open the CSV file, otherwise just save the CSV
-    if response:
-        file_path
-        print(f"\tOutliers summary added to the txt file.")
-        os.startfile(file_path)
-        print(f"\tUser opened the file.")
-    else:
-        file_path
-        print(f"\tOutliers summary added to the txt file.")
-        print(f"\tUser closed the pop-up.")
+    # Display message box with "OK" and "Cancel" buttons, unless running in batch mode
+    notify_user(*NOTIFICATIONS['clean'], file_path, interactive)
     
     # https://stackoverflow.com/questions/16676101/print-the-approval-sign-check-mark-u2713-in-python
-    print("\n\t\u2713 Descriptive summary function successfully finished.")
+    log.info("\n\t\u2713 Outliers cleanup function successfully finished.")
 
     return df
         
 
+def cleaned_mask(df, spec=None):
+    '''
+    This function returns the boolean mask of the rows of df without outliers, which is the loader of the cleaned dataset.
+    The mask is persisted in results/II.dataframe_cleaned_mask.npz only as a cache: it's used if the key saved with it, made of 
+    the fingerprint of df and the DatasetSpec, is still the same, and is otherwise computed again with the same engine as 
+    outliers_cleanup() and saved, so that a stale file is never trusted.
+    '''
+
+    spec = spec or core.IRIS
+    key = cache.make_key(df, 'cleaned_mask', dataclasses.asdict(spec))
+
+    arrays = helpers.load_arrays('results', CLEANED_MASK_FILE)
+    if arrays is not None and str(arrays['key']) == key and len(arrays['mask']) == len(df):
+        mask = arrays['mask']
+        log.info(f"\tCleaned dataset mask loaded from its cache.")
+    else:
+        with timed('compute', analysis='cleaned', rows=len(df)):
+            mask = ~core.detect_outliers(df, spec).outlier_rows.to_numpy()
+        with timed('save', analysis='cleaned'):
+            helpers.save_arrays('results', CLEANED_MASK_FILE, {'key': np.array(key), 'mask': mask})
+
+    copy_size = core.memory_usage(df) * np.count_nonzero(mask) / max(len(df), 1)
+    log.info(f"\tCleaned dataset kept as a mask of {np.count_nonzero(mask)} rows "
+             f"({mask.nbytes / 1024:.1f} KB instead of about {copy_size / 1024:.1f} KB).")
+
+    return mask
+
+
 # _____________________ HISTOGRAM _____________________
-def generate_histogram(df, file_name):
+def generate_histogram(df, file_name, interactive=True, dpi=None, spec=None):
     '''
     This function saves a histogram subplot of each variable in the Iris flower dataset as a PNG file.
+    The figure is computed by histogram() in the core module and saved with save_plot() from helpers.py module, at dpi dots 
+    per inch if given, and then released with the figures module so that repeated clicks don't accumulate figures. The result 
+    is returned without its figure, as the figure is reused by the next plot.
     '''
 
-    print(f"Starting {__name__}/generate_histogram()")
-
-    # I. 
-    # Get the list of columns names in the DataFrame
-    variables = df.select_dtypes(include='number').columns
-    species = df['species'].unique()
-
-    # Dynamically calculate the number of rows and columns for the subplots
-    num_variables = len(variables)       # Check how many variables the dataset contains
-    num_rows = (num_variables + 1) // 2  # Ensure there are at least 2 plots per row
-    num_columns = 2                      # Create 2 columns
-    
-    # II.
-    # Create subplots
-    fig, axes = plt.subplots(num_rows, num_columns, figsize=(14, 8))
-    
-    # Plot histograms for each variable
-    # https://matplotlib.org/stable/gallery/color/named_colors.html#list-of-named-colors
-    # Flatten the axes array
-    axes = axes.flatten()
-
-    # Create a dict object mapping colours to the different species
-    # https://stackoverflow.com/questions/70356069/defining-and-using-a-dictionary-of-colours-in-a-plot
-    colors = {'setosa': 'black', 'versicolor': 'orange', 'virginica': 'green'}
-
-    # Refactor the same looping logic as in def outliers_summary(df):
-    # use zip() to map each element from the variables list to the corresponding item from the axes list, combining them into a single iterable;
-    # use enumerate() to add an index to these pairs.
-    # During each iteration index is the current loop counter, col is the current variable, and ax is the current subplot axis.
-    for index, (col, ax) in enumerate(zip(variables, axes)):
-        for spec in species:
-            # Filter dataframe for the current species
-            df_species = df[df['species'] == spec]
-            # Plot the histogram
-            ax.hist(df_species[col], bins=10, color=colors[spec], alpha=0.5, label=spec, edgecolor='black')
-        ax.set_title(col)
-        ax.set_xlabel('Value')
-        ax.set_ylabel('Frequency')
-        ax.legend(title='Species')
-    
-        print(f"\tHistograms have been computed.")
+    log.info(f"Starting {__name__}/generate_histogram()")
 
-        # Cleanup the remainder unused subplots
-        # https://napsterinblue.github.io/notes/python/viz/subplots/
-        if index + 1 >= num_variables:
-            [ax.set_visible(False) for ax in axes.flatten()[index+1:]]
-            break
-    
-    # Adjust layout & set subplot suptitle
-    plt.suptitle("\nDistribution of Variables in the Iris Dataset\n",fontsize=14)
-    plt.tight_layout()
+    # I.
+    with timed('compute', analysis='histograms', rows=len(df)):
+        result = core.histogram(df, spec=spec)
+    log.info(f"\tHistograms have been computed.")
 
-    # III.
-    # Call 'save_csv_file' function from helpers.py module to save the plot as a PNG
-    file_path = helpers.save_plot('results', file_name, fig)
+    # II.
+    # Call 'save_plot' function from helpers.py module to save the plot as a PNG
+    with timed('render', analysis='histograms'):
+        file_path = helpers.save_plot('results', file_name, result.figure, dpi=dpi)
     
-    # Display message box with "OK" and "Cancel" buttons
-    response = messagebox.askokcancel("Generate histograms", "A histogram of each variable will be plotted and saved in the results directory. Please click OK to open the file.")
-
-    # IV.
-    # If response is True save & open the PNG, otherwise just save the PNG
-    if response:
-        file_path
-        print(f"\tPlot saved as PNG.")
-        plt.show()
-        print(f"\tUser opened the plot.")
-    else:
-        file_path
-        print(f"\tPlot saved as PNG")
-        print(f"\tUser closed the pop-up.")
+    # Display message box with "OK" and "Cancel" buttons, unless running in batch mode
+    notify_user(*NOTIFICATIONS['histograms'], file_path, interactive, plot=True)
+    figures.release(result)
     
     # https://stackoverflow.com/questions/16676101/print-the-approval-sign-check-mark-u2713-in-python
-    print("\n\t\u2713 Histogram function successfully finished.")
+    log.info("\n\t\u2713 Histogram function successfully finished.")
 
-def generate_histogram_options(df,df_cleaned):
+    return result
+
+def generate_histogram_options(df,df_cleaned,run=None):
     '''
     Helper function triggered by menu.py (button IV in the GUI), displaying a message box which prompts the user 
     to generate histograms for each variable using either the original DataFrame (df) or the cleaned DataFrame (df_cleaned) 
     without outliers. Depending on the user's choice, it calls the generate_histogram() function with the corresponding DataFrame.
+    If a run callback is given (e.g. by the menu, which runs the analyses in the background), it's called with the analysis
+    name, the dataset chosen and its DataFrame instead.
     '''
 
+    from tkinter import messagebox
+
     response = messagebox.askyesno("Generate histogram", "Would you like to generate the histogram without the outliers?")
 
-    if response:
+    if run is not None:
+        if response:
+            run('histograms', 'cleaned', df_cleaned)
+        else:
+            run('histograms', 'original', df)
+    elif response:
         generate_histogram(df_cleaned, 'IV.histograms_cleaned.png')
     else:
         generate_histogram(df, 'IV.histograms_original.png')
 
 
 # _____________________ PAIRPLOT _____________________
-def generate_pairplot(df, file_name):
+def generate_pairplot(df, file_name, interactive=True, mode='auto', variables=None, dpi=None, spec=None):
     '''
     This function outputs a scatter plot of each pair of variables of the Iris dataset.
+    The figure is computed by pairplot() in the core module, with the given mode & subset of variables, and saved with save_plot() 
+    from helpers.py module, at dpi dots per inch if given, and then released (the result is returned without it). The time spent on the slowest panels is printed, 
+    so that slow variables can be left out.
     '''
 
     # I.
-    print(f"Starting {__name__}/generate_pairplot()")
-
-    # Plot a pairplot to analyse the interaction between the different variables
-    # https://python-charts.com/correlation/pairs-plot-seaborn/
-    sns.pairplot(df, hue="species", corner=False, kind="reg", plot_kws={'line_kws':{'color':'black'}})
-
-    # Adjust layout & set subplot suptitle
-    plt.suptitle("Attribute Pairs by Species\n\n", fontsize=14)
-    plt.tight_layout()
+    log.info(f"Starting {__name__}/generate_pairplot()")
 
-    print(f"\tHistograms have been computed.")
+    with timed('compute', analysis='pairplot', rows=len(df)):
+        result = core.pairplot(df, mode=mode, variables=variables, spec=spec)
+    log.info(f"\tPair scatter plots have been computed ({result.mode} mode, {result.sampled_rows} of {len(df)} rows drawn as points).")
+    for panel, seconds in sorted(result.timings.items(), key=lambda item: item[1], reverse=True)[:5]:
+        log.info(f"\t\t{panel:<32}{seconds * 1000:8.1f} ms")
 
     # II.
     # Call 'save_plot' function from helpers.py module to save the plot as a PNG
-    save_plot = helpers.save_plot('results', file_name, plt)
+    with timed('render', analysis='pairplot'):
+        file_path = helpers.save_plot('results', file_name, result.figure, dpi=dpi)
     
-    # Display message box with "OK" and "Cancel" buttons
-    response = messagebox.askokcancel("Generate pair scatter plot", "A scatter plot of each pair of variables will be created and saved in the results directory. Please click OK to open the file.")
-
-    # III.
-    # If response is True save & open the PNG, otherwise just save the PNG
-    if response:
-        save_plot
-        print(f"\tPlot saved as PNG.")
-        plt.show()
-        print(f"\tUser opened the plot.")
-    else:
-        save_plot
-        print(f"\tPlot saved as PNG")
-        print(f"\tUser closed the pop-up.")
+    # Display message box with "OK" and "Cancel" buttons, unless running in batch mode
+    notify_user(*NOTIFICATIONS['pairplot'], file_path, interactive, plot=True)
+    figures.release(result)
     
     # https://stackoverflow.com/questions/16676101/print-the-approval-sign-check-mark-u2713-in-python
-    print("\n\t\u2713 Pairplot function successfully finished.")
+    log.info("\n\t\u2713 Pairplot function successfully finished.")
+
+    return result
 
-def generate_pairplot_options(df,df_cleaned):
+def generate_pairplot_options(df,df_cleaned,run=None):
     '''
     Helper function triggered by menu.py (button III in the GUI), displaying a message box which prompts the user 
     to generate pair scatter plots using either the original DataFrame (df) or the cleaned DataFrame (df_cleaned) without outliers. 
     Depending on the user's choice, it calls the generate_pairplot() function with the corresponding DataFrame.
+    If a run callback is given (e.g. by the menu, which runs the analyses in the background), it's called with the analysis
+    name, the dataset chosen and its DataFrame instead.
     '''
 
+    from tkinter import messagebox
+
     response = messagebox.askyesno("Generate pair plot", "Would you like to generate the pair scatter plot without the outliers?")
 
-    if response:
+    if run is not None:
+        if response:
+            run('pairplot', 'cleaned', df_cleaned)
+        else:
+            run('pairplot', 'original', df)
+    elif response:
         generate_pairplot(df_cleaned, 'III.pairplot_cleaned.png')
     else:
         generate_pairplot(df, 'III.pairplot_original.png')
 
 
 # _____________________ PCA _____________________
-def perform_PCA(df, file_name):
+def perform_PCA(df, file_name, interactive=True, engine='full', dtype='float64', dpi=None, spec=None):
     '''
     This function computes a PCA and reduces the 4-dimensional Iris dataset to 2 dimensions/features, outputing 
     a scatter plot of the principal components making it easier to understand how are species distributed.
     https://www.turing.com/kb/guide-to-principal-component-analysis
     https://towardsdatascience.com/a-step-by-step-introduction-to-pca-c0d78e26a0dd
-    https://builtin.com/machine-learning/pca-in-python
-    https://saturncloud.io/blog/what-is-sklearn-pca-explained-variance-and-explained-variance-ratio-difference
     
-    I. Standardise the range of variables to analyse the contribution of each variable equally. This calculation
-       categorises the variables that are dominating the other variables of small ranges, preventing a biased result. 
-       The goal is to mimic a normal distribution by having a mean of 0 and a standard deviation of 1.
+    I. Compute the PCA with pca() from the core module, which standardises the variables, reduces them to 2 components and 
+       plots them in a scatter plot. The result also contains the explained variance ratio and the loadings of each component.
+       The engine ('full', 'randomized' or 'incremental') and the dtype ('float64' or 'float32') are passed to pca(), so that 
+       large datasets can be fitted in batches and with half the memory.
        https://scikit-learn.org/stable/modules/generated/sklearn.preprocessing.StandardScaler.html
 
-    II. Compute the PCA, reducing the dataset to 2 components/variables
-
-    III. Create new DataFrame with the variables created by sklearn when computing the PCA, concatenating it along the columns 
-         with the original df containing only the species column. Since both DataFrames have same number of rows and are concatenated 
-         along the columns, the original df filtered for species is added as a new column to pca_df. Therefore, this concat aligns 
-         the species datapoints with the respective PCA based on the index.
-
-    IV. Compute a scatter plot to visualise the PCA with a for loop through each species in the DataFrame, applying the same logic as 
-        in generate_histogram() function.
-
-    V.  Call the save_plot function from helpers.py module to save plot as a PNG file.
+    II. Call the save_plot function from helpers.py module to save plot as a PNG file (at dpi dots per inch if given), and save the fitted model (means, scales
+        & components) next to it with save_pca_model(), so that new observations can be projected without fitting again.
         https://docs.python.org/3/library/os.path.html
     
-    VI. Show message box prompting the user to choose to open the the file or not. As per Python documentation, 
-        askokcancel returns a boolean value, so we check if response is True(OK) to save & open the plot with plt.show(); if False the plot will just be saved.
+    III. Show message box prompting the user to choose to open the the file or not with notify_user(). If the user clicks OK, 
+         the plot is opened with plt.show(); otherwise the plot will just be saved. The figure is released afterwards, so the 
+         result is returned without it.
         https://docs.python.org/3/library/tkinter.messagebox.html
         https://anzeljg.github.io/rin2/book2/2405/docs/tkinter/tkMessageBox.html
     '''
 
-    # I.
-    # Standardise the data by scaling features into a normal distribution
-    columns = df.select_dtypes(include='number').columns
-    columns_array = df.loc[:, columns].values                       # Create a Numpy array containing the values of columns var before transformation as it doesn't support pandas DataFrames
-    columns_array = StandardScaler().fit_transform(columns_array)   # Standardise the data with sklearn StandardScaler()
-
-    # II.
-    # Compute the PCA, reducing the dataset to 2 components/variables
-    pca = PCA(n_components=2)
-    principal_components = pca.fit_transform(columns_array)
+    log.info(f"Starting {__name__}/perform_PCA()")
 
-    # III.
-    # Create new DataFrame with the variables created by sklearn when computing the PCA
-    pca_df = pd.DataFrame(data=principal_components, columns=['PCA_1', 'PCA_2'])
-    pca_df = pd.concat([pca_df, df[['species']]], axis=1)
-    print(f"\PCA has been computed & stored in a DataFrame.")
-
-    # IV. 
-    # Visualize the PCA result
-    # Create a dict object mapping colours to the different species
-    # https://stackoverflow.com/questions/70356069/defining-and-using-a-dictionary-of-colours-in-a-plot
-    colors = {'setosa': 'black', 'versicolor': 'orange', 'virginica': 'green'}
-    species = df['species'].unique()
-
-    # Define plot size
-    plt.figure(figsize=(8, 6))
-
-    # Loop through each species in the DataFrame, applying the same logic as in generate_histogram()
-    for spec in species:
-        # Filter dataframe for the current species
-        df_species = pca_df['species'] == spec
-        plt.scatter(pca_df.loc[df_species, 'PCA_1'],
-                    pca_df.loc[df_species, 'PCA_2'],
-                    color=colors[spec])
-
-    # Format scatterplot
-    plt.legend(species)
-    plt.xlabel('Principal Component #1')
-    plt.ylabel('Principal Component #2')
-    plt.title('Principal Component Analysis with 2 Elements\n')
-
-    print(f"\tHistograms have been computed.")
+    # I.
+    with timed('compute', analysis='pca', rows=len(df)):
+        result = core.pca(df, engine=engine, dtype=dtype, spec=spec)
+    log.info(f"\tPCA ({engine}, {dtype}) has been computed, explaining {result.explained_variance_ratio.sum():.1%} of the variance.")
 
     # II.
     # Call 'save_plot' function from helpers.py module to save the plot as a PNG
-    file_path = helpers.save_plot('results', file_name, plt)
+    with timed('render', analysis='pca'):
+        file_path = helpers.save_plot('results', file_name, result.figure, dpi=dpi)
+    save_pca_model(df, file_name, result.model)
     
-    # Display message box with "OK" and "Cancel" buttons
-    response = messagebox.askokcancel("Principal Componenent Analysis", "A scatter plot of the computed PCA will be created and saved in the results directory. Please click OK to open the file.")
-
     # III.
-    # If response is True save & open the PNG, otherwise just save the PNG
-    if response:
-        file_path
-        print(f"\tPlot saved as PNG.")
-        plt.show()
-        print(f"\tUser opened the plot.")
-    else:
-        file_path
-        print(f"\tPlot saved as PNG")
-        print(f"\tUser closed the pop-up.")
+    # Display message box with "OK" and "Cancel" buttons, unless running in batch mode
+    notify_user(*NOTIFICATIONS['pca'], file_path, interactive, plot=True)
+    figures.release(result)
     
     # https://stackoverflow.com/questions/16676101/print-the-approval-sign-check-mark-u2713-in-python
-    print("\n\t\u2713 Pairplot function successfully finished.")
+    log.info("\n\t\u2713 PCA function successfully finished.")
 
-def perform_PCA_options(df,df_cleaned):
+    return result
+
+def perform_PCA_options(df,df_cleaned,run=None):
     '''
     Helper function triggered by menu.py (button V in the GUI), displaying a message box which prompts the user 
     to generate a scatter plot with the PCA using either the original DataFrame (df) or the cleaned DataFrame (df_cleaned) without outliers. 
     Depending on the user's choice, it calls the generate_pairplot() function with the corresponding DataFrame.
+    If a run callback is given (e.g. by the menu, which runs the analyses in the background), it's called with the analysis
+    name, the dataset chosen and its DataFrame instead.
     '''
 
+    from tkinter import messagebox
+
     response = messagebox.askyesno("Compute PCA", "Would you like to perform the PCA without the outliers?")
 
-    if response:
+    if run is not None:
+        if response:
+            run('pca', 'cleaned', df_cleaned)
+        else:
+            run('pca', 'original', df)
+    elif response:
         perform_PCA(df_cleaned, 'V.PCA_cleaned.png')
     else:
-        perform_PCA(df, 'V.PCA_original.png')
\ No newline at end of file
+        perform_PCA(df, 'V.PCA_original.png')
+
+
+# _____________________ PCA MODEL _____________________
+def pca_model_file(file_name):
+    '''
+    This function returns the name of the file with the PCA model fitted for a PCA plot, e.g. V.PCA_original_model.npz.
+    '''
+
+    return os.path.splitext(file_name)[0] + '_model.npz'
+
+def save_pca_model(df, file_name, model):
+    '''
+    This function saves the fitted PCA model in the results directory as a compact NPZ file, together with the fingerprint
+    of the dataset it was fitted on, so that a stale model can be detected when it's loaded.
+    '''
+
+    model.fingerprint = cache.fingerprint(df)
+
+    return helpers.save_arrays('results', pca_model_file(file_name), model.to_arrays())
+
+def load_pca_model(file_name, df=None):
+    '''
+    This function loads the PCA model saved by perform_PCA() for a PCA plot, without importing scikit-learn.
+    If df is given, the model is only returned if it was fitted on the same data. Otherwise, or if there is no model, it returns None.
+    '''
+
+    arrays = helpers.load_arrays('results', pca_model_file(file_name))
+    if arrays is None:
+        return None
+
+    model = core.PCAModel.from_arrays(arrays)
+    if df is not None and model.fingerprint != cache.fingerprint(df):
+        return None
+
+    return model
+
+def project_observations(df, input_path, file_name='V.PCA_original.png', interactive=True, spec=None):
+    '''
+    This function projects new flower measurements onto the principal components of the PCA fitted on df.
+
+    I. Load the persisted model of the PCA plot. The model is only fitted (and saved) again if it's missing or was fitted
+       on different data, so that all the new observations are scored against the same, stable projection.
+
+    II. Read the new observations from a CSV file with the same measurement columns and project all of them at once with the 
+        vectorised transform() of the model, i.e. one matrix multiply instead of fitting the scaler & the PCA again.
+
+    III. Save the observations with their components as a CSV file & show the message box with notify_user().
+    '''
+
+    log.info(f"\nStarting {__name__}/project_observations()")
+
+    # I.
+    model = load_pca_model(file_name, df)
+    if model is None:
+        model, _ = core.fit_pca(df, spec=spec)
+        save_pca_model(df, file_name, model)
+        log.info(f"\tPCA model fitted & saved to {pca_model_file(file_name)}.")
+    else:
+        log.info(f"\tPCA model loaded from {pca_model_file(file_name)}.")
+
+    # II.
+    new_df = pd.read_csv(input_path)
+    with timed('compute', analysis='project', rows=len(new_df)):
+        projected = new_df.assign(**dict(zip(model.names, model.transform(new_df).T)))
+    log.info(f"\t{len(new_df)} observation(s) from {input_path} projected onto {len(model.names)} components.")
+
+    # III.
+    file_path = helpers.save_csv_file('results', 'V.PCA_projection.csv', projected)
+    notify_user(*NOTIFICATIONS['project'], file_path, interactive)
+
+    log.info("\n\t\u2713 Projection function successfully finished.")
+
+    return projected
+
+
+# _____________________ REPORT _____________________
+def generate_report(df, file_name='VI.report', formats=('txt', 'json', 'html'), interactive=True, params=None, spec=None):
+    '''
+    This function saves a report of the dataset with every analysis in each of the formats (txt, json & html), using the 
+    report module, so that other programs can read the results in JSON without parsing the text summaries.
+
+    I. Compute each analysis once with the core module and add its tables, structured results and figures to the sections 
+       of the report. The figures are rendered to PNG and closed as they are added. The params dict maps an analysis to its
+       keyword arguments, as in the pipeline, e.g. {'pca': {'engine': 'incremental'}}.
+
+    II. Render each format in a single pass into a buffer and save it with one write, as results/VI.report.txt, .json & .html. 
+        The HTML report embeds the figures, so that it can be opened or shared as a single file.
+
+    III. Show the message box prompting the user to open the last report saved (the HTML one by default) with notify_user().
+    '''
+
+    log.info(f"\nStarting {__name__}/generate_report()")
+
+    spec = spec or core.IRIS
+    params = params or {}
+    df = core.materialize(df)
+    document = report.Report(f"{spec.name.capitalize()} dataset analysis")
+
+    # I.
+    with timed('compute', analysis='report', rows=len(df)):
+        document.section('Dataset').append(('data', 'Description', {'dataset': spec.name, 'label': spec.label, 'rows': len(df), 
+                                                                   'columns': spec.columns(df)}, None))
+        document.section('Descriptive Summary').extend(report.summary_blocks(core.describe(df, spec)))
+        document.section('Outliers').extend(report.outlier_blocks(core.detect_outliers(df, spec)))
+
+        options, render = zip(*(figures.split_options(params.get(analysis)) for analysis in ['histograms', 'pairplot', 'pca']))
+        histograms = core.histogram(df, spec=spec, **options[0])
+        pairplot = core.pairplot(df, spec=spec, **options[1])
+        document.section('Plots').extend([report.figure_block('Histograms', histograms.figure, **render[0]),
+                                          report.figure_block(f'Pair Plot ({pairplot.mode})', pairplot.figure, **render[1])])
+
+        pca = core.pca(df, spec=spec, **options[2])
+        variance = pd.Series(pca.explained_variance_ratio, index=pca.model.names, name='explained_variance_ratio')
+        document.section('Principal Component Analysis').extend([('table', 'Explained Variance Ratio', variance), 
+                                                                 ('table', 'Loadings', pca.loadings),
+                                                                 report.figure_block('Principal Components', pca.figure, **render[2])])
+    log.info(f"\tReport computed with {len(document.sections)} sections.")
+
+    # II.
+    with timed('save', analysis='report'):
+        file_paths = document.save('results', file_name, formats)
+
+    # III.
+    notify_user(*NOTIFICATIONS['report'], file_paths[-1], interactive)
+
+    log.info("\n\t\u2713 Report function successfully finished.")
+
+    return document